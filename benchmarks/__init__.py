@@ -0,0 +1,7 @@
+"""
+Benchmarks for the compression service.
+
+Run them from the project root, for example::
+
+    python -m benchmarks.concurrency
+"""
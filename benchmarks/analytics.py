@@ -0,0 +1,67 @@
+"""
+Analytics summary: per-row model properties vs vectorized NumPy.
+
+Fills a throwaway database with compression results, then computes the
+space-saved percentiles per size bucket and throughput per codec two ways:
+looping over model instances and their compression_percentage property,
+and compression.analytics (values_list() columns into NumPy arrays, the
+full dashboard summary). Also times a cached read of the summary.
+
+Usage::
+
+    python -m benchmarks.analytics --rows 1000000
+"""
+import argparse
+import statistics
+import time
+from collections import defaultdict
+
+from .common import benchmark_environment, print_table
+from .export import fill_history
+
+
+def per_row_summary(queryset):
+    """Space-saved quartiles per size bucket and throughput per codec, one model instance at a time"""
+    from compression.analytics import MIB, SIZE_BUCKET_EDGES
+
+    saved, input_bytes, seconds = defaultdict(list), defaultdict(float), defaultdict(float)
+    for result in queryset.select_related('file').iterator(chunk_size=2000):
+        size = result.file.original_file_size
+        saved[sum(size >= edge for edge in SIZE_BUCKET_EDGES)].append(result.compression_percentage)
+        input_bytes[result.codec] += size
+        seconds[result.codec] += result.compression_time
+    return (
+        {bucket: statistics.quantiles(values, n=10) for bucket, values in saved.items() if len(values) > 1},
+        {codec: input_bytes[codec] / seconds[codec] / MIB for codec in input_bytes if seconds[codec]},
+    )
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000, help='results in the history')
+    args = parser.parse_args()
+
+    with benchmark_environment():
+        from compression import analytics
+        from compression.models import CompressionResult
+
+        fill_history(args.rows)
+        queryset = CompressionResult.objects.all()
+        rows = [
+            ('per-row properties', f'{timed(per_row_summary, queryset):.2f}'),
+            ('vectorized', f'{timed(analytics.summary, refresh=True):.2f}'),
+            ('cached', f'{timed(analytics.summary):.4f}'),
+        ]
+
+    print(f'{args.rows} results\n')
+    print_table(('summary', 'seconds'), rows)
+
+
+if __name__ == '__main__':
+    main()
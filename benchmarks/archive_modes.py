@@ -0,0 +1,48 @@
+"""
+Multi-file archives: one solid LZMA stream vs one stream per member in parallel.
+
+A synthetic bundle of unrelated research files is compressed in both modes,
+and with the automatic choice, reporting wall time, throughput and ratio.
+
+Usage::
+
+    python -m benchmarks.archive_modes --members 8 --size 2097152 --workers 4
+"""
+import argparse
+import os
+import tempfile
+
+from .common import print_table, setup_django, write_research_bundle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=8, help='files in the bundle')
+    parser.add_argument('--size', type=int, default=2 * 1024 * 1024, help='bytes per file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='threads for parallel mode')
+    parser.add_argument('--preset', type=int, default=6, help='LZMA preset')
+    args = parser.parse_args()
+
+    setup_django()
+    from compression import engine
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='lzma-bench-') as directory:
+        members = write_research_bundle(directory, args.members, args.size)
+        total = sum(os.path.getsize(path) for path, _ in members)
+        for mode in (engine.ARCHIVE_SOLID, engine.ARCHIVE_PARALLEL, engine.ARCHIVE_AUTO):
+            outcome = engine.compress_many(
+                members, os.path.join(directory, mode), preset=args.preset, mode=mode, workers=args.workers
+            )
+            rows.append((
+                mode, outcome.archive_mode, f'{outcome.compression_time:.2f}',
+                f'{total / outcome.compression_time / 1024 / 1024:.1f}',
+                f'{total / outcome.compressed_file_size:.2f}',
+            ))
+
+    print(f'{args.members} files, {total / 1024 / 1024:.1f} MiB, preset {args.preset}, {args.workers} workers\n')
+    print_table(('mode', 'used', 'wall s', 'MiB/s', 'ratio'), rows)
+
+
+if __name__ == '__main__':
+    main()
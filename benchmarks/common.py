@@ -0,0 +1,97 @@
+"""
+Shared setup for the benchmark scripts.
+
+Each benchmark runs against a throwaway test database and a temporary
+MEDIA_ROOT, so it never touches db.sqlite3 or real uploads.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django():
+    """Configure and initialise Django for a benchmark run"""
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'compressor.settings')
+    os.environ.setdefault('DJANGO_SECRET_KEY', 'benchmark-only-secret-key')
+
+    import django
+    django.setup()
+
+
+@contextmanager
+def benchmark_environment():
+    """Create a test database and temporary media root for the duration of a run"""
+    setup_django()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    media_root = tempfile.mkdtemp(prefix='lzma-bench-')
+    if connection.vendor == 'sqlite':
+        # A file database, the shared-cache in-memory one locks whole tables across threads
+        connection.settings_dict['TEST']['NAME'] = os.path.join(media_root, 'bench.sqlite3')
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    settings.MEDIA_ROOT = media_root
+    try:
+        yield media_root
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def print_table(headers, rows):
+    """Print rows as a plain aligned text table"""
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    line = '  '.join(f'{{:<{width}}}' for width in widths)
+    print(line.format(*headers))
+    print(line.format(*['-' * width for width in widths]))
+    for row in rows:
+        print(line.format(*row))
+
+
+def write_research_bundle(directory, members=8, member_size=2 * 1024 * 1024, seed=0):
+    """
+    Write a mixed bundle of synthetic research files (CSV tables, JSON logs,
+    float dumps, notes) into directory, return a list of (path, name) pairs.
+    """
+    import json
+    import random
+    import struct
+
+    rng = random.Random(seed)
+    kinds = ['csv', 'jsonl', 'f32', 'txt']
+    words = ['sample', 'reading', 'sensor', 'calibration', 'baseline', 'drift', 'offset', 'trial']
+    bundle = []
+    for index in range(members):
+        kind = kinds[index % len(kinds)]
+        name = f'{kind}_{index:03d}.{"bin" if kind == "f32" else kind}'
+        parts, size = [], 0
+        if kind == 'csv':
+            parts.append(b'timestamp,station,temperature,humidity,pressure\n')
+        value = rng.uniform(0, 100)
+        while size < member_size:
+            value += rng.gauss(0, 0.5)
+            if kind == 'csv':
+                part = f'{1700000000 + size},{rng.randint(1, 20)},{value:.3f},{rng.uniform(20, 80):.2f},{rng.gauss(1013, 4):.1f}\n'.encode()
+            elif kind == 'jsonl':
+                part = (json.dumps({'event': rng.choice(words), 'trial': rng.randint(1, 500), 'value': round(value, 4)}) + '\n').encode()
+            elif kind == 'f32':
+                part = struct.pack('<64f', *(value + rng.gauss(0, 0.01) for _ in range(64)))
+            else:
+                part = (' '.join(rng.choice(words) for _ in range(12)) + '.\n').encode()
+            parts.append(part)
+            size += len(part)
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(b''.join(parts))
+        bundle.append((path, name))
+    return bundle
@@ -0,0 +1,296 @@
+"""
+Concurrent-connection capacity: WSGI thread pool vs ASGI event loop.
+
+Slow clients are simulated on both paths. A slow download client sleeps
+after every body chunk it receives; a slow upload client sleeps before every
+chunk of the request body it sends. The WSGI application is driven by a fixed
+pool of threads, the way a threaded WSGI server would run it, so each slow
+connection pins one thread. The ASGI application is driven by one event loop
+with every connection as a task.
+
+Usage::
+
+    python -m benchmarks.concurrency --connections 64 --threads 8 --delay 0.05
+"""
+import argparse
+import asyncio
+import io
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import benchmark_environment, print_table
+
+HOST = 'testserver'
+
+
+class ConnectionTracker:
+    """Track how many connections are being served at the same time"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.latencies = []
+        self.started = time.perf_counter()
+
+    def enter(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def leave(self):
+        # Latency counts from the moment every client connected, including time queued for a thread
+        with self.lock:
+            self.active -= 1
+            self.latencies.append(time.perf_counter() - self.started)
+
+
+class SlowInput(io.RawIOBase):
+    """wsgi.input that delivers the request body slowly"""
+
+    def __init__(self, body, chunk_size, delay):
+        self.body = io.BytesIO(body)
+        self.chunk_size = chunk_size
+        self.delay = delay
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        time.sleep(self.delay)
+        if size is None or size < 0:
+            size = self.chunk_size
+        return self.body.read(min(size, self.chunk_size))
+
+    def readline(self, size=-1):
+        return self.body.readline(size)
+
+
+def make_user_session():
+    """Create a user and return (user, cookie header value, csrf token)"""
+    from django.contrib.auth.models import User
+    from django.middleware.csrf import CSRF_ALLOWED_CHARS
+    from django.test import Client
+    from django.utils.crypto import get_random_string
+
+    user = User.objects.create_user(
+        username='bench@example.com', email='bench@example.com', password='benchpass123'
+    )
+    client = Client()
+    client.force_login(user)
+    csrf_token = get_random_string(32, CSRF_ALLOWED_CHARS)
+    cookie = f"sessionid={client.cookies['sessionid'].value}; csrftoken={csrf_token}"
+    return user, cookie, csrf_token
+
+
+def make_artifacts(user, count, size):
+    """Create count compressed artifacts ready for download, return their File ids"""
+    import os
+
+    from django.conf import settings
+
+    from compression.models import CompressionResult, File
+
+    compressed_dir = os.path.join(settings.MEDIA_ROOT, 'compressed', str(user.id))
+    os.makedirs(compressed_dir, exist_ok=True)
+    payload = os.urandom(size)
+    file_ids = []
+    for i in range(count):
+        compressed_filename = f'artifact_{time.time_ns()}_{i}.xz'
+        with open(os.path.join(compressed_dir, compressed_filename), 'wb') as f:
+            f.write(payload)
+        file_record = File.objects.create(
+            user=user, original_filename=f'artifact_{i}', original_file_size=size, file_path=''
+        )
+        CompressionResult.objects.create(
+            file=file_record, compressed_filename=compressed_filename, compressed_file_size=size,
+            compression_ratio=0.0, compression_time=0.0, download_link=''
+        )
+        file_ids.append(file_record.id)
+    return file_ids
+
+
+def make_upload_body(name, size):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+
+    content = (b'benchmark upload line of research data\n' * (size // 39 + 1))[:size]
+    body = encode_multipart(BOUNDARY, {'files': SimpleUploadedFile(name, content)})
+    return body, MULTIPART_CONTENT
+
+
+def wait_for_jobs(timeout=300):
+    """Wait until the background compression jobs queued by uploads have finished"""
+    from compression.models import CompressionJob
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not CompressionJob.objects.exclude(status__in=CompressionJob.FINISHED_STATUSES).exists():
+            return
+        time.sleep(0.1)
+
+
+def run_wsgi(requests, threads, delay, chunk_size):
+    """Serve requests through the WSGI app on a fixed thread pool"""
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+    tracker = ConnectionTracker()
+
+    def serve(request):
+        method, path, headers, body = request
+        tracker.enter()
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': HOST,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': SlowInput(body, chunk_size, delay) if body else io.BytesIO(b''),
+            'wsgi.errors': io.StringIO(),
+        }
+        for name, value in headers.items():
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            else:
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        status_holder = []
+        result = application(environ, lambda status, response_headers: status_holder.append(status))
+        try:
+            for _ in result:
+                time.sleep(delay)  # Slow client reading the response
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        tracker.leave()
+        return status_holder[0]
+
+    start = tracker.started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(serve, requests))
+    return time.perf_counter() - start, tracker, statuses
+
+
+def run_asgi(requests, delay, chunk_size):
+    """Serve requests through the ASGI app, one task per connection"""
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+    tracker = ConnectionTracker()
+
+    async def serve(request):
+        method, path, headers, body = request
+        tracker.enter()
+        finished = asyncio.Event()
+        pending = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b'']
+        status_holder = []
+
+        async def receive():
+            if pending:
+                if body:
+                    await asyncio.sleep(delay)  # Slow client sending the request
+                chunk = pending.pop(0)
+                return {'type': 'http.request', 'body': chunk, 'more_body': bool(pending)}
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status_holder.append(message['status'])
+            elif message['type'] == 'http.response.body':
+                await asyncio.sleep(delay)  # Slow client reading the response
+                if not message.get('more_body'):
+                    finished.set()
+
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', HOST.encode()), (b'content-length', str(len(body)).encode())]
+            + [(name.encode(), value.encode()) for name, value in headers.items()],
+            'client': ('127.0.0.1', 50000),
+            'server': (HOST, 80),
+        }
+        await application(scope, receive, send)
+        tracker.leave()
+        return status_holder[0]
+
+    async def serve_all():
+        return await asyncio.gather(*(serve(request) for request in requests))
+
+    start = tracker.started = time.perf_counter()
+    statuses = asyncio.run(serve_all())
+    return time.perf_counter() - start, tracker, statuses
+
+
+def build_requests(kind, count, user, cookie, csrf_token, size):
+    from django.urls import reverse
+
+    headers = {'cookie': cookie}
+    if kind == 'download':
+        return [
+            ('GET', reverse('download_compressed_file', kwargs={'file_id': file_id}), headers, b'')
+            for file_id in make_artifacts(user, count, size)
+        ]
+    requests = []
+    for i in range(count):
+        # Distinct names, concurrent uploads of one name in the same second would collide
+        body, content_type = make_upload_body(f'bench_{time.time_ns()}_{i}.txt', size)
+        upload_headers = dict(headers, **{'content-type': content_type, 'x-csrftoken': csrf_token})
+        requests.append(('POST', reverse('dashboard'), upload_headers, body))
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=64, help='concurrent slow clients per run')
+    parser.add_argument('--threads', type=int, default=8, help='WSGI server threads')
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds a slow client waits per chunk')
+    parser.add_argument('--size', type=int, default=512 * 1024, help='bytes per download/upload')
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024, help='bytes per slow-client chunk')
+    args = parser.parse_args()
+
+    with benchmark_environment():
+        user, cookie, csrf_token = make_user_session()
+        rows = []
+        for kind in ('download', 'upload'):
+            for server in ('wsgi', 'asgi'):
+                requests = build_requests(kind, args.connections, user, cookie, csrf_token, args.size)
+                if server == 'wsgi':
+                    elapsed, tracker, statuses = run_wsgi(requests, args.threads, args.delay, args.chunk_size)
+                else:
+                    elapsed, tracker, statuses = run_asgi(requests, args.delay, args.chunk_size)
+                if kind == 'upload':
+                    # Uploads return once queued, let compression finish before the next run
+                    wait_for_jobs()
+                ok = sum(1 for status in statuses if str(status).startswith('200'))
+                rows.append((
+                    kind, server, f'{ok}/{len(requests)}', tracker.peak,
+                    f'{elapsed:.2f}', f'{len(requests) / elapsed:.1f}',
+                    f'{statistics.median(tracker.latencies) * 1000:.0f}',
+                    f'{max(tracker.latencies) * 1000:.0f}',
+                ))
+
+    print(f'{args.connections} slow clients, {args.delay * 1000:.0f} ms per {args.chunk_size // 1024} KiB chunk, '
+          f'{args.size // 1024} KiB per transfer, WSGI threads={args.threads}\n')
+    print_table(
+        ('transfer', 'server', 'ok', 'peak conns', 'wall s', 'conn/s', 'p50 ms', 'max ms'),
+        rows,
+    )
+
+
+if __name__ == '__main__':
+    main()
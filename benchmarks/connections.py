@@ -0,0 +1,132 @@
+"""
+Requests per second with per-request vs persistent database connections.
+
+Logged-in clients poll a job's progress through the WSGI application on a
+thread pool, while a background writer keeps updating job rows the way
+running compression jobs do. The same load runs twice against SQLite:
+
+- per-request: the old settings, a new connection for every request
+  (CONN_MAX_AGE 0) and the default rollback journal
+- persistent: the current settings, connections kept across requests with
+  health checks, WAL so the writer doesn't block readers, a busy timeout
+  and IMMEDIATE transactions
+
+Usage::
+
+    python -m benchmarks.connections --requests 2000 --threads 8
+"""
+import argparse
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import benchmark_environment, print_table
+from .concurrency import HOST, make_user_session
+
+MODES = {
+    'per-request': {
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': False,
+        'OPTIONS': {'init_command': 'PRAGMA journal_mode=DELETE'},
+    },
+    'persistent': None,  # As configured in compressor.settings
+}
+
+
+def use_mode(mode, configured):
+    """Point new connections at the settings of mode and drop the current ones"""
+    from django.db import connections
+
+    settings_dict = connections.settings['default']
+    settings_dict.update(configured if MODES[mode] is None else MODES[mode])
+    connections.close_all()
+
+
+def run(application, requests, threads, cookie, path, writes):
+    """Serve requests GETs of path on threads while writes() runs, return (seconds, statuses, rows written)"""
+    def serve(_):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': HOST,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_COOKIE': cookie,
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(b''),
+            'wsgi.errors': io.StringIO(),
+        }
+        status_holder = []
+        result = application(environ, lambda status, response_headers: status_holder.append(status))
+        try:
+            for _ in result:
+                pass
+        finally:
+            result.close()
+        return status_holder[0]
+
+    stop = threading.Event()
+    written = []
+    writer = threading.Thread(target=writes, args=(stop, written))
+    writer.start()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            statuses = list(pool.map(serve, range(requests)))
+    finally:
+        stop.set()
+        writer.join()
+    return time.perf_counter() - start, statuses, len(written)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='progress polls per mode')
+    parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+    parser.add_argument('--write-interval', type=float, default=0.005, help='seconds between job row updates')
+    args = parser.parse_args()
+
+    with benchmark_environment():
+        from django.core.wsgi import get_wsgi_application
+        from django.db import close_old_connections, connections
+        from django.urls import reverse
+
+        from compression.models import CompressionJob
+
+        configured = {
+            key: connections.settings['default'][key] for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS', 'OPTIONS')
+        }
+        user, cookie, _ = make_user_session()
+        jobs = [CompressionJob.objects.create(user=user) for _ in range(8)]
+        path = reverse('compression_progress', kwargs={'job_id': jobs[0].id})
+        application = get_wsgi_application()
+
+        def writes(stop, written):
+            # A running job saves its progress every few percent
+            while not stop.is_set():
+                close_old_connections()
+                job = jobs[len(written) % len(jobs)]
+                CompressionJob.objects.filter(pk=job.pk).update(progress=len(written) % 100)
+                written.append(job.pk)
+                time.sleep(args.write_interval)
+            connections.close_all()
+
+        rows = []
+        for mode in MODES:
+            use_mode(mode, configured)
+            seconds, statuses, write_count = run(application, args.requests, args.threads, cookie, path, writes)
+            failed = sum(not status.startswith('200') for status in statuses)
+            rows.append((
+                mode, f'{args.requests / seconds:.0f}', f'{seconds:.2f}', failed, f'{write_count / seconds:.0f}'
+            ))
+        use_mode('persistent', configured)
+
+    print(f'{args.requests} progress polls on {args.threads} threads\n')
+    print_table(('connections', 'requests/s', 'seconds', 'failed', 'writes/s'), rows)
+
+
+if __name__ == '__main__':
+    main()
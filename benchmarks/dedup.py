@@ -0,0 +1,114 @@
+"""
+Chunk store deduplication: a user's runs compressed complete vs deduplicated.
+
+Writes successive runs of an experiment, each with the same reference table,
+the run's own readings and the log so far (appended to by every run). Every
+run is compressed once complete (engine.compress_single) and once against
+the chunks of the runs before it, the way compression.dedup stores uploads
+(engine.compress_deduplicated). Also times rebuilding the last run from its
+manifest, which is what its download does.
+
+Usage::
+
+    python -m benchmarks.dedup --runs 6 --table-rows 200000 --readings 20000
+"""
+import argparse
+import io
+import lzma
+import os
+import random
+import tempfile
+import time
+
+from .common import print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=6, help='uploads of the experiment')
+    parser.add_argument('--table-rows', type=int, default=200000, help='rows of the reference table every run holds')
+    parser.add_argument('--readings', type=int, default=20000, help='rows of its own each run adds')
+    args = parser.parse_args()
+
+    setup_django()
+    from compression import dedup, engine, manifest, versions
+
+    rng = random.Random(0)
+    table = ''.join(
+        f'{i},{rng.choice("ACGT") * rng.randint(4, 12)},{rng.random():.6f}\n' for i in range(args.table_rows)
+    ).encode()
+    log = b''
+    stored, artifacts = {}, {}  # The chunk store: digest -> (run, offset), and each run's artifact
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for run in range(1, args.runs + 1):
+            readings = ''.join(
+                f'{run},{i},{rng.gauss(20, 3):.4f},{rng.gauss(5, 1):.4f}\n' for i in range(args.readings)
+            ).encode()
+            log += ''.join(f'run {run} step {i}: ok\n' for i in range(2000)).encode()
+            content = f'# run {run}\n'.encode() + table + readings + log
+            path = os.path.join(directory, f'run{run}.csv')
+            with open(path, 'wb') as f:
+                f.write(content)
+
+            full = engine.compress_single(path, f'run{run}.csv', os.path.join(directory, f'full{run}'))
+
+            started = time.perf_counter()
+            chunks = manifest.chunk_file(path)
+            records = manifest.layout(chunks, stored)
+            deduplicated = sum(record.size for record in records if record.source is not None)
+            chunking_seconds = time.perf_counter() - started
+            if deduplicated >= dedup.MIN_SHARE * len(content):
+                kept = engine.compress_deduplicated(
+                    path, f'run{run}.csv', os.path.join(directory, f'dedup{run}'), records
+                )
+            else:
+                kept, records = full, None
+            artifacts[run] = kept.compressed_path
+
+            position = 0
+            for chunk, record in zip(chunks, records or [None] * len(chunks)):
+                if record is None:
+                    stored.setdefault(chunk.digest, (run, position))
+                elif record.source is None:
+                    stored.setdefault(chunk.digest, (run, record.offset))
+                position += chunk.size
+
+            rows.append((
+                run, len(content), full.compressed_file_size, f'{full.compression_time:.2f}',
+                f'{len(content) / max(len(content) - deduplicated, 1):.1f}x', kept.compressed_file_size,
+                f'{kept.compression_time + chunking_seconds:.2f}'
+            ))
+
+        # Rebuild the last run from its manifest, the referenced chunks read from the other artifacts
+        started = time.perf_counter()
+        readers = {}
+
+        def read_reference(source, offset, size):
+            source = source or args.runs  # manifest.SELF
+            if source not in readers:
+                # Decompressed once into a file to seek in, as versions.spool() does for a download
+                readers[source] = open(versions.spool(artifacts[source], directory), 'rb')
+            readers[source].seek(offset)
+            return readers[source].read(size)
+
+        with lzma.open(artifacts[args.runs]) as f:
+            rebuilt = f.read()
+        if rebuilt.startswith(manifest.MAGIC):
+            rebuilt = b''.join(manifest.decode(io.BytesIO(rebuilt), read_reference))
+        rebuild_seconds = time.perf_counter() - started
+        for reader in readers.values():
+            reader.close()
+        assert rebuilt == content
+
+    print(f'{args.runs} runs, {len(table)} bytes of reference table each\n')
+    print_table(('run', 'bytes', 'complete', 'seconds', 'dedup ratio', 'stored (dedup)', 'seconds'), rows)
+    full_total, kept_total = sum(row[2] for row in rows), sum(row[5] for row in rows)
+    full_seconds, kept_seconds = sum(float(row[3]) for row in rows), sum(float(row[6]) for row in rows)
+    print(f'\nstorage: {full_total} -> {kept_total} bytes ({full_total / kept_total:.1f}x smaller)')
+    print(f'compression time: {full_seconds:.2f} -> {kept_seconds:.2f} s')
+    print(f'rebuilding run {args.runs} from its manifest: {rebuild_seconds:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
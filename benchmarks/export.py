@@ -0,0 +1,106 @@
+"""
+History export: streamed in chunks vs built as one list.
+
+Fills a throwaway database with compression results for one user, then
+exports them as CSV two ways: the naive way, loading every result with its
+file into a list and writing the whole document, and through
+compression.export (values_list() rows in chunks, one line at a time).
+Reports the time to the first byte, the total time and the peak traced
+memory of each.
+
+Usage::
+
+    python -m benchmarks.export --rows 500000
+"""
+import argparse
+import csv
+import io
+import time
+import tracemalloc
+
+from .common import benchmark_environment, print_table
+
+
+def fill_history(rows, batch_size=10000):
+    """Create a user with rows results, return the user"""
+    from django.contrib.auth.models import User
+
+    from compression.models import CompressionResult, File
+
+    user = User.objects.create_user(username='bench@example.com', email='bench@example.com', password='benchpass123')
+    for start in range(0, rows, batch_size):
+        count = min(batch_size, rows - start)
+        files = File.objects.bulk_create_with_ids([
+            File(user=user, original_filename=f'dataset_{start + index:07d}.csv', original_file_size=1_000_000,
+                 file_path='', sha256='0' * 64)
+            for index in range(count)
+        ])
+        CompressionResult.objects.bulk_create([
+            CompressionResult(
+                file=file, compressed_filename=f'{file.original_filename}.xz', compressed_file_size=120_000,
+                compression_ratio=88.0, compression_time=0.4, download_link='', compressed_sha256='0' * 64,
+                cpu_user_time=0.38, cpu_system_time=0.02, peak_memory=94_000_000, bytes_read=1_000_000,
+                bytes_written=120_000,
+            )
+            for file in files
+        ])
+    return user
+
+
+def naive_export(queryset):
+    """Every result as a model instance first, then the whole CSV document"""
+    from compression.export import EXPORT_COLUMNS, HEADER
+
+    results = list(queryset.select_related('file', 'file__user').order_by('pk'))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER)
+    for result in results:
+        row = []
+        for _, lookup in EXPORT_COLUMNS:
+            value = result
+            for attribute in lookup.split('__'):
+                value = getattr(value, attribute)
+            row.append(value)
+        writer.writerow(row)
+    yield buffer.getvalue()
+
+
+def measure(stream):
+    """(seconds to first chunk, total seconds, bytes, peak traced MiB) of consuming stream"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in stream:
+        if first is None:
+            first = time.perf_counter() - started
+        size += len(chunk)
+    total = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first, total, size, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='results in the exported history')
+    args = parser.parse_args()
+
+    with benchmark_environment():
+        from compression import export
+        from compression.models import CompressionResult
+
+        user = fill_history(args.rows)
+        queryset = CompressionResult.objects.filter(file__user=user)
+        rows = []
+        for name, stream in (('list', naive_export(queryset)), ('streamed', export.iter_csv(queryset))):
+            first, total, size, peak = measure(stream)
+            rows.append((name, f'{first:.3f}', f'{total:.2f}', f'{size / 1024 / 1024:.1f}', f'{peak:.1f}'))
+
+    print(f'{args.rows} results\n')
+    print_table(('export', 'first byte s', 'total s', 'MiB', 'peak MiB'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Solid archives: members in upload order vs grouped by type and similarity.
+
+The bundle mixes CSV tables, JSON logs, float dumps and notes, and every
+file also appears as a slightly edited re-run. Upload order is shuffled, the
+way files end up when picked from several folders. The total is sized past
+the LZMA dictionary (8 MiB at preset 6) so distance between related members
+matters.
+
+Usage::
+
+    python -m benchmarks.member_ordering --members 12 --size 1048576
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from .common import print_table, setup_django, write_research_bundle
+
+
+def add_reruns(members, seed=0):
+    """Write an edited copy of every member next to it, return all members shuffled"""
+    rng = random.Random(seed)
+    reruns = []
+    for path, name in members:
+        with open(path, 'rb') as f:
+            data = bytearray(f.read())
+        # A re-run changes a few scattered regions of the output
+        for _ in range(20):
+            offset = rng.randrange(len(data))
+            data[offset:offset + 64] = rng.randbytes(64)
+        rerun_name = f'rerun_{name}'
+        rerun_path = os.path.join(os.path.dirname(path), rerun_name)
+        with open(rerun_path, 'wb') as f:
+            f.write(data)
+        reruns.append((rerun_path, rerun_name))
+    bundle = members + reruns
+    rng.shuffle(bundle)
+    return bundle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=12, help='distinct files before re-runs')
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='bytes per file')
+    parser.add_argument('--preset', type=int, default=6, help='LZMA preset')
+    args = parser.parse_args()
+
+    setup_django()
+    from compression import engine
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='lzma-bench-') as directory:
+        members = add_reruns(write_research_bundle(directory, args.members, args.size))
+        total = sum(os.path.getsize(path) for path, _ in members)
+
+        start = time.perf_counter()
+        engine.order_members(members)
+        ordering_time = time.perf_counter() - start
+
+        for reorder in (False, True):
+            outcome = engine.compress_many(
+                members, os.path.join(directory, str(reorder)), preset=args.preset,
+                mode=engine.ARCHIVE_SOLID, reorder=reorder,
+            )
+            rows.append((
+                'similarity' if reorder else 'upload', f'{outcome.compression_time:.2f}',
+                f'{total / outcome.compression_time / 1024 / 1024:.1f}',
+                f'{total / outcome.compressed_file_size:.2f}', f'{outcome.compressed_file_size / 1024:.0f}',
+            ))
+
+    print(f'{len(members)} files, {total / 1024 / 1024:.1f} MiB, preset {args.preset}, '
+          f'ordering took {ordering_time * 1000:.0f} ms\n')
+    print_table(('order', 'wall s', 'MiB/s', 'ratio', 'KiB out'), rows)
+
+
+if __name__ == '__main__':
+    main()
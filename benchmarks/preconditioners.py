@@ -0,0 +1,82 @@
+"""
+Preconditioners: plain LZMA vs a reversible transform before LZMA.
+
+Synthetic instrument data is compressed once as-is and once with the
+preconditioner picked by 'auto': a CSV table (columnar), a float32 .npy
+signal, a raw float64 dump and an int64 counter array (byte shuffle).
+
+Usage::
+
+    python -m benchmarks.preconditioners --rows 200000 --preset 6
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+
+from .common import print_table, setup_django
+
+
+def write_datasets(directory, rows, seed=0):
+    """Write the sample files, return a list of (path, name)"""
+    import numpy as np
+
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    datasets = {}
+
+    value, lines = 20.0, ['timestamp,station,temperature,status']
+    for index in range(rows):
+        value += rng.gauss(0, 0.1)
+        lines.append(f'{1700000000 + index * 5},{rng.randint(1, 12)},{value:.2f},{rng.choice(["ok", "ok", "check"])}')
+    datasets['readings.csv'] = ('\n'.join(lines) + '\n').encode()
+
+    signal = np.cumsum(np_rng.normal(0, 0.01, rows * 4)).astype(np.float32)
+    buffer = io.BytesIO()
+    np.save(buffer, signal)
+    datasets['signal.npy'] = buffer.getvalue()
+    datasets['spectrum.f64'] = np.sin(np.linspace(0, 400, rows * 2)).astype('<f8').tobytes()
+    counters = np.cumsum(np_rng.integers(0, 50, rows * 2)).astype('<i8')
+    buffer = io.BytesIO()
+    np.save(buffer, counters)
+    datasets['counters.npy'] = buffer.getvalue()
+
+    files = []
+    for name, data in datasets.items():
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        files.append((path, name))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000, help='rows/elements scale of the samples')
+    parser.add_argument('--preset', type=int, default=6, help='LZMA preset')
+    args = parser.parse_args()
+
+    setup_django()
+    from compression import engine
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='lzma-bench-') as directory:
+        for path, name in write_datasets(directory, args.rows):
+            size = os.path.getsize(path)
+            plain = engine.compress_single(path, name, os.path.join(directory, 'plain'), preset=args.preset)
+            outcome = engine.compress_single(
+                path, name, os.path.join(directory, 'auto'), preset=args.preset, preconditioner='auto'
+            )
+            rows.append((
+                name, f'{size / 1024 / 1024:.1f}', outcome.preconditioner or '-',
+                f'{size / plain.compressed_file_size:.2f}', f'{size / outcome.compressed_file_size:.2f}',
+                f'{plain.compression_time:.2f}', f'{outcome.compression_time:.2f}',
+            ))
+
+    print(f'preset {args.preset}\n')
+    print_table(('file', 'MiB', 'transform', 'plain ratio', 'ratio', 'plain s', 's'), rows)
+
+
+if __name__ == '__main__':
+    main()
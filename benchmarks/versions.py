@@ -0,0 +1,81 @@
+"""
+Dataset versions: compressing each one complete vs as a delta.
+
+Writes a CSV table, then successive versions of it that each edit a share
+of the rows and append a few new ones. Every version is compressed once
+complete (engine.compress_single) and once as a delta against the previous
+one (engine.compress_delta). Also times rebuilding the last version from
+the chain of deltas, which is what its download does.
+
+Usage::
+
+    python -m benchmarks.versions --rows 500000 --versions 4 --changed 0.02
+"""
+import argparse
+import lzma
+import os
+import random
+import tempfile
+import time
+
+from .common import print_table, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500000, help='rows of the first version')
+    parser.add_argument('--versions', type=int, default=4, help='versions, the first included')
+    parser.add_argument('--changed', type=float, default=0.02, help='share of rows edited by each new version')
+    args = parser.parse_args()
+
+    setup_django()
+    from compression import delta, engine
+
+    rng = random.Random(0)
+    rows = [f'{1700000000 + i * 5},{rng.randint(1, 12)},{rng.gauss(20, 3):.3f},ok\n' for i in range(args.rows)]
+    table = []
+    with tempfile.TemporaryDirectory() as directory:
+        previous, artifacts = None, []
+        for version in range(1, args.versions + 1):
+            if previous is not None:
+                for i in rng.sample(range(len(rows)), int(len(rows) * args.changed)):
+                    rows[i] = f'{1700000000 + i * 5},{rng.randint(1, 12)},{rng.gauss(20, 3):.3f},revised\n'
+                rows.extend(f'{1800000000 + i},{version},0.000,new\n' for i in range(len(rows) // 1000))
+            content = ''.join(rows).encode()
+            path = os.path.join(directory, f'v{version}.csv')
+            with open(path, 'wb') as f:
+                f.write(content)
+
+            full = engine.compress_single(path, f'v{version}.csv', os.path.join(directory, f'full{version}'))
+            if previous is None:
+                stored = full
+            else:
+                stored = engine.compress_delta(
+                    previous, path, f'v{version}.csv', os.path.join(directory, f'delta{version}')
+                )
+            artifacts.append(stored.compressed_path)
+            table.append((
+                version, len(content), full.compressed_file_size, f'{full.compression_time:.2f}',
+                stored.compressed_file_size, f'{stored.compression_time:.2f}'
+            ))
+            previous = content
+
+        started = time.perf_counter()
+        with lzma.open(artifacts[0]) as f:
+            rebuilt = f.read()
+        for artifact in artifacts[1:]:
+            with lzma.open(artifact) as f:
+                rebuilt = delta.apply(rebuilt, f.read())
+        rebuild_seconds = time.perf_counter() - started
+        assert rebuilt == previous
+
+    print(f'{args.versions} versions of {args.rows} rows, {args.changed:.0%} of rows edited per version\n')
+    print_table(('version', 'bytes', 'complete', 'seconds', 'stored (delta)', 'seconds'), table)
+    full_total = sum(row[2] for row in table)
+    stored_total = sum(row[4] for row in table)
+    print(f'\nstorage: {full_total} -> {stored_total} bytes ({full_total / stored_total:.1f}x smaller)')
+    print(f'rebuilding version {args.versions} from its chain: {rebuild_seconds:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
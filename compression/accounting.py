@@ -0,0 +1,140 @@
+"""
+Resource accounting for compression jobs.
+
+Jobs share the process with each other, so process-wide counters would mix
+them up. measure() instead samples the calling thread's own CPU time
+(getrusage(RUSAGE_THREAD)) and I/O (/proc/self/task/<tid>/io) at the start
+and end of the job, and engine helper threads submitted through bind() add
+their share to the same job. The bytes counted are those passed to read()
+and write(), whether or not they were served from the page cache.
+
+Peak memory is how far the process's resident set grew over the job: its
+high-water mark (VmHWM) at the end less its size at the start. That sees the
+LZMA, bzip2 and zlib encoders' buffers as well as Python objects, without
+tracing every allocation. The mark is reset (/proc/self/clear_refs) when a
+job starts with no other running; for a job that overlapped others it is an
+upper bound. Where the mark can't be read, ru_maxrss is used instead, which
+only counts growth past the process's earlier peak.
+"""
+import functools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple
+
+try:
+    import resource
+except ImportError:  # Windows, CPU time falls back to time.thread_time()
+    resource = None
+
+
+class Usage(NamedTuple):
+    """Resources a job used, named like the CompressionResult fields they are stored in"""
+    cpu_user_time: float = 0.0  # Seconds
+    cpu_system_time: float = 0.0
+    peak_memory: int = 0  # Bytes
+    bytes_read: int = 0
+    bytes_written: int = 0
+
+
+def _thread_sample():
+    """(user seconds, system seconds, bytes read, bytes written) of the calling thread so far"""
+    if resource and hasattr(resource, 'RUSAGE_THREAD'):
+        rusage = resource.getrusage(resource.RUSAGE_THREAD)
+        cpu = (rusage.ru_utime, rusage.ru_stime)
+    else:
+        cpu = (time.thread_time(), 0.0)
+    try:
+        with open(f'/proc/self/task/{threading.get_native_id()}/io') as f:
+            counters = dict(line.split(': ') for line in f)
+        io = (int(counters['rchar']), int(counters['wchar']))
+    except OSError:
+        io = (0, 0)
+    return cpu + io
+
+
+class _Account:
+    """Totals of one job, added to from every thread working for it"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = [0.0, 0.0, 0, 0]
+
+    def charge(self, start, end):
+        with self.lock:
+            for index, (before, after) in enumerate(zip(start, end)):
+                self.totals[index] += after - before
+
+
+_local = threading.local()
+_memory_lock = threading.Lock()
+_measuring = 0  # Jobs being measured, the high-water mark is only reset when there are none
+
+
+def _resident():
+    """(current, peak) resident bytes of the process"""
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        if resource is None:
+            return 0, 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        return peak, peak
+
+
+def _reset_peak():
+    """Lower the process's high-water mark to its current resident set (Linux)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class Meter:
+    """Handed out by measure(), holds the Usage once the block has finished"""
+    usage = None
+
+
+@contextmanager
+def measure():
+    """Account the work done in the block, including threads started through bind()"""
+    global _measuring
+    account = _Account()
+    previous, _local.account = getattr(_local, 'account', None), account
+    with _memory_lock:
+        if _measuring == 0:
+            _reset_peak()
+        _measuring += 1
+        baseline = _resident()[0]
+    start = _thread_sample()
+    meter = Meter()
+    try:
+        yield meter
+    finally:
+        account.charge(start, _thread_sample())
+        peak_memory = max(_resident()[1] - baseline, 0)
+        with _memory_lock:
+            _measuring -= 1
+        _local.account = previous
+        cpu_user_time, cpu_system_time, bytes_read, bytes_written = account.totals
+        meter.usage = Usage(cpu_user_time, cpu_system_time, peak_memory, bytes_read, bytes_written)
+
+
+def bind(func):
+    """Wrap func so the thread that runs it charges its work to the caller's measure()"""
+    account = getattr(_local, 'account', None)
+    if account is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = _thread_sample()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            account.charge(start, _thread_sample())
+    return wrapper
@@ -1,11 +1,17 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count, F, Max, Sum
+from django.template.response import TemplateResponse
+from django.urls import path
 
 # Admin site branding
 admin.site.site_header = "DataCompress Administration"
 admin.site.site_title = "DataCompress Portal"
 admin.site.index_title = "Administration Dashboard"
 
-from .models import File, CompressionResult
+from . import analytics, export
+from .models import CodecTrial, File, CompressionResult
 
 
 @admin.register(File)
@@ -20,13 +26,88 @@ class FileAdmin(admin.ModelAdmin):
         return qs.select_related('user')
 
 
+class CodecTrialInline(admin.TabularInline):
+    model = CodecTrial
+    extra = 0
+    can_delete = False
+    readonly_fields = ('codec', 'compressed_file_size', 'compression_time', 'memory', 'kept')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+# Resource totals shown above the results list, per user and per codec/preset
+RESOURCE_TOTALS = {
+    'results': Count('id'),
+    'original_size': Sum('file__original_file_size'),
+    'wall_time': Sum('compression_time'),
+    'cpu_time': Sum(F('cpu_user_time') + F('cpu_system_time')),
+    'peak_memory': Max('peak_memory'),
+    'bytes_read': Sum('bytes_read'),
+    'bytes_written': Sum('bytes_written'),
+}
+
+
+def resource_totals(queryset, group_by):
+    """Aggregate RESOURCE_TOTALS over queryset by one field, in one query, with CPU utilisation added"""
+    rows = list(queryset.order_by().values(group_by).annotate(**RESOURCE_TOTALS).order_by('-cpu_time', group_by))
+    for row in rows:
+        row['group'] = row.pop(group_by)
+        # Above 1 the job kept several cores busy, well below 1 it waited on disk or for a core
+        row['cpu_utilisation'] = row['cpu_time'] / row['wall_time'] if row['cpu_time'] and row['wall_time'] else None
+    return rows
+
+
 @admin.register(CompressionResult)
 class CompressionResultAdmin(admin.ModelAdmin):
-    list_display = ('file', 'compressed_filename', 'compression_ratio', 'compression_time', 'timestamp')
-    list_filter = ('timestamp',)
+    list_display = (
+        'file', 'compressed_filename', 'codec', 'compression_ratio', 'compression_time', 'cpu_time',
+        'peak_memory', 'verification', 'timestamp'
+    )
+    list_filter = ('timestamp', 'codec', 'verification')
+    inlines = [CodecTrialInline]
     search_fields = ('file__original_filename', 'compressed_filename')
-    readonly_fields = ('timestamp',)
+    actions = ['export_csv', 'export_json']
+    readonly_fields = (
+        'timestamp', 'compressed_sha256', 'verified_at', 'recompressed_at', 'deduplicated_size', 'dedup_time_saved',
+        'cpu_user_time', 'cpu_system_time', 'peak_memory', 'bytes_read', 'bytes_written'
+    )
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         return qs.select_related('file', 'file__user')
+
+    @admin.action(description='Export selected results as CSV')
+    def export_csv(self, request, queryset):
+        return export.export_response(request, queryset, export.FORMAT_CSV)
+
+    @admin.action(description='Export selected results as JSON')
+    def export_json(self, request, queryset):
+        return export.export_response(request, queryset, export.FORMAT_JSON)
+
+    def get_urls(self):
+        return [
+            path('analytics/', self.admin_site.admin_view(self.analytics_view), name='compression_analytics'),
+        ] + super().get_urls()
+
+    def analytics_view(self, request):
+        """Dashboard statistics over every result, from the cached analytics summary"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Compression analytics',
+            'opts': self.model._meta,
+            'summary': analytics.summary(refresh=request.GET.get('refresh') == '1'),
+            'ttl': settings.COMPRESSION_ANALYTICS_TTL,
+        }
+        return TemplateResponse(request, 'admin/compression/compressionresult/analytics.html', context)
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None:
+            # Totals follow the list's current filters and search
+            response.context_data['usage_by_user'] = resource_totals(changelist.queryset, 'file__user__username')
+            response.context_data['usage_by_codec'] = resource_totals(changelist.queryset, 'codec')
+        return response
@@ -0,0 +1,236 @@
+"""
+Aggregate statistics over the whole result history, for dashboards.
+
+The few columns needed are read once with values_list() in chunks and
+turned into NumPy arrays, codec and file type as integer codes. Every
+statistic is then computed on whole arrays instead of per-row model
+properties: size buckets with np.digitize(), histograms with
+np.histogram2d(), per-group totals with np.bincount(), per-group
+percentiles on one sorted copy, trends with np.polyfit(). The summary is
+cached for COMPRESSION_ANALYTICS_TTL seconds, so a polled dashboard costs
+one pass over the table per period however many rows it holds.
+"""
+import os
+from datetime import datetime, timezone as dt_timezone
+from typing import NamedTuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import engine
+from .models import CompressionResult
+
+CACHE_KEY = 'compression:analytics'
+CHUNK_SIZE = 10000  # Rows fetched and converted per step
+
+KIB = 1024
+MIB = 1024 * KIB
+SIZE_BUCKET_EDGES = [64 * KIB, MIB, 16 * MIB, 256 * MIB]
+SIZE_BUCKET_LABELS = ['< 64 KiB', '64 KiB - 1 MiB', '1 - 16 MiB', '16 - 256 MiB', '>= 256 MiB']
+SAVED_BINS = np.linspace(0, 100, 11)  # Histogram of space saved, 10 percentage points per bin
+PERCENTILES = (10, 50, 90)
+MAX_FILE_TYPES = 12  # Rarer extensions are counted as OTHER_TYPE
+OTHER_TYPE = 'other'
+
+DAY = 86400
+WEEK = 7 * DAY
+FIRST_MONDAY = 4 * DAY  # 1970-01-05, trend weeks start on Mondays (UTC)
+
+
+class Columns(NamedTuple):
+    original_size: np.ndarray  # Bytes
+    compressed_size: np.ndarray
+    seconds: np.ndarray
+    timestamp: np.ndarray  # POSIX seconds
+    codec: np.ndarray  # Index into codecs
+    file_type: np.ndarray  # Index into file_types
+    codecs: list
+    file_types: list
+
+
+def _file_type(filename):
+    return os.path.splitext(filename)[1].lower().lstrip('.') or '(none)'
+
+
+def load_columns(queryset):
+    """Read the columns the statistics need from a CompressionResult queryset"""
+    rows = queryset.order_by().values_list(
+        'file__original_file_size', 'compressed_file_size', 'compression_time', 'timestamp', 'codec',
+        'file__original_filename',
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+    numeric, codecs, file_types = [], [], []
+    while chunk := [row for _, row in zip(range(CHUNK_SIZE), rows)]:
+        original_size, compressed_size, seconds, timestamps, codec, filenames = zip(*chunk)
+        numeric.append(np.array(
+            [original_size, compressed_size, seconds, [value.timestamp() for value in timestamps]], dtype=np.float64
+        ))
+        codecs.extend(codec)
+        file_types.extend(_file_type(name) for name in filenames)
+
+    numeric = np.concatenate(numeric, axis=1) if numeric else np.empty((4, 0))
+    codec_names, codec_codes = np.unique(np.array(codecs, dtype=str), return_inverse=True)
+    type_names, type_codes = np.unique(np.array(file_types, dtype=str), return_inverse=True)
+    return Columns(*numeric, codec_codes, type_codes, codec_names.tolist(), type_names.tolist())
+
+
+def group_percentiles(values, groups, group_count, percentiles=PERCENTILES):
+    """Linearly interpolated percentiles of values per group, shape (group_count, len(percentiles)), NaN when empty"""
+    ordered = values[np.lexsort((values, groups))]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    position = starts[:, None] + (counts[:, None] - 1) * (np.array(percentiles) / 100)[None, :]
+    position = np.clip(position, 0, max(len(ordered) - 1, 0))
+    low = np.floor(position).astype(int)
+    high = np.ceil(position).astype(int)
+    if not len(ordered):
+        return np.full(position.shape, np.nan)
+    result = ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+    result[counts == 0] = np.nan
+    return result
+
+
+def _number(value, digits=2):
+    """A JSON-friendly float, None for NaN and infinities"""
+    value = float(value)
+    return round(value, digits) if np.isfinite(value) else None
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), np.nan)
+
+
+def _group_table(keys, codes, saved, timed, throughput):
+    """Per-group rows, most results first: results, mean space saved, aggregate and median throughput"""
+    count = len(keys)
+    results = np.bincount(codes, minlength=count)
+    mean_saved = _ratio(np.bincount(codes, weights=saved, minlength=count), results)
+    timed_codes = codes[timed]
+    input_bytes = np.bincount(timed_codes, weights=throughput.original_size, minlength=count)
+    seconds = np.bincount(timed_codes, weights=throughput.seconds, minlength=count)
+    aggregate = _ratio(input_bytes, seconds) / MIB
+    percentiles = group_percentiles(throughput.rate, timed_codes, count, (50, 90))
+    return [
+        {
+            'key': keys[index],
+            'results': int(results[index]),
+            'mean_saved_percent': _number(mean_saved[index]),
+            'throughput_mib_s': _number(aggregate[index]),
+            'median_throughput_mib_s': _number(percentiles[index, 0]),
+            'p90_throughput_mib_s': _number(percentiles[index, 1]),
+        }
+        for index in np.argsort(-results, kind='stable')
+        if results[index]
+    ]
+
+
+class _Timed(NamedTuple):
+    original_size: np.ndarray
+    seconds: np.ndarray
+    rate: np.ndarray  # MiB/s of each timed result
+
+
+def _top_types(columns):
+    """file_type codes and names with everything past the MAX_FILE_TYPES most common folded into OTHER_TYPE"""
+    counts = np.bincount(columns.file_type, minlength=len(columns.file_types))
+    if len(counts) <= MAX_FILE_TYPES:
+        return columns.file_type, columns.file_types
+    top = np.argsort(-counts, kind='stable')[:MAX_FILE_TYPES]
+    remap = np.full(len(counts), MAX_FILE_TYPES)
+    remap[top] = np.arange(MAX_FILE_TYPES)
+    return remap[columns.file_type], [columns.file_types[index] for index in top] + [OTHER_TYPE]
+
+
+def _trend_slope(x, y):
+    """Least-squares slope of y over x, None without two distinct x values"""
+    if len(x) < 2 or np.ptp(x) == 0:
+        return None
+    return np.polyfit(x, y, 1)[0]
+
+
+def summarise(columns):
+    """Every dashboard statistic of the history in columns, as a JSON-ready dict"""
+    total = len(columns.original_size)
+    saved = np.clip(100 * (1 - _ratio(columns.compressed_size, columns.original_size)), -100, 100)
+    saved = np.nan_to_num(saved)  # Empty originals count as nothing saved
+    timed = (columns.seconds > 0) & (columns.original_size > 0)
+    throughput = _Timed(
+        columns.original_size[timed], columns.seconds[timed], columns.original_size[timed] / columns.seconds[timed] / MIB
+    )
+
+    # Ratio distribution by input size
+    bucket = np.digitize(columns.original_size, SIZE_BUCKET_EDGES)
+    bucket_count = len(SIZE_BUCKET_LABELS)
+    histogram, _, _ = np.histogram2d(
+        bucket, np.clip(saved, 0, 100), bins=[np.arange(bucket_count + 1) - 0.5, SAVED_BINS]
+    )
+    bucket_results = np.bincount(bucket, minlength=bucket_count)
+    bucket_percentiles = group_percentiles(saved, bucket, bucket_count)
+    by_size = [
+        {
+            'bucket': SIZE_BUCKET_LABELS[index],
+            'results': int(bucket_results[index]),
+            'saved_percentiles': {
+                f'p{percentile}': _number(bucket_percentiles[index, position])
+                for position, percentile in enumerate(PERCENTILES)
+            },
+            'saved_histogram': histogram[index].astype(int).tolist(),
+        }
+        for index in range(bucket_count)
+    ]
+
+    by_codec = _group_table(columns.codecs, columns.codec, saved, timed, throughput)
+    for row in by_codec:
+        row['label'] = engine.CODECS[row['key']].label if row['key'] in engine.CODECS else row['key']
+    type_codes, type_labels = _top_types(columns)
+    by_file_type = _group_table(type_labels, type_codes, saved, timed, throughput)
+
+    # Weekly trend and its linear fit, per 30 days
+    weeks, week_codes = np.unique(np.floor((columns.timestamp - FIRST_MONDAY) / WEEK), return_inverse=True)
+    week_results = np.bincount(week_codes, minlength=len(weeks))
+    week_saved = _ratio(np.bincount(week_codes, weights=saved, minlength=len(weeks)), week_results)
+    week_bytes = np.bincount(week_codes[timed], weights=throughput.original_size, minlength=len(weeks))
+    week_seconds = np.bincount(week_codes[timed], weights=throughput.seconds, minlength=len(weeks))
+    week_throughput = _ratio(week_bytes, week_seconds) / MIB
+    trend = [
+        {
+            'week': datetime.fromtimestamp(week * WEEK + FIRST_MONDAY, dt_timezone.utc).date().isoformat(),
+            'results': int(week_results[index]),
+            'mean_saved_percent': _number(week_saved[index]),
+            'throughput_mib_s': _number(week_throughput[index]),
+            'input_gib': _number(week_bytes[index] / (1024 * MIB), 3),
+        }
+        for index, week in enumerate(weeks)
+    ]
+    days = columns.timestamp / DAY
+    saved_slope = _trend_slope(days, saved)
+    throughput_slope = _trend_slope(days[timed], throughput.rate)
+
+    return {
+        'results': total,
+        'original_bytes': int(columns.original_size.sum()),
+        'compressed_bytes': int(columns.compressed_size.sum()),
+        'mean_saved_percent': _number(saved.mean()) if total else None,
+        'saved_bins': SAVED_BINS.astype(int).tolist(),
+        'by_size': by_size,
+        'by_codec': by_codec,
+        'by_file_type': by_file_type,
+        'trend': trend,
+        'regression': {
+            'saved_percent_per_30_days': None if saved_slope is None else _number(saved_slope * 30, 4),
+            'throughput_mib_s_per_30_days': None if throughput_slope is None else _number(throughput_slope * 30, 4),
+        },
+    }
+
+
+def summary(refresh=False):
+    """The cached summary of every result, recomputed when older than COMPRESSION_ANALYTICS_TTL or on refresh"""
+    data = None if refresh else cache.get(CACHE_KEY)
+    if data is None:
+        data = summarise(load_columns(CompressionResult.objects.all()))
+        data['generated_at'] = timezone.now().isoformat()
+        cache.set(CACHE_KEY, data, settings.COMPRESSION_ANALYTICS_TTL)
+    return data
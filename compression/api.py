@@ -0,0 +1,245 @@
+"""
+JSON API for automated clients (ingest pipelines).
+
+Requests authenticate with an API token ("Authorization: Token <key>",
+issued by `manage.py create_api_token`) instead of a session and CSRF
+token. A batch of files, or of server-side paths under
+COMPRESSION_API_ALLOWED_ROOT, is queued in one call that returns job ids
+immediately; status and results of many jobs are fetched in one round-trip.
+"""
+import json
+import os
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from users.models import APIToken
+
+from . import analytics, export, versions
+from .executors import run_io
+from .models import CompressionJob, CompressionResult
+from .views import (
+    _artifact_response, _claim_download, _job_options, _link_source, _previous_version, _release_download,
+    _start_jobs, _store_upload, _upload_size_error,
+)
+
+# Most ids accepted by one bulk status/results query
+MAX_BULK_IDS = 1000
+
+
+def api_token_required(view):
+    """Authenticate an async API view with an API token, answering 401 without one"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        token = await sync_to_async(APIToken.authenticate)(request.headers.get('Authorization'))
+        if token is None:
+            return JsonResponse({'error': 'Invalid or missing API token'}, status=401)
+        request.user = token.user
+        request.api_token = token
+        return await view(request, *args, **kwargs)
+    # Token requests carry no session cookie, so there's nothing for CSRF to protect
+    return csrf_exempt(wrapper)
+
+
+def _parse_ids(request, name):
+    """Return the comma-separated integer ids of a query parameter, or raise ValueError"""
+    try:
+        ids = [int(value) for value in request.GET.get(name, '').split(',') if value.strip()]
+    except ValueError:
+        raise ValueError(f"'{name}' must be comma-separated integer ids") from None
+    if not ids:
+        raise ValueError(f"'{name}' must list at least one id")
+    if len(ids) > MAX_BULK_IDS:
+        raise ValueError(f"At most {MAX_BULK_IDS} ids per request")
+    return ids
+
+
+def _resolve_server_path(relative_path):
+    """Return the real path of a file under COMPRESSION_API_ALLOWED_ROOT, or raise ValueError"""
+    allowed_root = os.path.realpath(settings.COMPRESSION_API_ALLOWED_ROOT)
+    path = os.path.realpath(os.path.join(allowed_root, relative_path))
+    if os.path.commonpath([allowed_root, path]) != allowed_root:
+        raise ValueError(f"'{relative_path}' is outside the allowed directory")
+    if not os.path.isfile(path):
+        raise ValueError(f"'{relative_path}' is not a file")
+    return path
+
+
+def _job_payload(job):
+    payload = job.to_event()
+    payload.pop('redirect_url', None)  # Browser-only
+    payload['result_id'] = job.result_id
+    return payload
+
+
+async def _stored_files_from_request(request):
+    """
+    Store the batch described by the request, return (stored_files, archive, options)
+    where options are the _job_options() for its jobs and the _previous_version().
+    Multipart requests carry 'files'; JSON requests name server-side 'paths'.
+    """
+    if request.content_type == 'application/json':
+        if not settings.COMPRESSION_API_ALLOWED_ROOT:
+            raise ValueError("Server-side paths are not enabled on this server")
+        body = json.loads(request.body or b'{}')
+        if not isinstance(body, dict):
+            raise ValueError("The request body must be a JSON object")
+        options = _job_options(body)
+        paths = body.get('paths')
+        if not isinstance(paths, list) or not paths:
+            raise ValueError("'paths' must be a non-empty list")
+        options['previous_version'] = await sync_to_async(_previous_version)(body, request.user, len(paths) == 1)
+        sources = [await run_io(_resolve_server_path, str(path)) for path in paths]
+
+        stored_files = []
+        for source_path in sources:
+            file_path = await run_io(_link_source, source_path, request.user.id)
+            size = await run_io(os.path.getsize, file_path)
+            stored_files.append((os.path.basename(source_path), size, file_path))
+        return stored_files, bool(body.get('archive')), options
+
+    files = await run_io(lambda: request.FILES.getlist('files'))
+    if not files:
+        raise ValueError("No files uploaded")
+    options = _job_options(request.POST)
+    options['previous_version'] = await sync_to_async(_previous_version)(request.POST, request.user, len(files) == 1)
+    size_error = _upload_size_error(sum(file.size for file in files))
+    if size_error:
+        raise ValueError(size_error)
+
+    stored_files = []
+    for uploaded_file in files:
+        file_path = await run_io(_store_upload, uploaded_file, request.user.id)
+        stored_files.append((uploaded_file.name, uploaded_file.size, file_path))
+    return stored_files, request.POST.get('archive') in ('1', 'true'), options
+
+
+@require_POST
+@api_token_required
+async def create_jobs(request):
+    """
+    Queue a batch for compression. Each file becomes its own job, unless
+    'archive' is set, in which case the batch becomes one archive job built
+    in 'archive_mode' (auto, solid or parallel). Single-file jobs apply
+    'preconditioner' (none, auto, columnar, shuffle) before LZMA, or with
+    'compare' run every codec and keep the named one (or the 'best'). A single
+    file with 'previous_version' (a file ID) is a new version of that file.
+    """
+    try:
+        stored_files, archive, options = await _stored_files_from_request(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    batches = [stored_files] if archive else [[stored_file] for stored_file in stored_files]
+    created = [
+        dict(_job_payload(job), files=[original_filename for original_filename, _, _ in batch])
+        for job, batch in zip(await _start_jobs(request.user, batches, **options), batches)
+    ]
+    return JsonResponse({'jobs': created}, status=202)
+
+
+@require_GET
+@api_token_required
+async def job_status(request):
+    """Status of many jobs in one query: ?ids=1,2,3"""
+    try:
+        ids = _parse_ids(request, 'ids')
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    found = {
+        job.id: _job_payload(job)
+        async for job in CompressionJob.objects.filter(user=request.user, id__in=ids)
+    }
+    return JsonResponse({
+        'jobs': [found[job_id] for job_id in ids if job_id in found],
+        'missing': [job_id for job_id in ids if job_id not in found],
+    })
+
+
+@require_GET
+@api_token_required
+async def job_results(request):
+    """Results of many jobs in one query: ?job_ids=1,2,3"""
+    try:
+        ids = _parse_ids(request, 'job_ids')
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    queryset = CompressionJob.objects.filter(
+        user=request.user, id__in=ids
+    ).select_related('result', 'result__file')
+    results = {}
+    async for job in queryset:
+        payload = _job_payload(job)
+        if job.result:
+            payload.update({
+                'file_id': job.result.file_id,  # For uploading a later version ('previous_version')
+                'original_file_size': job.result.file.original_file_size,
+                'compressed_filename': job.result.download_filename,
+                'compressed_file_size': job.result.compressed_file_size,
+                'compression_ratio': job.result.compression_ratio,
+                'compression_time': job.result.compression_time,
+                'compressed_sha256': job.result.compressed_sha256,
+                'stored_as_delta': job.result.is_delta,
+                'preconditioner': job.result.preconditioner,
+                'deduplicated_size': job.result.deduplicated_size,
+                'dedup_time_saved': job.result.dedup_time_saved,
+                'verification': job.result.verification,
+                'downloaded': job.result.downloaded,
+                'download_url': reverse('api_download_result', kwargs={'result_id': job.result.id}),
+            })
+        results[job.id] = payload
+    return JsonResponse({
+        'results': [results[job_id] for job_id in ids if job_id in results],
+        'missing': [job_id for job_id in ids if job_id not in results],
+    })
+
+
+@require_GET
+@api_token_required
+async def download_result(request, result_id):
+    """One-time download of a result's artifact"""
+    try:
+        compression_result = await CompressionResult.objects.select_related('file').aget(
+            id=result_id, file__user=request.user
+        )
+    except CompressionResult.DoesNotExist:
+        return JsonResponse({'error': 'Result not found'}, status=404)
+
+    if compression_result.is_corrupt:
+        return JsonResponse({'error': 'This result failed its integrity check'}, status=409)
+    if compression_result.downloaded or not await sync_to_async(_claim_download)(compression_result.id):
+        return JsonResponse({'error': 'This result has already been downloaded'}, status=410)
+
+    compressed_path = compression_result.artifact_path
+    if not await sync_to_async(versions.artifacts_exist)(compression_result):
+        # Not downloaded after all: if the artifact is restored, it still can be
+        await sync_to_async(_release_download)(compression_result.id)
+        return JsonResponse({'error': 'Compressed file not found on server'}, status=404)
+
+    return await _artifact_response(request, compression_result, compressed_path)
+
+
+@require_GET
+@api_token_required
+async def export_results(request):
+    """The token owner's whole result history, streamed as CSV or JSON: ?format=csv|json"""
+    export_format = request.GET.get('format', export.FORMAT_JSON)
+    if export_format not in export.FORMATS:
+        return JsonResponse({'error': f"Unknown export format '{export_format}'"}, status=400)
+    return export.export_response(request, CompressionResult.objects.filter(file__user=request.user), export_format)
+
+
+@require_GET
+@api_token_required
+async def analytics_summary(request):
+    """Statistics over every user's results for dashboards, staff tokens only; ?refresh=1 skips the cache"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Analytics are available to staff only'}, status=403)
+    return JsonResponse(await sync_to_async(analytics.summary)(refresh=request.GET.get('refresh') == '1'))
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CompressionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'compression'
+
+    def ready(self):
+        if settings.COMPRESSION_RECOMPRESS and not settings.COMPRESSION_JOBS_EAGER:
+            from . import recompress
+            recompress.start_idle_checks()
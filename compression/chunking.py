@@ -0,0 +1,87 @@
+"""
+Content-defined chunking.
+
+Data is cut wherever a rolling hash of the last 32 bytes matches a mask, so
+chunk boundaries depend only on nearby content: an insertion or deletion
+moves the boundaries around it but leaves the rest of the chunks (and their
+hashes) unchanged. That is what lets a new version of a dataset be matched
+against the previous one chunk by chunk (compression.delta).
+
+The hash is a gear hash, h = (h << 1) + GEAR[byte] on 32 bits, which only
+depends on the last 32 bytes. NumPy computes it for every position at once
+by doubling the window five times instead of looping over the bytes.
+Files are chunked a block at a time (iter_chunks), in constant memory.
+"""
+import numpy as np
+
+WINDOW_DOUBLINGS = 5  # 2 ** 5 = 32 bytes, all a 32-bit gear hash sees
+BLOCK_SIZE = 8 * 1024 * 1024  # Read and hashed at once by iter_chunks()
+GEAR = np.random.default_rng(0x6c7a6d61).integers(0, 2 ** 32, 256, dtype=np.uint32)
+
+
+def rolling_hashes(data):
+    """The gear hash ending at every byte of data, as a uint32 array"""
+    hashes = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    window = 1
+    for _ in range(WINDOW_DOUBLINGS):
+        # h over 2w bytes = h over the last w + (h over the w before) << w
+        shifted = np.zeros_like(hashes)
+        shifted[window:] = hashes[:-window] << np.uint32(window)
+        hashes = hashes + shifted
+        window *= 2
+    return hashes
+
+
+def chunk_ends(data, average=8192, minimum=None, maximum=None):
+    """
+    End offsets of the content-defined chunks of data, the last one len(data).
+    average must be a power of two; chunks are kept between minimum (default
+    average / 4) and maximum (default average * 8) bytes long.
+    """
+    minimum = minimum or average // 4
+    maximum = maximum or average * 8
+    if not data:
+        return []
+    bits = average.bit_length() - 1
+    candidates = np.flatnonzero((rolling_hashes(data) >> np.uint32(32 - bits)) == 0) + 1
+
+    ends, start = [], 0
+    for end in candidates.tolist():
+        while end - start > maximum:
+            start += maximum
+            ends.append(start)
+        if end - start >= minimum:
+            ends.append(end)
+            start = end
+    while len(data) - start > maximum:
+        start += maximum
+        ends.append(start)
+    if start < len(data):
+        ends.append(len(data))
+    return ends
+
+
+def iter_chunks(file, average=8192, block_size=BLOCK_SIZE):
+    """
+    Yield the content-defined chunks of a binary file object, the same as
+    chunk_ends() cuts its whole content into. Each block is cut from the last
+    boundary on, and its last, unfinished chunk carried into the next one.
+    That hashes the first bytes of a block without the bytes before them,
+    but a chunk never ends there: the default minimum exceeds the window.
+    """
+    pending = b''
+    while True:
+        block = file.read(block_size)
+        data = pending + block
+        if not data:
+            return
+        ends = chunk_ends(data, average)
+        if block:
+            ends.pop()  # Unfinished, it may end further on
+        start = 0
+        for end in ends:
+            yield data[start:end]
+            start = end
+        pending = data[start:]
+        if not block:
+            return
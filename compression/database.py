@@ -0,0 +1,32 @@
+"""
+Database connections outside the request cycle.
+
+Django checks a request's connections when it starts and ends. Compression
+jobs and background verification run on long-lived worker threads instead,
+and a job may spend minutes in LZMA between two queries. That can take it
+past CONN_MAX_AGE or the server's idle timeout (MySQL's wait_timeout). They
+call refresh_connections() before touching the database again. It closes
+a connection that is too old or has failed, so the next query reconnects,
+and arms the CONN_HEALTH_CHECKS ping for one that is reused.
+"""
+from contextlib import contextmanager
+
+from django.db import connections
+
+
+def refresh_connections():
+    """close_old_connections() for this thread, leaving connections inside a transaction alone"""
+    for connection in connections.all(initialized_only=True):
+        # Inside atomic() autocommit is off, which close_if_unusable_or_obsolete() takes for a broken connection
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+
+@contextmanager
+def worker_connections():
+    """Check a worker thread's connections before and after a unit of work, as a request would"""
+    refresh_connections()
+    try:
+        yield
+    finally:
+        refresh_connections()
@@ -0,0 +1,169 @@
+"""
+Deduplication across a user's uploads.
+
+Research datasets share large identical regions (headers, reference tables,
+appended logs) that whole-file hashing misses. Every single-file upload is
+cut into content-defined chunks (compression.manifest) and they are recorded
+in the user's chunk store: one Chunk row per distinct chunk, naming the result
+whose artifact holds it and where. If enough of a new upload is already in
+the store, its artifact is a chunk manifest instead of the file. Chunks that
+are already stored become references, and only the rest is compressed.
+
+Deduplication is opt-in (COMPRESSION_DEDUP): it costs every upload the
+chunking and a row per distinct chunk, and each deduplicated download a
+rebuild.
+
+Downloading a deduplicated result rebuilds the file from its manifest, with
+the referenced chunks read from the other artifacts, and streams it as .xz,
+compressed on the fly (versions.iter_compressed()). A downloaded result's
+chunks leave the store at once, so no later upload references them; its
+artifact is kept for as long as a result referencing it still needs it
+(versions.release_artifact()).
+"""
+import os
+import time
+from typing import NamedTuple
+
+from . import manifest, versions
+from .models import Chunk, ChunkReference, CompressionResult
+
+MIN_SHARE = 0.1  # Of an upload found in the store for it to be deduplicated, otherwise it is compressed complete
+LOOKUP_BATCH = 500  # Digests looked up per query
+
+
+class SourceGone(Exception):
+    """An artifact holding referenced chunks was deleted before the manifest was recorded"""
+
+
+class Plan(NamedTuple):
+    chunks: list  # manifest.Chunks of the upload
+    records: list  # manifest.Records of its manifest, None to compress it complete
+    deduplicated_size: int  # Bytes of it the manifest references
+    sources: set  # Ids of the results whose artifacts hold them
+    rates: dict  # Seconds per byte those results compressed at, by id
+    seconds: float  # Spent chunking the upload and looking its chunks up
+
+
+def _stored(user_id, digests):
+    """Map the digests of the user's stored chunks among digests to (result id, offset)"""
+    digests = list(digests)
+    stored = {}
+    for start in range(0, len(digests), LOOKUP_BATCH):
+        rows = Chunk.objects.filter(
+            user_id=user_id, digest__in=digests[start:start + LOOKUP_BATCH]
+        ).exclude(result__verification=CompressionResult.VERIFICATION_CORRUPT)
+        stored.update((digest, (result_id, offset)) for digest, result_id, offset in rows.values_list(
+            'digest', 'result_id', 'offset'
+        ))
+    return stored
+
+
+def _rates(result_ids):
+    """Seconds per byte each result spent compressing what it didn't deduplicate"""
+    rows = CompressionResult.objects.filter(pk__in=result_ids).values_list(
+        'pk', 'compression_time', 'file__original_file_size', 'deduplicated_size'
+    )
+    return {pk: seconds / max(size - deduplicated, 1) for pk, seconds, size, deduplicated in rows}
+
+
+def plan_for(file_record):
+    """Chunk an upload and decide whether to store it as a manifest: a Plan"""
+    start_time = time.time()
+    chunks = manifest.chunk_file(file_record.file_path)
+    stored = _stored(file_record.user_id, {chunk.digest for chunk in chunks})
+    records = manifest.layout(chunks, stored)
+    deduplicated = sum(record.size for record in records if record.source is not None)
+    if deduplicated < MIN_SHARE * file_record.original_file_size:
+        return complete(Plan(chunks, records, deduplicated, set(), {}, time.time() - start_time))
+    sources = {record.source for record in records if record.source not in (None, manifest.SELF)}
+    return Plan(chunks, records, deduplicated, sources, _rates(sources), time.time() - start_time)
+
+
+def complete(plan):
+    """The Plan of an upload stored complete instead: only its chunks are recorded"""
+    return Plan(plan.chunks, None, 0, set(), {}, plan.seconds)
+
+
+def time_saved(plan, outcome):
+    """
+    Estimated seconds not spent compressing the chunks a manifest references,
+    at the rate their sources were compressed at (chunks repeated within the
+    upload at the rate the rest of it was), less the time spent chunking.
+    """
+    if plan.records is None:
+        return 0.0
+    literal = sum(record.size for record in plan.records if record.source is None)
+    own_rate = outcome.compression_time / literal if literal else 0.0
+    saved = sum(
+        record.size * plan.rates.get(record.source, own_rate)
+        for record in plan.records if record.source is not None
+    )
+    return saved - plan.seconds
+
+
+def lock_sources(plan):
+    """
+    In a transaction recording a manifest: lock the rows of the results it
+    references so their artifacts can't be released meanwhile, and raise
+    SourceGone if one already was.
+    """
+    sources = list(CompressionResult.objects.select_for_update().select_related('file').filter(pk__in=plan.sources))
+    if len(sources) != len(plan.sources) or not all(os.path.exists(source.artifact_path) for source in sources):
+        raise SourceGone("An earlier upload was deleted while this one was compressed")
+
+
+def store(result, plan):
+    """Record the chunks result's artifact holds in its user's chunk store, and the results it references"""
+    ChunkReference.objects.bulk_create([ChunkReference(result=result, source_id=pk) for pk in plan.sources])
+    rows, position = {}, 0
+    for i, chunk in enumerate(plan.chunks):
+        if plan.records is None:
+            offset = position  # The artifact is the file
+            position += chunk.size
+        elif plan.records[i].source is None:
+            offset = plan.records[i].offset
+        else:
+            continue
+        if chunk.digest not in rows:
+            rows[chunk.digest] = Chunk(
+                user_id=result.file.user_id, digest=chunk.digest, size=chunk.size, result=result, offset=offset
+            )
+    # Chunks already stored by another result stay where they are
+    Chunk.objects.bulk_create(rows.values(), batch_size=LOOKUP_BATCH, ignore_conflicts=True)
+
+
+def iter_content(result):
+    """
+    Yield the original content of a deduplicated result, rebuilt from its
+    manifest, in chunks. The manifest and each artifact it references are
+    decompressed into a temporary file the first time they are needed, so
+    references are read with plain seeks rather than by decompressing an
+    artifact again from the start for every one that goes back in it.
+    """
+    paths = {source.pk: source.artifact_path for source in result.chunk_sources.select_related('file')}
+    paths[manifest.SELF] = result.artifact_path
+    readers = {}
+    with versions.rebuild_directory() as directory:
+
+        def read_reference(source, offset, size):
+            if source not in paths:
+                raise ValueError(f"The manifest references result {source}, which it was not recorded against")
+            if source not in readers:
+                readers[source] = open(versions.spool(paths[source], directory), 'rb')
+            reader = readers[source]
+            reader.seek(offset)
+            return reader.read(size)
+
+        try:
+            manifest_path = versions.spool(result.artifact_path, directory)
+            readers[manifest.SELF] = open(manifest_path, 'rb')
+            with open(manifest_path, 'rb') as stream:
+                yield from manifest.decode(stream, read_reference)
+        finally:
+            for reader in readers.values():
+                reader.close()
+
+
+def iter_rebuilt(result):
+    """Yield a deduplicated result rebuilt and compressed as .xz, in pieces, for download"""
+    return versions.iter_compressed(result, iter_content(result))
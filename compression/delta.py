@@ -0,0 +1,173 @@
+"""
+Binary deltas between two versions of a file.
+
+Both versions are cut into content-defined chunks (compression.chunking) and
+every chunk of the new version that also occurs in the old one becomes a
+copy of that range. Copies are then extended byte by byte into the changed
+regions around them, so an edited row costs about its own length rather
+than a whole chunk. What is left is inserted literally. Deltas are plain
+byte strings; the engine compresses them with LZMA like any other content.
+
+Format: MAGIC, the sizes of both versions (QQ), then operations until the
+end: COPY with a base offset and length (QQ), or INSERT with a length (Q)
+followed by that many bytes.
+"""
+import hashlib
+import struct
+
+import numpy as np
+
+from .chunking import chunk_ends
+
+MAGIC = b'LZDELTA1'
+COPY = b'C'
+INSERT = b'I'
+CHUNK_SIZE = 256  # Average chunk matched between versions, small so scattered edits spoil few of them
+EXTENSION = '.lzdelta'  # Of delta artifacts, before the codec's own
+READ_BLOCK_SIZE = 1024 * 1024  # Most bytes iter_apply() reads and yields at once
+
+_SIZES = struct.Struct('<QQ')
+_COPY = struct.Struct('<QQ')
+_INSERT = struct.Struct('<Q')
+
+
+def _digest(chunk):
+    return hashlib.blake2b(chunk, digest_size=16).digest()
+
+
+def _common_prefix(a, b):
+    """Length of the common prefix of two uint8 arrays"""
+    n = min(len(a), len(b))
+    mismatches = np.flatnonzero(a[:n] != b[:n])
+    return int(mismatches[0]) if mismatches.size else n
+
+
+def _common_suffix(a, b):
+    n = min(len(a), len(b))
+    if not n:
+        return 0
+    return _common_prefix(a[len(a) - n:][::-1], b[len(b) - n:][::-1])
+
+
+def _matching_runs(base, target, chunk_size):
+    """[target start, target end, base start] of the ranges of target found in base, in target order"""
+    index = {}
+    start = 0
+    for end in chunk_ends(base, chunk_size):
+        index.setdefault(_digest(base[start:end]), start)
+        start = end
+
+    runs = []
+    start = 0
+    for end in chunk_ends(target, chunk_size):
+        offset = index.get(_digest(target[start:end]))
+        if offset is not None:
+            if runs and runs[-1][1] == start and runs[-1][2] + start - runs[-1][0] == offset:
+                runs[-1][1] = end  # Continues the previous copy
+            else:
+                runs.append([start, end, offset])
+        start = end
+
+    # Grow every copy into the unmatched bytes after it, then before it
+    base_bytes, target_bytes = np.frombuffer(base, np.uint8), np.frombuffer(target, np.uint8)
+    for i, run in enumerate(runs):
+        gap_end = runs[i + 1][0] if i + 1 < len(runs) else len(target)
+        run[1] += _common_prefix(target_bytes[run[1]:gap_end], base_bytes[run[2] + run[1] - run[0]:])
+    for i, run in enumerate(runs):
+        gap_start = runs[i - 1][1] if i else 0
+        grown = _common_suffix(target_bytes[gap_start:run[0]], base_bytes[:run[2]])
+        run[0] -= grown
+        run[2] -= grown
+    return runs
+
+
+def encode(base, target, chunk_size=CHUNK_SIZE):
+    """The delta that turns base into target (both bytes)"""
+    parts = [MAGIC, _SIZES.pack(len(base), len(target))]
+    position = 0
+    for target_start, target_end, base_start in _matching_runs(base, target, chunk_size):
+        if target_start > position:
+            parts += [INSERT, _INSERT.pack(target_start - position), target[position:target_start]]
+        parts += [COPY, _COPY.pack(base_start, target_end - target_start)]
+        position = target_end
+    if position < len(target):
+        parts += [INSERT, _INSERT.pack(len(target) - position), target[position:]]
+    return b''.join(parts)
+
+
+def apply(base, delta):
+    """Rebuild the target of delta from base, raise ValueError if delta isn't one made against base"""
+    view = memoryview(delta)
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a delta")
+    base_size, target_size = _SIZES.unpack_from(view, len(MAGIC))
+    if base_size != len(base):
+        raise ValueError(f"Delta is against {base_size} bytes, not {len(base)}")
+
+    base_view = memoryview(base)
+    parts = []
+    position = len(MAGIC) + _SIZES.size
+    while position < len(view):
+        operation = bytes(view[position:position + 1])
+        position += 1
+        if operation == COPY:
+            offset, length = _COPY.unpack_from(view, position)
+            position += _COPY.size
+            parts.append(base_view[offset:offset + length])
+        elif operation == INSERT:
+            length, = _INSERT.unpack_from(view, position)
+            position += _INSERT.size
+            parts.append(view[position:position + length])
+            position += length
+        else:
+            raise ValueError(f"Unknown delta operation {operation!r}")
+
+    target = b''.join(parts)
+    if len(target) != target_size:
+        raise ValueError(f"Delta rebuilt {len(target)} bytes, not {target_size}")
+    return target
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated delta")
+    return data
+
+
+def iter_apply(base_file, delta_stream, block_size=READ_BLOCK_SIZE):
+    """
+    Yield the target of the delta read from delta_stream, in pieces of at
+    most block_size, copying ranges from the seekable binary file base_file.
+    Like apply(), but neither version is held in memory.
+    """
+    if delta_stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a delta")
+    base_size, target_size = _SIZES.unpack(_read_exactly(delta_stream, _SIZES.size))
+    if base_size != base_file.seek(0, 2):
+        raise ValueError(f"Delta is against {base_size} bytes, not {base_file.tell()}")
+
+    written = 0
+    while True:
+        operation = delta_stream.read(1)
+        if not operation:
+            break
+        if operation == COPY:
+            offset, length = _COPY.unpack(_read_exactly(delta_stream, _COPY.size))
+            if offset + length > base_size:
+                raise ValueError(f"Delta copies past the end of its base, at {offset}")
+            base_file.seek(offset)
+            source = base_file
+        elif operation == INSERT:
+            length, = _INSERT.unpack(_read_exactly(delta_stream, _INSERT.size))
+            source = delta_stream
+        else:
+            raise ValueError(f"Unknown delta operation {operation!r}")
+        written += length
+        while length:
+            piece = _read_exactly(source, min(length, block_size))
+            length -= len(piece)
+            yield piece
+
+    if written != target_size:
+        raise ValueError(f"Delta rebuilt {written} bytes, not {target_size}")
@@ -0,0 +1,652 @@
+"""
+LZMA compression engine (with bz2 and zlib for codec comparisons).
+
+Everything in this module works on plain paths and returns plain values, it
+never touches the ORM. That keeps it safe to run on executor threads (or in
+worker processes) while the views record the outcome afterwards.
+"""
+import bz2
+import hashlib
+import heapq
+import lzma
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+import zlib
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+from . import accounting, delta, manifest, preconditioners
+
+LZMA_PRESET = 6  # Preset 6 is default for good compression
+CHUNK_SIZE = 64 * 1024  # Download chunks
+COMPRESS_BLOCK_SIZE = 1024 * 1024  # Input read per compressor call
+ARCHIVE_STAGE_WEIGHT = 0.3  # Share of a multi-file job's progress spent zipping
+
+# Multi-file modes: one LZMA stream over a zip of all members, or one stream
+# per member compressed in parallel and collected in a tar
+ARCHIVE_SOLID = 'solid'
+ARCHIVE_PARALLEL = 'parallel'
+ARCHIVE_AUTO = 'auto'
+
+# Automatic mode only goes parallel for several reasonably sized members...
+PARALLEL_MIN_MEMBERS = 4
+PARALLEL_MIN_AVERAGE_SIZE = 256 * 1024
+PARALLEL_MAX_SHARE = 0.5  # ...none of which holds most of the bytes...
+# ...whose content doesn't compress noticeably better together than apart
+SIMILARITY_SAMPLE_SIZE = 64 * 1024
+SIMILARITY_MAX_SAMPLES = 8
+SIMILARITY_THRESHOLD = 0.1
+PROGRESS_INTERVAL = 0.2  # Seconds between progress reports of parallel members
+
+# Solid archives put similar members next to each other, judged by a MinHash
+# (bottom-k) sketch of byte shingles from a few samples of every member
+FINGERPRINT_SAMPLES = 4
+FINGERPRINT_SAMPLE_SIZE = 8 * 1024
+FINGERPRINT_SHINGLE = 8
+FINGERPRINT_SIZE = 128
+
+MIB = 1024 * 1024
+PROBE_MIN_DICT_SIZE = 4096  # Smallest LZMA2 dictionary, of the encoders codecs are picked with
+
+
+class Codec(NamedTuple):
+    label: str
+    extension: str
+    compressor: object  # Factory returning an object with compress() and flush()
+    memory: int  # Encoder memory in bytes, as documented for the library
+    probe: object = None  # Factory taking a sample size, the same encoder with its dictionary bounded to it
+
+
+def _lzma_codec(preset, memory_mib):
+    return Codec(f'LZMA preset {preset}', '.xz', lambda: lzma.LZMACompressor(preset=preset), memory_mib * MIB)
+
+
+def _lzma_filters_codec(label, pre_filters, **options):
+    """Preset 9 extreme after pre_filters, a list of (filter id, options), with the LZMA2 options overridden"""
+    filters = [{'id': filter_id, **filter_options} for filter_id, filter_options in pre_filters]
+    filters.append({'id': lzma.FILTER_LZMA2, 'preset': 9 | lzma.PRESET_EXTREME, **options})
+
+    def probe(sample_size):
+        # A dictionary larger than the sample finds nothing more, so the output is the same in a few MiB
+        bounded = filters[:-1] + [{**filters[-1], 'dict_size': max(sample_size, PROBE_MIN_DICT_SIZE)}]
+        return lzma.LZMACompressor(filters=bounded)
+    return Codec(label, '.xz', lambda: lzma.LZMACompressor(filters=filters), 674 * MIB, probe)
+
+
+# Memory per xz(1)'s preset table, bzip2's 400k + 8 x block size and zlib's
+# 2^(windowBits + 2) + 2^(memLevel + 9)
+CODECS = {
+    **{
+        f'lzma-{preset}': _lzma_codec(preset, memory_mib)
+        for preset, memory_mib in enumerate((3, 9, 17, 32, 48, 94, 94, 186, 370, 674))
+    },
+    # Chains tried on cold artifacts (compression.recompress): plain, tuned for byte-aligned text, and after a
+    # 4-byte delta for arrays of 32-bit values
+    'lzma-9e': _lzma_filters_codec('LZMA preset 9 extreme', []),
+    'lzma-9e-text': _lzma_filters_codec('LZMA preset 9 extreme, text', [], lc=4, pb=0),
+    'lzma-9e-delta4': _lzma_filters_codec('LZMA preset 9 extreme, 4-byte delta', [(lzma.FILTER_DELTA, {'dist': 4})]),
+    'bz2-9': Codec('bzip2 level 9', '.bz2', lambda: bz2.BZ2Compressor(9), 7600 * 1024),
+    'zlib-6': Codec('zlib level 6 (gzip)', '.gz', lambda: zlib.compressobj(6, wbits=31), 256 * 1024),
+    'zlib-9': Codec('zlib level 9 (gzip)', '.gz', lambda: zlib.compressobj(9, wbits=31), 256 * 1024),
+}
+COMPARE_CODECS = ('lzma-1', 'lzma-6', 'lzma-9', 'bz2-9', 'zlib-6', 'zlib-9')
+KEEP_BEST = 'best'  # Keep the smallest artifact of a comparison
+RECOMPRESS_CODECS = ('lzma-9e', 'lzma-9e-text', 'lzma-9e-delta4')  # Tried on cold artifacts (compression.recompress)
+RECOMPRESS_SAMPLE_SIZE = 256 * 1024  # Decompressed bytes the recompression codec is picked on
+RECOMPRESS_BLOCK_SIZE = 64 * 1024  # Decompressed input per step, a recompression can stop after any of them
+
+
+class CompressionOutcome(NamedTuple):
+    compressed_filename: str
+    compressed_path: str
+    compressed_file_size: int
+    compression_time: float
+    archive_mode: str = ''  # Mode used for multi-file jobs
+    preconditioner: str = ''  # Transform applied before LZMA, if any
+    codec: str = f'lzma-{LZMA_PRESET}'
+    digest: str = ''  # Of the original, single files only
+    compressed_digest: str = ''  # Of the artifact
+    member_digests: tuple = ()  # Of each member of an archive, in the order given
+
+
+class CodecTrial(NamedTuple):
+    """One codec's run in a comparison"""
+    codec: str
+    compressed_file_size: int
+    compression_time: float
+    memory: int
+
+
+def compressed_filename_for(original_filename, extension='.xz'):
+    """Return the .xz (or other codec's) name for a single file, keeping its original extension"""
+    # Format: originalname.original_ext.xz (so when decompressed, it becomes originalname.original_ext)
+    original_name, original_ext = os.path.splitext(original_filename)
+    if original_ext:
+        # If there's an extension, include it in the compressed filename
+        return f"{original_name}{original_ext}{extension}"
+    # If no extension, just add .xz
+    return f"{original_filename}{extension}"
+
+
+def archive_filename_for(original_filenames, suffix='.xz'):
+    """Return the name (.xz, or .tar for parallel archives) for an archive of several files"""
+    if len(original_filenames) <= 3:
+        filenames = [os.path.splitext(name)[0] for name in original_filenames]
+        compressed_filename = f"{'_'.join(filenames)}{suffix}"
+    else:
+        compressed_filename = f"{len(original_filenames)}_files_archive{suffix}"
+
+    # Ensure filename isn't too long
+    if len(compressed_filename) > 200:
+        compressed_filename = f"{len(original_filenames)}_files_archive{suffix}"
+    return compressed_filename
+
+
+def new_digest():
+    """Return the hash object used for integrity digests"""
+    return hashlib.sha256()
+
+
+class _HashingWriter:
+    """File wrapper that hashes everything written through it"""
+
+    def __init__(self, file, digest):
+        self.file = file
+        self.digest = digest
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def tell(self):
+        return self.file.tell()
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Yield a temporary path beside path for the block to write, then move it
+    onto path with os.replace(). Readers never see a partial artifact, and
+    a failed write leaves nothing behind.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.part')
+    os.close(fd)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def compress_file(source_path, compressed_path, preset=LZMA_PRESET, progress=None, compressor=None,
+                  digest=None, compressed_digest=None):
+    """
+    Compress source_path into compressed_path, return the compressed size.
+    The input is streamed through the compressor (LZMA at preset unless
+    another is given), progress(done, total) is called after every block read.
+    Hash objects passed as digest and compressed_digest are updated with the
+    input and output in the same pass.
+    """
+    total = os.path.getsize(source_path)
+    compressor = compressor or lzma.LZMACompressor(preset=preset)
+    done = 0
+    compressed_size = 0
+
+    with atomic_output(compressed_path) as temp_path, \
+            open(source_path, 'rb') as input_file, open(temp_path, 'wb') as output_file:
+        if compressed_digest:
+            output_file = _HashingWriter(output_file, compressed_digest)
+        while True:
+            block = input_file.read(COMPRESS_BLOCK_SIZE)
+            if not block:
+                break
+            if digest:
+                digest.update(block)
+            compressed_size += output_file.write(compressor.compress(block))
+            done += len(block)
+            if progress:
+                progress(done, total)
+        compressed_size += output_file.write(compressor.flush())
+    return compressed_size
+
+
+def compress_bytes(data, compressed_path, preset=LZMA_PRESET, progress=None, compressed_digest=None):
+    """Like compress_file() for data already in memory"""
+    total = len(data)
+    compressor = lzma.LZMACompressor(preset=preset)
+    compressed_size = 0
+
+    view = memoryview(data)
+    with atomic_output(compressed_path) as temp_path, open(temp_path, 'wb') as output_file:
+        if compressed_digest:
+            output_file = _HashingWriter(output_file, compressed_digest)
+        for done in range(0, total, COMPRESS_BLOCK_SIZE):
+            block = view[done:done + COMPRESS_BLOCK_SIZE]
+            compressed_size += output_file.write(compressor.compress(block))
+            if progress:
+                progress(done + len(block), total)
+        compressed_size += output_file.write(compressor.flush())
+    return compressed_size
+
+
+def choose_recompress_codec(sample, codecs=RECOMPRESS_CODECS):
+    """
+    The codec of codecs that compresses sample smallest. Each is tried in
+    turn through its probe, an encoder sized to the sample rather than a
+    full preset 9 extreme one.
+    """
+    def compressed_size(codec):
+        compressor = CODECS[codec].probe(len(sample))
+        return len(compressor.compress(sample)) + len(compressor.flush())
+    return min(codecs, key=compressed_size)
+
+
+def recompress_file(source_path, output_path, codec=None, should_stop=None, compressed_digest=None):
+    """
+    Decompress the .xz artifact at source_path and compress its content again
+    into output_path, with codec or else the best of RECOMPRESS_CODECS on the
+    first RECOMPRESS_SAMPLE_SIZE bytes. Return (codec, compressed size).
+    should_stop() is called after every RECOMPRESS_BLOCK_SIZE block; once it
+    returns True the work is abandoned and None returned. The xz check of
+    every block is verified as it is decompressed, so a damaged artifact
+    raises LZMAError.
+    """
+    with lzma.open(source_path, 'rb') as input_file, open(output_path, 'wb') as output_file:
+        block = input_file.read(RECOMPRESS_SAMPLE_SIZE)
+        codec = codec or choose_recompress_codec(block)
+        compressor = CODECS[codec].compressor()
+        if compressed_digest:
+            output_file = _HashingWriter(output_file, compressed_digest)
+        compressed_size = 0
+        while block:
+            if should_stop and should_stop():
+                return None
+            compressed_size += output_file.write(compressor.compress(block))
+            block = input_file.read(RECOMPRESS_BLOCK_SIZE)
+        compressed_size += output_file.write(compressor.flush())
+    return codec, compressed_size
+
+
+def _scaled(progress, offset, weight):
+    """Map a stage's progress onto [offset, offset + weight] of the whole job"""
+    if progress is None:
+        return None
+
+    def report(done, total):
+        progress(offset + weight * (done / total if total else 1), 1)
+    return report
+
+
+def _is_text(sample):
+    return b'\0' not in sample[:4096]
+
+
+def fingerprint(path):
+    """
+    Return (type key, MinHash sketch) for a file. The sketch is the set of the
+    FINGERPRINT_SIZE smallest hashes of the shingles in evenly spaced samples.
+    """
+    size = os.path.getsize(path)
+    samples = []
+    with open(path, 'rb') as f:
+        for index in range(FINGERPRINT_SAMPLES):
+            f.seek(size * index // FINGERPRINT_SAMPLES)
+            samples.append(f.read(FINGERPRINT_SAMPLE_SIZE))
+    hashes = {
+        zlib.crc32(sample[offset:offset + FINGERPRINT_SHINGLE])
+        for sample in samples
+        for offset in range(len(sample) - FINGERPRINT_SHINGLE + 1)
+    }
+    type_key = (os.path.splitext(path)[1].lower(), _is_text(samples[0]))
+    return type_key, frozenset(heapq.nsmallest(FINGERPRINT_SIZE, hashes))
+
+
+def resemblance(sketch, other):
+    """Estimate the Jaccard similarity of two files from their sketches"""
+    union = heapq.nsmallest(FINGERPRINT_SIZE, sketch | other)
+    if not union:
+        return 0.0
+    return sum(1 for value in union if value in sketch and value in other) / len(union)
+
+
+def order_members(members):
+    """
+    Order members for a solid archive: grouped by type (extension, text or
+    binary) in order of first appearance, and within a group chained so each
+    member is followed by the remaining one most similar to it.
+    """
+    groups = {}
+    for member in members:
+        type_key, sketch = fingerprint(member[0])
+        groups.setdefault(type_key, []).append((member, sketch))
+
+    ordered = []
+    for group in groups.values():
+        current, sketch = group.pop(0)
+        ordered.append(current)
+        while group:
+            index = max(range(len(group)), key=lambda i: resemblance(sketch, group[i][1]))
+            current, sketch = group.pop(index)
+            ordered.append(current)
+    return ordered
+
+
+def _zip_member(zipf, path, arcname, digest=None):
+    """Store path in zipf as arcname, hashing it on the way in"""
+    with open(path, 'rb') as source, zipf.open(zipfile.ZipInfo.from_file(path, arcname), 'w') as member:
+        while True:
+            block = source.read(COMPRESS_BLOCK_SIZE)
+            if not block:
+                break
+            if digest:
+                digest.update(block)
+            member.write(block)
+
+
+def compress_archive(members, compressed_path, preset=LZMA_PRESET, progress=None, reorder=True,
+                     member_digests=None, compressed_digest=None):
+    """
+    Zip members (a list of (path, arcname) pairs) and compress the zip with
+    LZMA into compressed_path as one solid stream. Return the compressed size.
+    Similar members are placed together first unless reorder is False.
+    member_digests, a hash object per member in the order given, are updated
+    while zipping.
+    """
+    digests = dict(zip(members, member_digests or ()))
+    if reorder:
+        members = order_members(members)
+    member_sizes = [os.path.getsize(path) for path, _ in members]
+    zipping = _scaled(progress, 0, ARCHIVE_STAGE_WEIGHT)
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_zip:
+        temp_zip_path = temp_zip.name
+    try:
+        # Members are stored, not deflated, so LZMA sees (and matches across) the raw data
+        with zipfile.ZipFile(temp_zip_path, 'w', zipfile.ZIP_STORED) as zipf:
+            for index, member in enumerate(members):
+                _zip_member(zipf, *member, digest=digests.get(member))
+                if zipping:
+                    zipping(sum(member_sizes[:index + 1]), sum(member_sizes))
+        return compress_file(
+            temp_zip_path, compressed_path, preset=preset,
+            progress=_scaled(progress, ARCHIVE_STAGE_WEIGHT, 1 - ARCHIVE_STAGE_WEIGHT),
+            compressed_digest=compressed_digest,
+        )
+    finally:
+        # Clean up temp zip file
+        os.unlink(temp_zip_path)
+
+
+def _wait_reporting(futures, progress, done, total):
+    """
+    Wait for futures, calling progress(done(), total) from this thread only
+    (the callback may use the database). Return their results, or raise the
+    first error.
+    """
+    results, pending = [], set(futures)
+    while pending:
+        finished, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+        for future in finished:
+            results.append(future.result())
+        if progress:
+            progress(done(), total)
+    return results
+
+
+def compress_parallel(members, compressed_path, preset=LZMA_PRESET, progress=None, workers=None,
+                      member_digests=None, compressed_digest=None):
+    """
+    Compress each of members (a list of (path, arcname) pairs) into its own
+    .xz on a pool of workers threads and collect them, uncompressed, in a tar
+    at compressed_path. Members can be extracted one at a time. Return the
+    archive size.
+    """
+    member_digests = member_digests or [None] * len(members)
+    member_sizes = [os.path.getsize(path) for path, _ in members]
+    total = sum(member_sizes)
+    done = [0] * len(members)
+
+    def member_progress(index):
+        def report(member_done, member_total):
+            done[index] = member_done
+        return report
+
+    compressed_dir = os.path.dirname(compressed_path)
+    os.makedirs(compressed_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=compressed_dir) as temp_dir:
+        parts = [os.path.join(temp_dir, f'{index}.xz') for index in range(len(members))]
+        compress_member = accounting.bind(compress_file)  # Charged to the job that called us
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = [
+                pool.submit(
+                    compress_member, path, part, preset, member_progress(index), digest=member_digests[index]
+                )
+                for index, ((path, _), part) in enumerate(zip(members, parts))
+            ]
+            _wait_reporting(futures, progress, lambda: sum(done), total)
+
+        with atomic_output(compressed_path) as temp_path, open(temp_path, 'wb') as output_file:
+            if compressed_digest:
+                output_file = _HashingWriter(output_file, compressed_digest)
+            with tarfile.open(fileobj=output_file, mode='w') as tar:
+                for part, (_, arcname) in zip(parts, members):
+                    tar.add(part, arcname=compressed_filename_for(arcname))
+    return os.path.getsize(compressed_path)
+
+
+def _read_sample(path, size):
+    """Read up to size bytes from the middle of a file, away from headers"""
+    with open(path, 'rb') as f:
+        f.seek(max(os.path.getsize(path) // 2 - size // 2, 0))
+        return f.read(size)
+
+
+def similarity_gain(paths):
+    """
+    Estimate how much compressing files together beats compressing them
+    apart, as the fraction saved on a small sample of each (0 = unrelated).
+    """
+    if len(paths) > SIMILARITY_MAX_SAMPLES:
+        step = len(paths) / SIMILARITY_MAX_SAMPLES
+        paths = [paths[int(index * step)] for index in range(SIMILARITY_MAX_SAMPLES)]
+    samples = [_read_sample(path, SIMILARITY_SAMPLE_SIZE) for path in paths]
+    apart = sum(len(lzma.compress(sample, preset=1)) for sample in samples)
+    together = len(lzma.compress(b''.join(samples), preset=1))
+    return 1 - together / apart if apart else 0
+
+
+def choose_archive_mode(members):
+    """Pick solid or parallel compression for members, a list of (path, arcname) pairs"""
+    sizes = [os.path.getsize(path) for path, _ in members]
+    total = sum(sizes)
+    if len(members) < PARALLEL_MIN_MEMBERS or total < len(members) * PARALLEL_MIN_AVERAGE_SIZE:
+        return ARCHIVE_SOLID
+    if max(sizes) > PARALLEL_MAX_SHARE * total:
+        return ARCHIVE_SOLID
+    if similarity_gain([path for path, _ in members]) > SIMILARITY_THRESHOLD:
+        return ARCHIVE_SOLID
+    return ARCHIVE_PARALLEL
+
+
+def compress_single(source_path, original_filename, compressed_dir, preset=LZMA_PRESET, progress=None,
+                    preconditioner=preconditioners.NONE):
+    """
+    Compress one uploaded file into compressed_dir. With a preconditioner
+    ('auto' to detect one) the .xz holds a container, named .lzpc, that
+    decodes back to the original.
+    """
+    start_time = time.time()
+    digest, compressed_digest = new_digest(), new_digest()
+    used, container = preconditioners.encode_file(
+        source_path, original_filename, preconditioner, size=os.path.getsize(source_path), digest=digest
+    )
+    if container is None:
+        compressed_filename = compressed_filename_for(original_filename)
+        compressed_path = os.path.join(compressed_dir, compressed_filename)
+        compressed_size = compress_file(
+            source_path, compressed_path, preset=preset, progress=progress,
+            digest=digest, compressed_digest=compressed_digest
+        )
+    else:
+        compressed_filename = compressed_filename_for(original_filename + preconditioners.CONTAINER_EXTENSION)
+        compressed_path = os.path.join(compressed_dir, compressed_filename)
+        compressed_size = compress_bytes(
+            container, compressed_path, preset=preset, progress=progress, compressed_digest=compressed_digest
+        )
+    return CompressionOutcome(
+        compressed_filename, compressed_path, compressed_size, time.time() - start_time,
+        preconditioner=used or '', codec=f'lzma-{preset}',
+        digest=digest.hexdigest(), compressed_digest=compressed_digest.hexdigest()
+    )
+
+
+def compress_delta(base, source_path, original_filename, compressed_dir, preset=LZMA_PRESET, progress=None):
+    """
+    Compress one uploaded file as a delta against base, the content of its
+    previous version, into compressed_dir (a .lzdelta inside the .xz). The
+    outcome's compressed_filename is the name the rebuilt version downloads as.
+    """
+    start_time = time.time()
+    digest, compressed_digest = new_digest(), new_digest()
+    with open(source_path, 'rb') as f:
+        content = f.read()
+    digest.update(content)
+    compressed_path = os.path.join(compressed_dir, compressed_filename_for(original_filename + delta.EXTENSION))
+    compressed_size = compress_bytes(
+        delta.encode(base, content), compressed_path, preset=preset, progress=progress,
+        compressed_digest=compressed_digest
+    )
+    return CompressionOutcome(
+        compressed_filename_for(original_filename), compressed_path, compressed_size, time.time() - start_time,
+        codec=f'lzma-{preset}', digest=digest.hexdigest(), compressed_digest=compressed_digest.hexdigest()
+    )
+
+
+def compress_deduplicated(source_path, original_filename, compressed_dir, records, preset=LZMA_PRESET,
+                          progress=None):
+    """
+    Compress one uploaded file as a chunk manifest laid out as records
+    (compression.manifest), into compressed_dir (a .lzchunks inside the .xz).
+    Only its literal chunks are compressed. The outcome's compressed_filename
+    is the name the rebuilt file downloads as.
+    """
+    start_time = time.time()
+    digest, compressed_digest = new_digest(), new_digest()
+    total = sum(record.size for record in records)
+    compressor = lzma.LZMACompressor(preset=preset)
+    compressed_path = os.path.join(compressed_dir, compressed_filename_for(original_filename + manifest.EXTENSION))
+    compressed_size = 0
+
+    with atomic_output(compressed_path) as temp_path, \
+            open(source_path, 'rb') as input_file, open(temp_path, 'wb') as output_file:
+        output_file = _HashingWriter(output_file, compressed_digest)
+        reported = 0
+        for piece in manifest.encode(input_file, records, digest):
+            compressed_size += output_file.write(compressor.compress(piece))
+            if progress and input_file.tell() - reported >= COMPRESS_BLOCK_SIZE:
+                reported = input_file.tell()
+                progress(reported, total)
+        compressed_size += output_file.write(compressor.flush())
+    if progress:
+        progress(total, total)
+    return CompressionOutcome(
+        compressed_filename_for(original_filename), compressed_path, compressed_size, time.time() - start_time,
+        codec=f'lzma-{preset}', digest=digest.hexdigest(), compressed_digest=compressed_digest.hexdigest()
+    )
+
+
+def compare_codecs(source_path, original_filename, compressed_dir, codecs=COMPARE_CODECS, keep=KEEP_BEST,
+                   progress=None, workers=1):
+    """
+    Compress one file with several codecs, one after another by default: a
+    compare job holds a single slot of the compression pool, so workers
+    above 1 (LZMA, bz2 and zlib all release the GIL) use cores outside
+    COMPRESSION_WORKERS. Keep the artifact of codec keep, or the smallest
+    one for 'best', in compressed_dir and delete the others. Return
+    (outcome, trials), trials in the order of codecs.
+    """
+    total = os.path.getsize(source_path)
+    done = dict.fromkeys(codecs, 0)
+    # The original is hashed by the first codec's pass, each artifact by its own
+    digest = new_digest()
+    compressed_digests = {codec: new_digest() for codec in codecs}
+
+    def run(codec, path):
+        def report(codec_done, codec_total):
+            done[codec] = codec_done
+        start = time.perf_counter()
+        size = compress_file(
+            source_path, path, progress=report, compressor=CODECS[codec].compressor(),
+            digest=digest if codec == codecs[0] else None, compressed_digest=compressed_digests[codec]
+        )
+        return CodecTrial(codec, size, time.perf_counter() - start, CODECS[codec].memory)
+
+    os.makedirs(compressed_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=compressed_dir) as temp_dir:
+        paths = {codec: os.path.join(temp_dir, codec) for codec in codecs}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(accounting.bind(run), codec, paths[codec]) for codec in codecs]
+            trials = _wait_reporting(futures, progress, lambda: sum(done.values()), total * len(codecs))
+        trials.sort(key=lambda trial: codecs.index(trial.codec))
+
+        if keep == KEEP_BEST:
+            kept = min(trials, key=lambda trial: trial.compressed_file_size)
+        else:
+            kept = trials[codecs.index(keep)]
+        compressed_filename = compressed_filename_for(original_filename, CODECS[kept.codec].extension)
+        compressed_path = os.path.join(compressed_dir, compressed_filename)
+        os.replace(paths[kept.codec], compressed_path)
+
+    outcome = CompressionOutcome(
+        compressed_filename, compressed_path, kept.compressed_file_size, kept.compression_time, codec=kept.codec,
+        digest=digest.hexdigest(), compressed_digest=compressed_digests[kept.codec].hexdigest()
+    )
+    return outcome, trials
+
+
+def compress_many(members, compressed_dir, preset=LZMA_PRESET, progress=None, mode=ARCHIVE_AUTO, workers=None,
+                  reorder=True):
+    """Archive and compress several uploaded files into compressed_dir, solid or in parallel"""
+    start_time = time.time()
+    if mode == ARCHIVE_AUTO:
+        mode = choose_archive_mode(members)
+    arcnames = [arcname for _, arcname in members]
+    member_digests = [new_digest() for _ in members]
+    compressed_digest = new_digest()
+
+    if mode == ARCHIVE_PARALLEL:
+        compressed_filename = archive_filename_for(arcnames, suffix='.tar')
+        compressed_path = os.path.join(compressed_dir, compressed_filename)
+        compressed_size = compress_parallel(
+            members, compressed_path, preset=preset, progress=progress, workers=workers,
+            member_digests=member_digests, compressed_digest=compressed_digest
+        )
+    else:
+        compressed_filename = archive_filename_for(arcnames)
+        compressed_path = os.path.join(compressed_dir, compressed_filename)
+        compressed_size = compress_archive(
+            members, compressed_path, preset=preset, progress=progress, reorder=reorder,
+            member_digests=member_digests, compressed_digest=compressed_digest
+        )
+    return CompressionOutcome(
+        compressed_filename, compressed_path, compressed_size, time.time() - start_time, mode,
+        codec=f'lzma-{preset}', compressed_digest=compressed_digest.hexdigest(),
+        member_digests=tuple(digest.hexdigest() for digest in member_digests)
+    )
+
+
+def iter_file(path, chunk_size=CHUNK_SIZE):
+    """Yield a file's content in chunks"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
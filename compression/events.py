@@ -0,0 +1,71 @@
+"""
+In-process publish/subscribe for compression job events.
+
+Workers publish a job's state transitions and progress ticks here, and the
+Server-Sent Events view forwards them to the browser. Nothing is written to
+the database per tick. Subscribers can be plain threads (WSGI) or coroutines
+on an event loop (ASGI); publishing is safe from any thread.
+"""
+import asyncio
+import queue
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+_subscribers = defaultdict(set)
+_subscribers_lock = threading.Lock()
+
+
+class Subscription:
+    """A queue of events for one job, readable from a thread or a coroutine"""
+
+    def __init__(self, loop=None):
+        self._loop = loop
+        self._queue = asyncio.Queue() if loop else queue.SimpleQueue()
+
+    def put(self, event):
+        if self._loop is None:
+            self._queue.put(event)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+        except RuntimeError:
+            # The subscriber's loop has already shut down
+            pass
+
+    def get(self, timeout):
+        """Block for the next event, return None after timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout):
+        """Wait for the next event, return None after timeout seconds"""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+@contextmanager
+def subscribe(job_id, loop=None):
+    """Receive events for job_id while the block runs; pass loop for async consumers"""
+    subscription = Subscription(loop)
+    with _subscribers_lock:
+        _subscribers[job_id].add(subscription)
+    try:
+        yield subscription
+    finally:
+        with _subscribers_lock:
+            _subscribers[job_id].discard(subscription)
+            if not _subscribers[job_id]:
+                del _subscribers[job_id]
+
+
+def publish(job_id, event):
+    """Send event to everyone subscribed to job_id"""
+    with _subscribers_lock:
+        subscriptions = list(_subscribers.get(job_id, ()))
+    for subscription in subscriptions:
+        subscription.put(event)
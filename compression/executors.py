@@ -0,0 +1,59 @@
+"""
+Bounded executors used by the async views.
+
+Blocking disk I/O and CPU-bound LZMA work must never run on the event loop.
+Both are handed to fixed-size thread pools instead, so a burst of requests
+queues up behind the pools rather than spawning a thread per connection.
+LZMA releases the GIL while it compresses, so threads are enough to keep
+several cores busy; compression jobs are queued on that pool by
+compression.jobs. Background verification (compression.verifier) and
+recompression (compression.recompress) each get a pool of their own with a
+single thread.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    """Return the shared executor for 'io', 'compression', 'verify' or 'recompress' work"""
+    with _executors_lock:
+        if name not in _executors:
+            if name == 'io':
+                max_workers = settings.COMPRESSION_IO_WORKERS
+            elif name in ('verify', 'recompress'):
+                max_workers = 1
+            else:
+                max_workers = settings.COMPRESSION_WORKERS
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=f'compression-{name}'
+            )
+        return _executors[name]
+
+
+async def run_io(func, *args, **kwargs):
+    """Run blocking filesystem work on the bounded I/O pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor('io'), functools.partial(func, *args, **kwargs))
+
+
+async def run_compression(func, *args, **kwargs):
+    """Run CPU-bound LZMA work on the compression pool, alongside the jobs"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor('compression'), functools.partial(func, *args, **kwargs))
+
+
+async def aiter_in_executor(iterator):
+    """Advance a blocking iterator on the I/O pool, one item at a time"""
+    sentinel = object()
+    while True:
+        item = await run_io(next, iterator, sentinel)
+        if item is sentinel:
+            break
+        yield item
@@ -0,0 +1,133 @@
+"""
+Streaming CSV and JSON export of compression history.
+
+Rows are read with values_list() in chunks of EXPORT_CHUNK_SIZE
+(.iterator(), advanced from a worker thread under ASGI) and encoded one at a
+time into a StreamingHttpResponse, so an export of any length runs in
+constant memory and its first bytes go out before the last rows are read.
+"""
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+FORMAT_CSV = 'csv'
+FORMAT_JSON = 'json'
+FORMATS = {FORMAT_CSV: 'text/csv', FORMAT_JSON: 'application/json'}
+
+EXPORT_CHUNK_SIZE = 2000  # Rows fetched per database round-trip
+
+# (column name, lookup on CompressionResult)
+EXPORT_COLUMNS = [
+    ('result_id', 'id'),
+    ('user', 'file__user__username'),
+    ('timestamp', 'timestamp'),
+    ('original_filename', 'file__original_filename'),
+    ('original_file_size', 'file__original_file_size'),
+    ('original_sha256', 'file__sha256'),
+    ('compressed_filename', 'compressed_filename'),
+    ('compressed_file_size', 'compressed_file_size'),
+    ('compressed_sha256', 'compressed_sha256'),
+    ('compression_ratio', 'compression_ratio'),
+    ('compression_time', 'compression_time'),
+    ('codec', 'codec'),
+    ('archive_mode', 'archive_mode'),
+    ('preconditioner', 'preconditioner'),
+    ('verification', 'verification'),
+    ('downloaded', 'downloaded'),
+    ('cpu_user_time', 'cpu_user_time'),
+    ('cpu_system_time', 'cpu_system_time'),
+    ('peak_memory', 'peak_memory'),
+    ('bytes_read', 'bytes_read'),
+    ('bytes_written', 'bytes_written'),
+]
+HEADER = [name for name, _ in EXPORT_COLUMNS]
+
+
+class _Echo:
+    """File-like object whose write() hands back the line, so csv.writer can encode one row at a time"""
+
+    def write(self, value):
+        return value
+
+
+def _rows(queryset):
+    # Ordered by primary key so the export is stable and needs no sort on an unindexed column
+    return queryset.order_by('pk').values_list(*(lookup for _, lookup in EXPORT_COLUMNS))
+
+
+def _next_chunk(rows):
+    return list(islice(rows, EXPORT_CHUNK_SIZE))
+
+
+async def _arows(queryset):
+    """_rows() for async iteration, a chunk per trip to a worker thread"""
+    # Not QuerySet.aiterator(): for values_list() it runs the query on the event loop
+    rows = _rows(queryset).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    try:
+        while chunk := await sync_to_async(_next_chunk)(rows):
+            for row in chunk:
+                yield row
+    finally:
+        await sync_to_async(rows.close)()  # Releases the cursor when the client goes away mid-export
+
+
+def _csv_line(writer, row):
+    return writer.writerow(value.isoformat() if hasattr(value, 'isoformat') else value for value in row)
+
+
+def _json_line(row, first):
+    return ('[\n' if first else ',\n') + json.dumps(dict(zip(HEADER, row)), cls=DjangoJSONEncoder)
+
+
+def iter_csv(queryset):
+    """Yield the queryset's results as CSV lines (WSGI)"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HEADER)
+    for row in _rows(queryset).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield _csv_line(writer, row)
+
+
+async def aiter_csv(queryset):
+    """Yield the queryset's results as CSV lines (ASGI)"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HEADER)
+    async for row in _arows(queryset):
+        yield _csv_line(writer, row)
+
+
+def iter_json(queryset):
+    """Yield the queryset's results as a JSON array, one object per line (WSGI)"""
+    first = True
+    for row in _rows(queryset).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield _json_line(row, first)
+        first = False
+    yield '[]\n' if first else '\n]\n'
+
+
+async def aiter_json(queryset):
+    """Yield the queryset's results as a JSON array, one object per line (ASGI)"""
+    first = True
+    async for row in _arows(queryset):
+        yield _json_line(row, first)
+        first = False
+    yield '[]\n' if first else '\n]\n'
+
+
+def export_response(request, queryset, export_format, basename='compression-history'):
+    """StreamingHttpResponse downloading the queryset's results as CSV or JSON"""
+    if isinstance(request, ASGIRequest):
+        # An async iterator, a synchronous one would be read into a list before sending
+        stream = (aiter_csv if export_format == FORMAT_CSV else aiter_json)(queryset)
+    else:
+        stream = (iter_csv if export_format == FORMAT_CSV else iter_json)(queryset)
+    response = StreamingHttpResponse(stream, content_type=FORMATS[export_format])
+    filename = f"{basename}-{timezone.now():%Y%m%d-%H%M%S}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,160 @@
+"""
+Background execution of compression jobs.
+
+An upload creates a CompressionJob and hands its id to submit(), which queues
+it on the bounded compression pool and returns straight away. The worker
+records each state transition on the job row and publishes it, together with
+fine-grained progress ticks, through compression.events.
+
+Waiting jobs are started shortest first by their predicted duration (see
+compression.predictor). A job's estimate counts down while it waits, so a
+long job is never starved by a stream of short ones.
+
+With COMPRESSION_VERIFY set, every completed result is handed to
+compression.verifier, which checks it once the queue is idle.
+With COMPRESSION_RECOMPRESS set, every completed job also schedules a sweep
+of cold artifacts by compression.recompress, which yields to new jobs.
+"""
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import events, recompress, verifier
+from .database import refresh_connections, worker_connections
+from .executors import get_executor
+from .models import CompressionJob
+
+logger = logging.getLogger(__name__)
+
+# Progress ticks are published on every percent but only saved every 10%
+PROGRESS_SAVE_STEP = 10
+
+
+class ProgressTracker:
+    """Engine progress callback that publishes ticks for one job"""
+
+    def __init__(self, job):
+        self.job = job
+        self.published = 0
+        self.saved = 0
+
+    def __call__(self, done, total):
+        # 100% is only reported once the result has been recorded
+        percent = min(int(done * 100 / total), 99) if total else 99
+        if percent <= self.published:
+            return
+        self.published = percent
+        events.publish(self.job.id, self.job.to_event(progress=percent))
+        if percent >= self.saved + PROGRESS_SAVE_STEP:
+            # Keep the row roughly current for clients that fall back to polling
+            self.saved = percent
+            refresh_connections()  # Possibly minutes since this thread's last query
+            CompressionJob.objects.filter(pk=self.job.pk).update(progress=percent)
+
+
+def _transition(job, status):
+    job.status = status
+    if status == CompressionJob.STATUS_COMPLETED:
+        job.progress = 100
+    job.save()
+    events.publish(job.id, job.to_event())
+
+
+def run_job(job_id):
+    """Compress every file of a job and record the outcome on it"""
+    # Imported here, the views import this module to submit jobs
+    from .views import compress_multiple_files, compress_single_file
+
+    job = CompressionJob.objects.get(pk=job_id)
+    file_records = list(job.files.order_by('id'))
+    _transition(job, CompressionJob.STATUS_RUNNING)
+
+    try:
+        if len(file_records) == 1:
+            compression_result = compress_single_file(
+                file_records[0], progress=ProgressTracker(job), preconditioner=job.preconditioner,
+                compare=job.compare
+            )
+        else:
+            compression_result = compress_multiple_files(
+                file_records, progress=ProgressTracker(job), mode=job.archive_mode
+            )
+    except Exception as e:
+        logger.exception("Compression job %s failed", job_id)
+        job.error = str(e)
+        _transition(job, CompressionJob.STATUS_FAILED)
+        return
+
+    job.result = compression_result
+    _transition(job, CompressionJob.STATUS_COMPLETED)
+    if settings.COMPRESSION_VERIFY:
+        verifier.schedule(compression_result.id)
+    if settings.COMPRESSION_RECOMPRESS:
+        recompress.schedule()
+
+
+def _run_in_worker(job_id):
+    # Worker threads outlive requests, so manage their connection like a request would
+    with worker_connections():
+        try:
+            run_job(job_id)
+        except Exception:
+            logger.exception("Compression job %s could not be run", job_id)
+
+
+# Jobs waiting for a worker: job_id -> (estimated seconds, time queued)
+_waiting = {}
+_waiting_lock = threading.Lock()
+_running = 0  # Jobs on a worker, guarded by _waiting_lock
+
+
+def is_idle():
+    """Whether no compression job is waiting or running in this process"""
+    with _waiting_lock:
+        return not _waiting and not _running
+
+
+def _take_shortest():
+    """Remove and return the waiting job with the least estimated time left after its wait"""
+    now = time.monotonic()
+    with _waiting_lock:
+        job_id = min(_waiting, key=lambda key: _waiting[key][0] - (now - _waiting[key][1]))
+        del _waiting[job_id]
+    return job_id
+
+
+def _run_shortest():
+    # One of these is queued per submitted job, each runs whichever job is shortest by then
+    global _running
+    with _waiting_lock:
+        _running += 1
+    try:
+        _run_in_worker(_take_shortest())
+    finally:
+        with _waiting_lock:
+            _running -= 1
+
+
+def _enqueue(job_id, estimated_seconds):
+    with _waiting_lock:
+        _waiting[job_id] = (estimated_seconds or 0.0, time.monotonic())
+    get_executor('compression').submit(_run_shortest)
+
+
+def submit(job_id, estimated_seconds=None):
+    """Queue a job on the compression pool, or run it now when COMPRESSION_JOBS_EAGER is set"""
+    if settings.COMPRESSION_JOBS_EAGER:
+        run_job(job_id)
+    else:
+        _enqueue(job_id, estimated_seconds)
+
+
+async def asubmit(job_id, estimated_seconds=None):
+    """Async variant of submit() for the async views"""
+    if settings.COMPRESSION_JOBS_EAGER:
+        await sync_to_async(run_job)(job_id)
+    else:
+        _enqueue(job_id, estimated_seconds)
@@ -0,0 +1,211 @@
+import fnmatch
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.template.defaultfilters import filesizeformat
+
+from compression import accounting, engine, preconditioners, storage
+from compression.database import refresh_connections
+from compression.models import CompressionResult, File
+from users.auth_backends import users_with_email
+
+
+class Command(BaseCommand):
+    help = (
+        "Compress every file under a server-side directory on a process pool, "
+        "registering File/CompressionResult rows for a user. Files already "
+        "registered are skipped, so an interrupted run can simply be restarted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Directory to walk")
+        parser.add_argument('--user', required=True, help="Email of the user who owns the results")
+        parser.add_argument(
+            '--workers', type=int, default=settings.COMPRESSION_WORKERS,
+            help="Compression processes (default: COMPRESSION_WORKERS)"
+        )
+        parser.add_argument('--pattern', default='*', help="Only compress files whose name matches this glob")
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help="Results registered per database transaction"
+        )
+        parser.add_argument('--preset', type=int, default=engine.LZMA_PRESET, help="LZMA preset (0-9)")
+        parser.add_argument(
+            '--preconditioner', choices=preconditioners.CHOICES, default=preconditioners.NONE,
+            help="Reversible transform applied before LZMA ('auto' detects one per file)"
+        )
+
+    def handle(self, *args, **options):
+        directory = os.path.realpath(options['directory'])
+        if not os.path.isdir(directory):
+            raise CommandError(f"{options['directory']} is not a directory")
+        # Legacy rows may share an address, so don't guess whose results these are
+        users = list(users_with_email(options['user'])[:2])
+        if not users:
+            raise CommandError(f"No user with email {options['user']}")
+        if len(users) > 1:
+            raise CommandError(f"Several users have email {options['user']}")
+        user, = users
+
+        sources = self._find_sources(directory, options['pattern'])
+        done = self._registered(user, directory)
+        pending = [(path, relative_path) for path, relative_path in sources if path not in done]
+        self.stdout.write(
+            f"{len(sources)} files found, {len(sources) - len(pending)} already compressed, {len(pending)} to go "
+            f"on {options['workers']} workers"
+        )
+        if not pending:
+            return
+
+        # Don't let forked workers inherit open database connections (unless the
+        # caller holds a transaction on them, as when called from a test)
+        if not connection.in_atomic_block:
+            connections.close_all()
+
+        start_time = time.time()
+        totals = {'files': 0, 'failed': 0, 'original': 0, 'compressed': 0, 'cpu_time': 0.0}
+        batch, collected = [], set()
+        pool = ProcessPoolExecutor(max_workers=options['workers'])
+        futures = {}
+        try:
+            for path, relative_path in pending:
+                # Each file is compressed from a link in the upload area, which its File row records
+                file_path = storage.upload_path(user.id, path)
+                future = pool.submit(
+                    _compress_measured, path, file_path, _artifact_name(relative_path),
+                    storage.artifact_dir(user.id), options['preset'], preconditioner=options['preconditioner'],
+                )
+                futures[future] = (path, relative_path, file_path)
+            for future in as_completed(futures):
+                path, relative_path, file_path = futures[future]
+                collected.add(future)
+                try:
+                    outcome, usage = future.result()
+                except Exception as e:
+                    totals['failed'] += 1
+                    self.stderr.write(f"Failed to compress {relative_path}: {e}")
+                    continue
+
+                batch.append((path, relative_path, file_path, os.path.getsize(path), outcome, usage))
+                if len(batch) >= options['batch_size']:
+                    self._register(user, batch, totals)
+                    batch = []
+            self._register(user, batch, totals)
+            batch = []
+        finally:
+            # If interrupted, stop the queued files, and delete what the finished
+            # ones left behind that isn't registered, so nothing is orphaned
+            pool.shutdown(cancel_futures=True)
+            unregistered = [(file_path, outcome) for _, _, file_path, _, outcome, _ in batch]
+            for future, (_, _, file_path) in futures.items():
+                if future not in collected and not future.cancelled() and future.exception() is None:
+                    unregistered.append((file_path, future.result()[0]))
+            _remove_files(unregistered)
+
+        self._report(totals, time.time() - start_time)
+
+    def _find_sources(self, directory, pattern):
+        """Return (path, path relative to directory) for every regular file, sorted"""
+        sources = []
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if fnmatch.fnmatch(name, pattern) and os.path.isfile(path) and not os.path.islink(path):
+                    sources.append((path, os.path.relpath(path, directory)))
+        return sources
+
+    def _registered(self, user, directory):
+        """Source paths under directory the user already has results for"""
+        # One prefix filter rather than a parameter per file; results registered before
+        # File.source_path existed recorded the source as their file_path
+        prefix = os.path.join(directory, '')
+        rows = File.objects.filter(
+            Q(source_path__startswith=prefix) | Q(file_path__startswith=prefix),
+            user=user, compressionresult__isnull=False,
+        ).values_list('source_path', 'file_path')
+        return {source_path or file_path for source_path, file_path in rows}
+
+    def _register(self, user, batch, totals):
+        """Register a batch of finished files with one File and one CompressionResult insert"""
+        if not batch:
+            return
+
+        refresh_connections()  # A whole batch was compressed since the last query
+        with transaction.atomic():
+            file_records = File.objects.bulk_create_with_ids([
+                File(
+                    user=user, original_filename=relative_path, original_file_size=size, file_path=file_path,
+                    source_path=path, sha256=outcome.digest
+                )
+                for path, relative_path, file_path, size, outcome, _ in batch
+            ])
+            CompressionResult.objects.bulk_create([
+                CompressionResult(
+                    file=file_record,
+                    compressed_filename=outcome.compressed_filename,
+                    compressed_path=outcome.compressed_path,
+                    compressed_file_size=outcome.compressed_file_size,
+                    compression_ratio=(1 - outcome.compressed_file_size / size) * 100 if size else 0.0,
+                    compression_time=outcome.compression_time,
+                    download_link=f"/compression/download/{file_record.id}/",
+                    preconditioner=outcome.preconditioner,
+                    codec=outcome.codec,
+                    compressed_sha256=outcome.compressed_digest,
+                    **usage._asdict()
+                )
+                for file_record, (_, _, _, size, outcome, usage) in zip(file_records, batch)
+            ])
+        _remove_files([(file_path, None) for _, _, file_path, _, _, _ in batch])  # The links, as uploads are
+
+        for _, _, _, size, outcome, _ in batch:
+            totals['files'] += 1
+            totals['original'] += size
+            totals['compressed'] += outcome.compressed_file_size
+            totals['cpu_time'] += outcome.compression_time
+        self.stdout.write(f"  registered {totals['files']} files")
+
+    def _report(self, totals, elapsed):
+        original, compressed = totals['original'], totals['compressed']
+        ratio = (1 - compressed / original) * 100 if original else 0.0
+        throughput = original / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Compressed {totals['files']} files ({totals['failed']} failed) in {elapsed:.2f} s: "
+            f"{filesizeformat(original)} -> {filesizeformat(compressed)} ({ratio:.2f}% reduction), "
+            f"{filesizeformat(throughput)}/s aggregate, "
+            f"{totals['cpu_time'] / elapsed if elapsed else 0.0:.1f}x parallel speed-up"
+        ))
+
+
+def _compress_measured(source_path, file_path, *args, **kwargs):
+    """
+    Link source_path to file_path and engine.compress_single() that in a
+    worker process, returning (outcome, accounting.Usage)
+    """
+    storage.link_file(source_path, file_path)
+    try:
+        with accounting.measure() as meter:
+            outcome = engine.compress_single(file_path, *args, **kwargs)
+    except BaseException:
+        os.remove(file_path)
+        raise
+    return outcome, meter.usage
+
+
+def _remove_files(files):
+    """Delete the (upload link, outcome) of files, the outcome's artifact unless it is None"""
+    for file_path, outcome in files:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        if outcome is not None and os.path.exists(outcome.compressed_path):
+            storage.remove_artifact(outcome.compressed_path)
+
+
+def _artifact_name(relative_path):
+    """Flatten a relative path into a single artifact file name"""
+    return relative_path.replace(os.sep, '__')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from compression import recompress
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-encode artifacts left undownloaded for COMPRESSION_RECOMPRESS_AFTER "
+        "seconds at LZMA preset 9 extreme, keeping each new artifact if it is smaller."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help="Try at most this many results")
+
+    def handle(self, *args, **options):
+        tried, shrunk, saved, _ = recompress.sweep(limit=options['limit'])
+        self.stdout.write(f"{shrunk} of {tried} cold artifacts recompressed, {saved} bytes saved")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from compression import verifier
+from compression.models import CompressionResult
+
+
+class Command(BaseCommand):
+    help = (
+        "Round-trip the artifacts of results not yet downloaded against the "
+        "digests recorded when they were compressed, flagging corrupt ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true', help="Re-check results already verified, not only pending ones"
+        )
+
+    def handle(self, *args, **options):
+        results = CompressionResult.objects.filter(downloaded=False).select_related('file').order_by('id')
+        if not options['all']:
+            results = results.filter(verification=CompressionResult.VERIFICATION_PENDING)
+
+        counts = {True: 0, False: 0, None: 0}
+        for result in results.iterator():
+            intact = verifier.verify_result(result)
+            counts[intact] += 1
+            if intact is False:
+                self.stdout.write(self.style.ERROR(f"  corrupt: result {result.id} ({result.compressed_filename})"))
+        self.stdout.write(
+            f"{counts[True]} verified, {counts[False]} corrupt, {counts[None]} skipped (artifact gone or no digests)"
+        )
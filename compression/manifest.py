@@ -0,0 +1,122 @@
+"""
+Chunk manifests: a file as its content-defined chunks, stored or referenced.
+
+A deduplicated artifact (compression.dedup) decompresses to a manifest:
+MAGIC, then one record per chunk of the file (compression.chunking), in
+order. A LITERAL record holds the chunk, its length (Q) then the bytes. A
+REFERENCE record points at a chunk stored elsewhere (QQQ): a result id, or
+SELF for an earlier record of the same manifest, and the chunk's offset and
+length in that artifact's decompressed content. That content is the file
+itself for an artifact holding one complete, and the manifest for another
+deduplicated one, so a reference never leads to a further one.
+"""
+import hashlib
+import struct
+from typing import NamedTuple
+
+from .chunking import iter_chunks
+
+MAGIC = b'LZCHUNK1'
+LITERAL = b'L'
+REFERENCE = b'R'
+SELF = 0  # Result id of references to the manifest they are in
+CHUNK_SIZE = 8192  # Average chunk, each stored one costs a row in the chunk store
+EXTENSION = '.lzchunks'  # Of deduplicated artifacts, before the codec's own
+
+_LITERAL = struct.Struct('<Q')
+_REFERENCE = struct.Struct('<QQQ')
+
+
+class Chunk(NamedTuple):
+    digest: str
+    size: int
+
+
+class Record(NamedTuple):
+    """One chunk of a manifest: literal (source None), or where it is stored"""
+    size: int
+    source: int = None  # Result id or SELF, None for a literal
+    offset: int = 0  # In the source's decompressed content, or, for a literal, of its bytes in this manifest
+
+
+def chunk_digest(chunk):
+    return hashlib.blake2b(chunk, digest_size=16).hexdigest()
+
+
+def chunk_file(path, average=CHUNK_SIZE):
+    """The Chunks of the file at path"""
+    with open(path, 'rb') as f:
+        return [Chunk(chunk_digest(chunk), len(chunk)) for chunk in iter_chunks(f, average)]
+
+
+def layout(chunks, stored):
+    """
+    The Records of a manifest for chunks, given stored, which maps the
+    digests of chunks stored elsewhere to (result id, offset). A chunk that
+    occurs more than once is only a literal the first time.
+    """
+    records, position, literals = [], len(MAGIC), {}
+    for chunk in chunks:
+        if chunk.digest in stored:
+            source, offset = stored[chunk.digest]
+            records.append(Record(chunk.size, source, offset))
+            position += 1 + _REFERENCE.size
+        elif chunk.digest in literals:
+            records.append(Record(chunk.size, SELF, literals[chunk.digest]))
+            position += 1 + _REFERENCE.size
+        else:
+            position += 1 + _LITERAL.size
+            literals[chunk.digest] = position
+            records.append(Record(chunk.size, None, position))
+            position += chunk.size
+    return records
+
+
+def encode(file, records, digest=None):
+    """
+    Yield, in pieces, the manifest of a binary file object laid out as
+    records. A hash object passed as digest is updated with the file.
+    """
+    yield MAGIC
+    for record in records:
+        chunk = file.read(record.size)
+        if len(chunk) != record.size:
+            raise ValueError("The file changed since it was chunked")
+        if digest:
+            digest.update(chunk)
+        if record.source is None:
+            yield LITERAL + _LITERAL.pack(record.size) + chunk
+        else:
+            yield REFERENCE + _REFERENCE.pack(record.source, record.offset, record.size)
+
+
+def _read(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated chunk manifest")
+    return data
+
+
+def decode(stream, read_reference):
+    """
+    Yield the content a manifest, read from the binary stream, describes.
+    read_reference(source, offset, size) returns a referenced chunk. Raise
+    ValueError if the stream isn't a complete manifest.
+    """
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a chunk manifest")
+    while True:
+        kind = stream.read(1)
+        if not kind:
+            return
+        if kind == LITERAL:
+            size, = _LITERAL.unpack(_read(stream, _LITERAL.size))
+            yield _read(stream, size)
+        elif kind == REFERENCE:
+            source, offset, size = _REFERENCE.unpack(_read(stream, _REFERENCE.size))
+            chunk = read_reference(source, offset, size)
+            if len(chunk) != size:
+                raise ValueError(f"Referenced chunk at {offset} is past the end of its artifact")
+            yield chunk
+        else:
+            raise ValueError(f"Unknown manifest record {kind!r}")
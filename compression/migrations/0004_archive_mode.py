@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0003_compressionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressionjob',
+            name='archive_mode',
+            field=models.CharField(choices=[('auto', 'Automatic'), ('solid', 'Solid (one stream, best ratio)'), ('parallel', 'Parallel (one stream per file, faster)')], default='auto', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='archive_mode',
+            field=models.CharField(blank=True, choices=[('auto', 'Automatic'), ('solid', 'Solid (one stream, best ratio)'), ('parallel', 'Parallel (one stream per file, faster)')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0004_archive_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressionjob',
+            name='preconditioner',
+            field=models.CharField(choices=[('none', 'None'), ('auto', 'Automatic'), ('columnar', 'Columnar (CSV/TSV)')], default='none', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='preconditioner',
+            field=models.CharField(blank=True, choices=[('none', 'None'), ('auto', 'Automatic'), ('columnar', 'Columnar (CSV/TSV)')], max_length=20),
+        ),
+    ]
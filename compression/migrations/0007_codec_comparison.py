@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0006_shuffle_preconditioner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressionjob',
+            name='compare',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='codec',
+            field=models.CharField(default='lzma-6', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='CodecTrial',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codec', models.CharField(max_length=20)),
+                ('compressed_file_size', models.BigIntegerField()),
+                ('compression_time', models.FloatField()),
+                ('memory', models.BigIntegerField()),
+                ('kept', models.BooleanField(default=False)),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='codec_trials', to='compression.compressionresult')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0007_codec_comparison'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressionjob',
+            name='estimated_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='compressionjob',
+            name='estimated_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0008_job_estimate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressionresult',
+            name='compressed_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='verification',
+            field=models.CharField(choices=[('pending', 'Not verified'), ('ok', 'Verified'), ('corrupt', 'Corrupt')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='verified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
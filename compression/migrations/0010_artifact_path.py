@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0009_digests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressionresult',
+            name='compressed_path',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
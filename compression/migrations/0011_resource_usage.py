@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0010_artifact_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressionresult',
+            name='bytes_read',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='bytes_written',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='cpu_system_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='cpu_user_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='peak_memory',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
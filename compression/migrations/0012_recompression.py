@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0011_resource_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressionresult',
+            name='recompressed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-19 02:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0012_recompression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressionresult',
+            name='delta_base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='delta_dependents', to='compression.compressionresult'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='previous_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='next_versions', to='compression.file'),
+        ),
+    ]
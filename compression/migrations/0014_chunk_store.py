@@ -0,0 +1,57 @@
+# Generated by Django 5.2.6 on 2026-10-19 02:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0013_dataset_versions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compressionresult',
+            name='dedup_time_saved',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='deduplicated_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ChunkReference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='compression.compressionresult')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='compression.compressionresult')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='compressionresult',
+            name='chunk_sources',
+            field=models.ManyToManyField(blank=True, related_name='chunk_dependents', through='compression.ChunkReference', to='compression.compressionresult'),
+        ),
+        migrations.CreateModel(
+            name='Chunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=32)),
+                ('size', models.PositiveIntegerField()),
+                ('offset', models.BigIntegerField()),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='compression.compressionresult')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'digest'), name='unique_user_chunk')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='chunkreference',
+            constraint=models.UniqueConstraint(fields=('result', 'source'), name='unique_chunk_reference'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compression', '0014_chunk_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='source_path',
+            field=models.CharField(blank=True, db_index=True, max_length=500),
+        ),
+    ]
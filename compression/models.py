@@ -1,7 +1,118 @@
-from django.db import models
+import os
+
+from django.db import connection, models
 from django.contrib.auth.models import User
+from django.urls import reverse
 from django.utils import timezone
 
+from . import engine, preconditioners, storage
+
+ARCHIVE_MODE_CHOICES = [
+    (engine.ARCHIVE_AUTO, 'Automatic'),
+    (engine.ARCHIVE_SOLID, 'Solid (one stream, best ratio)'),
+    (engine.ARCHIVE_PARALLEL, 'Parallel (one stream per file, faster)'),
+]
+
+PRECONDITIONER_CHOICES = [
+    (preconditioners.NONE, 'None'),
+    (preconditioners.AUTO, 'Automatic'),
+    ('columnar', 'Columnar (CSV/TSV)'),
+    ('shuffle', 'Byte shuffle (numeric arrays)'),
+]
+
+
+class CompressionJobManager(models.Manager):
+    def bulk_create_with_ids(self, jobs):
+        """
+        bulk_create jobs and make sure each one has its primary key. Backends
+        that can't return the keys from the insert (MySQL) save them one by one.
+        """
+        if connection.features.can_return_rows_from_bulk_insert:
+            return self.bulk_create(jobs)
+        for job in jobs:
+            job.save(force_insert=True)
+        return jobs
+
+
+class CompressionJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)  # Percentage, persisted coarsely
+    result = models.OneToOneField(
+        'CompressionResult', null=True, blank=True, on_delete=models.SET_NULL, related_name='job'
+    )
+    error = models.TextField(blank=True)
+    archive_mode = models.CharField(
+        max_length=20, choices=ARCHIVE_MODE_CHOICES, default=engine.ARCHIVE_AUTO
+    )  # Requested mode for multi-file jobs
+    preconditioner = models.CharField(
+        max_length=20, choices=PRECONDITIONER_CHOICES, default=preconditioners.NONE
+    )  # Requested transform before LZMA, single-file jobs
+    compare = models.CharField(
+        max_length=20, blank=True
+    )  # Codec to keep ('best' or a codec key) when comparing codecs, blank for a normal job
+    estimated_size = models.BigIntegerField(null=True, blank=True)  # Predicted compressed size in bytes
+    estimated_seconds = models.FloatField(null=True, blank=True)  # Predicted compression time
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CompressionJobManager()
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status}) - {self.user.username}"
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+    def to_event(self, progress=None):
+        """Return the job state as sent to the browser (progress view and event stream)"""
+        event = {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': 100 if self.status == self.STATUS_COMPLETED else (progress or self.progress),
+        }
+        if self.estimated_seconds is not None:
+            event['estimate'] = {'compressed_size': self.estimated_size, 'seconds': round(self.estimated_seconds, 2)}
+        if self.status == self.STATUS_COMPLETED and self.result_id:
+            event['redirect_url'] = reverse('compression_results', kwargs={'result_id': self.result_id})
+        elif self.status == self.STATUS_FAILED:
+            event['message'] = self.error
+        return event
+
+
+class FileManager(models.Manager):
+    def bulk_create_with_ids(self, file_records, batch_size=None):
+        """
+        bulk_create File rows and make sure each one has its primary key.
+        SQLite, PostgreSQL and MariaDB return the keys from the insert;
+        on MySQL they are looked up afterwards by (user, file_path).
+        """
+        created = self.bulk_create(file_records, batch_size=batch_size)
+        if connection.features.can_return_rows_from_bulk_insert:
+            return created
+
+        pending = {(f.user_id, f.file_path): f for f in created}
+        rows = self.filter(
+            user_id__in={f.user_id for f in created}, file_path__in=[f.file_path for f in created]
+        ).order_by('pk').values_list('pk', 'user_id', 'file_path')
+        for pk, user_id, file_path in rows:
+            if (user_id, file_path) in pending:
+                pending[(user_id, file_path)].pk = pk
+        return created
+
 
 class File(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -9,14 +120,36 @@ class File(models.Model):
     original_file_size = models.BigIntegerField()  # Size in bytes
     upload_timestamp = models.DateTimeField(default=timezone.now)
     file_path = models.CharField(max_length=500)  # Path to uploaded file
+    source_path = models.CharField(
+        max_length=500, blank=True, db_index=True
+    )  # Server-side file it was linked from by compress_tree, which resumes by it
+    job = models.ForeignKey(
+        CompressionJob, null=True, blank=True, on_delete=models.SET_NULL, related_name='files'
+    )  # Job compressing this upload
+    sha256 = models.CharField(max_length=64, blank=True)  # Of the original, hashed while it was compressed
+    previous_version = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.SET_NULL, related_name='next_versions'
+    )  # Earlier upload of the same dataset, see compression.versions
+
+    objects = FileManager()
 
     def __str__(self):
         return f"{self.original_filename} - {self.user.username}"
 
 
 class CompressionResult(models.Model):
+    VERIFICATION_PENDING = 'pending'
+    VERIFICATION_OK = 'ok'
+    VERIFICATION_CORRUPT = 'corrupt'
+    VERIFICATION_CHOICES = [
+        (VERIFICATION_PENDING, 'Not verified'),
+        (VERIFICATION_OK, 'Verified'),
+        (VERIFICATION_CORRUPT, 'Corrupt'),
+    ]
+
     file = models.OneToOneField(File, on_delete=models.CASCADE)
     compressed_filename = models.CharField(max_length=255)
+    compressed_path = models.CharField(max_length=500, blank=True)  # Artifact on disk, see compression.storage
     compressed_file_size = models.BigIntegerField()  # Size in bytes
     compression_ratio = models.FloatField()  # Percentage compression
     compression_time = models.FloatField()  # Time in seconds
@@ -24,10 +157,92 @@ class CompressionResult(models.Model):
     timestamp = models.DateTimeField(default=timezone.now)
     downloaded = models.BooleanField(default=False)  # Track if file has been downloaded
     downloaded_at = models.DateTimeField(null=True, blank=True)  # When file was downloaded
+    archive_mode = models.CharField(
+        max_length=20, choices=ARCHIVE_MODE_CHOICES, blank=True
+    )  # Mode actually used for a multi-file archive, blank for single files
+    preconditioner = models.CharField(
+        max_length=20, choices=PRECONDITIONER_CHOICES, blank=True
+    )  # Transform actually applied before LZMA, blank if none
+    codec = models.CharField(max_length=20, default=f'lzma-{engine.LZMA_PRESET}')  # Key in engine.CODECS
+    compressed_sha256 = models.CharField(max_length=64, blank=True)  # Of the artifact as written
+    verification = models.CharField(
+        max_length=20, choices=VERIFICATION_CHOICES, default=VERIFICATION_PENDING
+    )  # Outcome of the round-trip check by compression.verifier
+    verified_at = models.DateTimeField(null=True, blank=True)
+    recompressed_at = models.DateTimeField(null=True, blank=True)  # When the artifact was tried at a higher preset
+    delta_base = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.RESTRICT, related_name='delta_dependents'
+    )  # Result whose content the artifact is a delta against, null for a complete artifact
+    deduplicated_size = models.BigIntegerField(
+        default=0
+    )  # Bytes of the original found in the user's chunk store and referenced, not compressed (compression.dedup)
+    dedup_time_saved = models.FloatField(default=0.0)  # Estimated seconds not spent compressing them
+    chunk_sources = models.ManyToManyField(
+        'self', symmetrical=False, blank=True, through='ChunkReference', related_name='chunk_dependents'
+    )  # Results whose artifacts hold the chunks a deduplicated artifact references
+    # Resources the job used (compression.accounting), null for results from before they were recorded
+    cpu_user_time = models.FloatField(null=True, blank=True)  # Seconds, across every thread of the job
+    cpu_system_time = models.FloatField(null=True, blank=True)
+    peak_memory = models.BigIntegerField(null=True, blank=True)  # Peak growth of the resident set, bytes
+    bytes_read = models.BigIntegerField(null=True, blank=True)
+    bytes_written = models.BigIntegerField(null=True, blank=True)
 
     def __str__(self):
         return f"Compression of {self.file.original_filename}"
 
+    @property
+    def artifact_path(self):
+        """Path of the artifact, also for results from before the sharded layout"""
+        return self.compressed_path or storage.legacy_artifact_path(self.file.user_id, self.compressed_filename)
+
+    @property
+    def download_filename(self):
+        """Name the download is served as: a preconditioned artifact is decoded to a plain .xz on the way"""
+        suffix = preconditioners.CONTAINER_EXTENSION + '.xz'
+        if self.preconditioner and self.compressed_filename.endswith(suffix):
+            return self.compressed_filename[:-len(suffix)] + '.xz'
+        return self.compressed_filename
+
+    @property
+    def is_kept_after_download(self):
+        """Downloaded, but its artifact is kept as a later result needs it to be rebuilt (versions.release_artifact())"""
+        return self.downloaded and os.path.exists(self.artifact_path)
+
+    @property
+    def cpu_time(self):
+        if self.cpu_user_time is None:
+            return None
+        return self.cpu_user_time + self.cpu_system_time
+
+    @property
+    def is_delta(self):
+        return self.delta_base_id is not None
+
+    @property
+    def is_deduplicated(self):
+        return self.deduplicated_size > 0
+
+    @property
+    def dedup_ratio(self):
+        """Original size over the bytes compressed after deduplication, None if every chunk was already stored"""
+        compressed = self.file.original_file_size - self.deduplicated_size
+        return self.file.original_file_size / compressed if compressed else None
+
+    @property
+    def lzma_ratio(self):
+        """Bytes compressed after deduplication over the artifact size"""
+        compressed = self.file.original_file_size - self.deduplicated_size
+        return compressed / self.compressed_file_size if self.compressed_file_size else None
+
+    @property
+    def is_corrupt(self):
+        return self.verification == self.VERIFICATION_CORRUPT
+
+    @property
+    def codec_label(self):
+        codec = engine.CODECS.get(self.codec)
+        return codec.label if codec else self.codec
+
     @property
     def compression_percentage(self):
         """Return compression ratio as percentage"""
@@ -46,3 +261,58 @@ class CompressionResult(models.Model):
             hours = int(self.compression_time // 3600)
             minutes = int((self.compression_time % 3600) // 60)
             return f"{hours} hour{'s' if hours != 1 else ''} {minutes} minute{'s' if minutes != 1 else ''}"
+
+
+class CodecTrial(models.Model):
+    """One codec's run when a result was produced in compare mode"""
+    result = models.ForeignKey(CompressionResult, on_delete=models.CASCADE, related_name='codec_trials')
+    codec = models.CharField(max_length=20)  # Key in engine.CODECS
+    compressed_file_size = models.BigIntegerField()  # Size in bytes
+    compression_time = models.FloatField()  # Time in seconds, measured while the codecs ran concurrently
+    memory = models.BigIntegerField()  # Encoder memory in bytes
+    kept = models.BooleanField(default=False)  # Whether this codec's artifact is the result's
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.codec} for {self.result}"
+
+    @property
+    def codec_label(self):
+        codec = engine.CODECS.get(self.codec)
+        return codec.label if codec else self.codec
+
+    @property
+    def compression_percentage(self):
+        original_size = self.result.file.original_file_size
+        return round((1 - self.compressed_file_size / original_size) * 100, 2) if original_size else 0.0
+
+    @property
+    def throughput(self):
+        """Input bytes per second"""
+        return self.result.file.original_file_size / self.compression_time if self.compression_time else 0
+
+
+class ChunkReference(models.Model):
+    """A deduplicated result referencing chunks held by another result's artifact"""
+    result = models.ForeignKey(CompressionResult, on_delete=models.CASCADE, related_name='+')
+    source = models.ForeignKey(CompressionResult, on_delete=models.RESTRICT, related_name='+')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['result', 'source'], name='unique_chunk_reference')]
+
+
+class Chunk(models.Model):
+    """A chunk in a user's store: the result whose artifact holds it and where (compression.dedup)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    digest = models.CharField(max_length=32)  # BLAKE2b-128 of the chunk, hex
+    size = models.PositiveIntegerField()
+    result = models.ForeignKey(CompressionResult, on_delete=models.CASCADE, related_name='chunks')
+    offset = models.BigIntegerField()  # In the artifact's decompressed content
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'digest'], name='unique_user_chunk')]
+
+    def __str__(self):
+        return f"Chunk {self.digest} of {self.result_id}"
@@ -0,0 +1,416 @@
+"""
+Reversible transforms applied to a file before LZMA.
+
+A preconditioner rewrites a file into a layout LZMA compresses better and
+wraps the result in a small container naming the transform, so decode()
+gives back the input byte for byte. Containers are what the .xz holds for a
+preconditioned result. Downloads decode them on the way (iter_decoded_file()),
+so users get a plain .xz of the original; a .lzpc downloaded before that is
+restored with:
+
+    python -m compression.preconditioners decode data.csv.lzpc
+
+Like the engine, nothing here touches the ORM.
+"""
+import ast
+import itertools
+import lzma
+import os
+import re
+import struct
+import sys
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+CONTAINER_MAGIC = b'LZPC'
+CONTAINER_VERSION = 1
+CONTAINER_EXTENSION = '.lzpc'
+
+NONE = 'none'
+AUTO = 'auto'
+
+# Preconditioning holds the whole file in memory, larger files are compressed as-is
+# (Preconditioner.max_size, lower for transforms that cost more per byte)
+MAX_PRECONDITION_SIZE = 256 * 1024 * 1024
+DETECT_SAMPLE_SIZE = 64 * 1024
+
+
+def _pack_sections(sections):
+    return b''.join(struct.pack('<Q', len(section)) + section for section in sections)
+
+
+def _unpack_sections(payload):
+    sections, offset = [], 0
+    while offset < len(payload):
+        (length,) = struct.unpack_from('<Q', payload, offset)
+        offset += 8
+        sections.append(payload[offset:offset + length])
+        offset += length
+    return sections
+
+
+class Preconditioner(ABC):
+    """A reversible transform: encode() returns a payload, or None when it doesn't apply"""
+    name = None
+    extensions = ()
+    max_size = MAX_PRECONDITION_SIZE
+
+    @abstractmethod
+    def detect(self, filename, head):
+        """Return whether the file (its name and first bytes) looks like a fit"""
+
+    @abstractmethod
+    def encode(self, data):
+        """Return the payload for data, or None"""
+
+    @abstractmethod
+    def iter_decode(self, payload):
+        """Yield the data a payload was encoded from, in blocks"""
+
+    def decode(self, payload):
+        """Return the data a payload was encoded from"""
+        return b''.join(self.iter_decode(payload))
+
+
+class Columnar(Preconditioner):
+    """
+    Delimited text (CSV/TSV) stored column by column. Integer and fixed-point
+    columns are delta coded, low-cardinality columns dictionary coded, the
+    rest kept as text. Files with quoting or ragged rows are left alone.
+    """
+    name = 'columnar'
+    extensions = ('.csv', '.tsv', '.tab')
+
+    INTEGER = re.compile(rb'0|-?[1-9][0-9]*')
+    DECIMAL = re.compile(rb'-?(?:0|[1-9][0-9]*)\.([0-9]+)')
+    MAX_DICTIONARY = 65536
+    # Pure Python, field by field: about 2.5 MiB/s, peaking at about 21x the file's size
+    # (a 35 MiB CSV took 14 s and 756 MiB), in the web process
+    max_size = 8 * 1024 * 1024
+    DECODE_BLOCK_ROWS = 8192
+
+    def detect(self, filename, head):
+        if b'\0' in head or b'"' in head:
+            return False
+        first_line = head.split(b'\n', 1)[0]
+        if filename.lower().endswith(self.extensions):
+            return True
+        return first_line.count(b',') >= 2 or b'\t' in first_line
+
+    def _layout(self, data):
+        """Return (delimiter, newline, trailing_newline, rows) or None"""
+        if b'"' in data or not data:
+            return None
+        first_line = data.split(b'\n', 1)[0]
+        delimiter = b'\t' if first_line.count(b'\t') > first_line.count(b',') else b','
+        newline = b'\r\n' if first_line.endswith(b'\r') else b'\n'
+        trailing_newline = data.endswith(newline)
+        body = data[:-len(newline)] if trailing_newline else data
+        lines = body.split(newline)
+        if data.count(b'\n') != data.count(newline):
+            return None  # Mixed line endings
+        rows = [line.split(delimiter) for line in lines]
+        width = len(rows[0])
+        if width < 2 or len(rows) < 2 or any(len(row) != width for row in rows):
+            return None
+        return delimiter, newline, trailing_newline, rows
+
+    def _encode_column(self, values):
+        """Return (encoding, sections) for one column, the smallest reversible option"""
+        if all(self.INTEGER.fullmatch(value) for value in values):
+            numbers = [int(value) for value in values]
+            return 'delta', [self._deltas(numbers)]
+
+        matches = [self.DECIMAL.fullmatch(value) for value in values]
+        if all(matches) and len({len(match.group(1)) for match in matches}) == 1:
+            scale = len(matches[0].group(1))
+            numbers = [int(value.replace(b'.', b'')) for value in values]
+            # '-0.00' has no integer form, keep such columns as text
+            if [self._decimal(number, scale) for number in numbers] == values:
+                return f'decimal{scale}', [self._deltas(numbers)]
+
+        distinct = list(dict.fromkeys(values))
+        if len(distinct) <= self.MAX_DICTIONARY and len(distinct) * 4 < len(values):
+            index = {value: position for position, value in enumerate(distinct)}
+            width = 'B' if len(distinct) <= 256 else 'H'
+            codes = struct.pack(f'<{len(values)}{width}', *(index[value] for value in values))
+            return f'dict{width}', [b'\n'.join(distinct), codes]
+
+        return 'text', [b'\n'.join(values)]
+
+    @staticmethod
+    def _deltas(numbers):
+        previous, deltas = 0, []
+        for number in numbers:
+            deltas.append(str(number - previous).encode())
+            previous = number
+        return b'\n'.join(deltas)
+
+    @staticmethod
+    def _undelta(section):
+        total, numbers = 0, []
+        for delta in section.split(b'\n'):
+            total += int(delta)
+            numbers.append(total)
+        return numbers
+
+    @staticmethod
+    def _decimal(number, scale):
+        digits = str(abs(number)).rjust(scale + 1, '0')
+        return f"{'-' if number < 0 else ''}{digits[:-scale]}.{digits[-scale:]}".encode()
+
+    def encode(self, data):
+        layout = self._layout(data)
+        if layout is None:
+            return None
+        delimiter, newline, trailing_newline, rows = layout
+
+        # The first line (usually the header) is kept as it is
+        encodings, sections = [], [delimiter.join(rows[0])]
+        for values in zip(*rows[1:]):
+            encoding, column_sections = self._encode_column(list(values))
+            encodings.append(encoding)
+            sections.extend(column_sections)
+
+        header = b' '.join([
+            delimiter.hex().encode(), newline.hex().encode(), b'1' if trailing_newline else b'0',
+            str(len(rows) - 1).encode(), *(encoding.encode() for encoding in encodings),
+        ])
+        return _pack_sections([header, *sections])
+
+    def iter_decode(self, payload):
+        header, first_line, *sections = _unpack_sections(payload)
+        delimiter, newline, trailing_newline, row_count, *encodings = header.split(b' ')
+        delimiter, newline = bytes.fromhex(delimiter.decode()), bytes.fromhex(newline.decode())
+        row_count = int(row_count)
+
+        columns = []
+        sections = iter(sections)
+        for encoding in (encoding.decode() for encoding in encodings):
+            if encoding == 'delta':
+                columns.append([str(number).encode() for number in self._undelta(next(sections))])
+            elif encoding.startswith('decimal'):
+                scale = int(encoding[len('decimal'):])
+                columns.append([self._decimal(number, scale) for number in self._undelta(next(sections))])
+            elif encoding.startswith('dict'):
+                distinct = next(sections).split(b'\n')
+                codes = struct.unpack(f'<{row_count}{encoding[-1]}', next(sections))
+                columns.append([distinct[code] for code in codes])
+            else:
+                columns.append(next(sections).split(b'\n'))
+
+        yield first_line
+        rows = zip(*columns)
+        while batch := list(itertools.islice(rows, self.DECODE_BLOCK_ROWS)):
+            yield newline + newline.join(delimiter.join(row) for row in batch)
+        if trailing_newline == b'1':
+            yield newline
+
+
+class ByteShuffle(Preconditioner):
+    """
+    Fixed-width numeric arrays (.npy files, raw float/int dumps) split into
+    byte planes: all first bytes of every element, then all second bytes,
+    and so on, optionally after XOR or delta coding consecutive elements.
+    Sign and exponent bytes of neighbouring floats repeat, so the planes
+    give LZMA long runs that interleaved elements hide.
+    """
+    name = 'shuffle'
+    extensions = ('.npy', '.f32', '.f64', '.raw', '.dat', '.bin')
+
+    NPY_MAGIC = b'\x93NUMPY'
+    CODINGS = ('none', 'xor', 'delta')
+    PROBE_SIZE = 256 * 1024
+    MIN_SIZE = 4096  # Smaller payloads gain nothing
+    WIDTHS = (1, 2, 4, 8)  # Element widths with an unsigned integer dtype to transform as
+    DECODE_BLOCK_SIZE = 4 * 1024 * 1024
+
+    def detect(self, filename, head):
+        return head.startswith(self.NPY_MAGIC) or filename.lower().endswith(self.extensions)
+
+    def _npy_layout(self, data):
+        """Return (header length, element widths to try) of a .npy file, or None"""
+        if len(data) < 12:
+            return None
+        major = data[6]
+        if major == 1:
+            (header_length,), start = struct.unpack_from('<H', data, 8), 10
+        elif major in (2, 3):
+            (header_length,), start = struct.unpack_from('<I', data, 8), 12
+        else:
+            return None
+        try:
+            header = ast.literal_eval(data[start:start + header_length].decode('latin1'))
+            dtype = np.dtype(header['descr'])
+        except (ValueError, SyntaxError, TypeError, KeyError):
+            return None
+        if dtype.hasobject or dtype.kind not in 'iufc':
+            return None
+        # Complex numbers are pairs of floats
+        width = dtype.itemsize // 2 if dtype.kind == 'c' else dtype.itemsize
+        if width not in self.WIDTHS:
+            return None  # Extended precision (float128, complex256) has no unsigned integer view
+        return start + header_length, (width,)
+
+    @staticmethod
+    def _transform(body, width, coding):
+        elements = np.frombuffer(body, dtype=f'<u{width}')
+        if coding == 'xor' and len(elements):
+            elements = np.concatenate([elements[:1], elements[1:] ^ elements[:-1]])
+        elif coding == 'delta' and len(elements):
+            elements = np.concatenate([elements[:1], elements[1:] - elements[:-1]])
+        return elements.view(np.uint8).reshape(-1, width).T.tobytes()
+
+    def _iter_untransform(self, planes, width, coding):
+        planes = np.frombuffer(planes, dtype=np.uint8).reshape(width, -1)
+        step = self.DECODE_BLOCK_SIZE // width
+        previous = None  # Last element of the previous block, which the next one continues from
+        for start in range(0, planes.shape[1], step):
+            elements = planes[:, start:start + step].T.copy().view(f'<u{width}').ravel()
+            if coding == 'xor':
+                elements = np.bitwise_xor.accumulate(elements)
+                if previous is not None:
+                    elements ^= previous
+            elif coding == 'delta':
+                elements = np.cumsum(elements, dtype=elements.dtype)
+                if previous is not None:
+                    elements += previous
+            previous = elements[-1]
+            yield elements.tobytes()
+
+    def _probe(self, body, widths):
+        """Pick the (width, coding) whose transformed sample compresses smallest, None if plain wins"""
+        sample_size = self.PROBE_SIZE - self.PROBE_SIZE % 8
+        sample = body[:sample_size]
+        best, best_size = None, len(lzma.compress(sample, preset=0))
+        for width in widths:
+            usable = sample[:len(sample) - len(sample) % width]
+            for coding in self.CODINGS:
+                size = len(lzma.compress(self._transform(usable, width, coding), preset=0))
+                if size < best_size:
+                    best, best_size = (width, coding), size
+        return best
+
+    def encode(self, data):
+        if data.startswith(self.NPY_MAGIC):
+            layout = self._npy_layout(data)
+            if layout is None:
+                return None
+            offset, widths = layout
+        else:
+            offset, widths = 0, (4, 8)
+
+        body = data[offset:]
+        if len(body) < self.MIN_SIZE:
+            return None
+        choice = self._probe(body, widths)
+        if choice is None:
+            return None
+        width, coding = choice
+        usable = len(body) - len(body) % width
+        return _pack_sections([
+            f'{width} {coding}'.encode(), data[:offset],
+            self._transform(body[:usable], width, coding), body[usable:],
+        ])
+
+    def iter_decode(self, payload):
+        header, prefix, planes, tail = _unpack_sections(payload)
+        width, coding = header.decode().split(' ')
+        yield prefix
+        yield from self._iter_untransform(planes, int(width), coding)
+        yield tail
+
+
+PRECONDITIONERS = {
+    preconditioner.name: preconditioner for preconditioner in (ByteShuffle(), Columnar())
+}
+CHOICES = (NONE, AUTO, *PRECONDITIONERS)
+
+
+def choose(filename, head):
+    """Return the first preconditioner whose detection accepts the file, or None"""
+    for preconditioner in PRECONDITIONERS.values():
+        if preconditioner.detect(filename, head):
+            return preconditioner
+    return None
+
+
+def _decodes_to(preconditioner, payload, data):
+    """Whether payload decodes to data, compared block by block rather than as a second copy"""
+    view, offset = memoryview(data), 0
+    for block in preconditioner.iter_decode(payload):
+        if view[offset:offset + len(block)] != block:
+            return False
+        offset += len(block)
+    return offset == len(data)
+
+
+def encode_file(path, filename, name=AUTO, size=None, digest=None):
+    """
+    Apply preconditioner name ('auto' to detect one) to the file at path.
+    Return (name, container bytes), or (None, None) when none applies or
+    the file is over its max_size. A hash object passed as digest is updated
+    with the file only when a container is returned, the caller hashes the
+    plain path itself.
+    """
+    if name == NONE:
+        return None, None
+    if size is None:
+        size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        preconditioner = choose(filename, f.read(DETECT_SAMPLE_SIZE)) if name == AUTO else PRECONDITIONERS[name]
+        if preconditioner is None or size > preconditioner.max_size:
+            return None, None
+        f.seek(0)
+        data = f.read()
+    payload = preconditioner.encode(data)
+    # Anything that wouldn't come back byte for byte is compressed as-is
+    if payload is None or not _decodes_to(preconditioner, payload, data):
+        return None, None
+    if digest:
+        digest.update(data)
+    return preconditioner.name, pack(preconditioner.name, payload)
+
+
+def pack(name, payload):
+    """Wrap a preconditioner payload in a container"""
+    encoded_name = name.encode()
+    return CONTAINER_MAGIC + bytes([CONTAINER_VERSION, len(encoded_name)]) + encoded_name + payload
+
+
+def iter_unpack(container):
+    """Decode a container back to the original bytes, yielded in blocks"""
+    if container[:4] != CONTAINER_MAGIC or container[4] != CONTAINER_VERSION:
+        raise ValueError("Not a preconditioned container")
+    name_length = container[5]
+    name = container[6:6 + name_length].decode()
+    if name not in PRECONDITIONERS:
+        raise ValueError(f"Unknown preconditioner '{name}'")
+    return PRECONDITIONERS[name].iter_decode(container[6 + name_length:])
+
+
+def unpack(container):
+    """Decode a container back to the original bytes"""
+    return b''.join(iter_unpack(container))
+
+
+def iter_decoded_file(path):
+    """Yield the original of the .xz at path, which holds a container, decoded in blocks"""
+    with lzma.open(path) as stream:
+        container = stream.read()
+    yield from iter_unpack(container)
+
+
+def main(argv):
+    if len(argv) not in (2, 3) or argv[0] != 'decode' or not argv[1].endswith(CONTAINER_EXTENSION):
+        sys.exit(f"usage: python -m compression.preconditioners decode FILE{CONTAINER_EXTENSION} [OUTPUT]")
+    output_path = argv[2] if len(argv) == 3 else argv[1][:-len(CONTAINER_EXTENSION)]
+    with open(argv[1], 'rb') as f:
+        blocks = iter_unpack(f.read())
+    with open(output_path, 'wb') as f:
+        f.writelines(blocks)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,124 @@
+"""
+Pre-compression estimates of output size and duration.
+
+A stratified sample of every input (evenly spaced slices, so headers,
+bodies and trailers are all represented) is compressed at the job's preset,
+which gives a content-specific ratio and throughput in a fraction of a
+second. Past results for the same file type and a similar size add the
+throughput this server actually achieved. The estimate is shown to the user
+straight after upload and orders the compression queue (shortest job first).
+"""
+import lzma
+import os
+import statistics
+import time
+from typing import NamedTuple
+
+from . import engine
+
+SAMPLE_STRATA = 8
+SAMPLE_STRATUM_SIZE = 32 * 1024
+HISTORY_LIMIT = 50  # Most recent comparable results considered
+HISTORY_SIZE_FACTOR = 4  # Comparable results are within this factor of the input size
+HISTORY_WEIGHT = 5  # Comparable results worth as much as the sample's throughput
+MAX_SAMPLED_FILES = 16  # Per request, the other files extrapolate from a spread of these and history
+
+
+class Estimate(NamedTuple):
+    compressed_size: int
+    seconds: float
+
+
+class SampleStats(NamedTuple):
+    size: int
+    ratio: float  # Compressed / original size of the sample
+    throughput: float  # Input bytes per second on the sample
+    sampled: bool = True  # False when ratio and throughput are averaged over other files' samples
+
+
+def sample(path, preset=engine.LZMA_PRESET):
+    """Compress a stratified sample of the file at path, return its SampleStats"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_STRATA * SAMPLE_STRATUM_SIZE:
+            data = f.read()
+        else:
+            slices = []
+            for index in range(SAMPLE_STRATA):
+                f.seek((size - SAMPLE_STRATUM_SIZE) * index // (SAMPLE_STRATA - 1))
+                slices.append(f.read(SAMPLE_STRATUM_SIZE))
+            data = b''.join(slices)
+    if not data:
+        return SampleStats(size, 1.0, 0.0)
+
+    start = time.perf_counter()
+    compressed_size = len(lzma.compress(data, preset=preset))
+    elapsed = time.perf_counter() - start
+    return SampleStats(size, compressed_size / len(data), len(data) / elapsed if elapsed else 0.0)
+
+
+def sample_files(paths, preset=engine.LZMA_PRESET, limit=MAX_SAMPLED_FILES):
+    """
+    SampleStats for every path. Only limit evenly spread files are
+    compressed, the rest get their size-weighted average ratio and
+    throughput and are marked unsampled, so combine() prefers history.
+    """
+    if len(paths) <= limit:
+        return [sample(path, preset) for path in paths]
+
+    step = len(paths) / limit
+    sampled = {int(index * step): sample(paths[int(index * step)], preset) for index in range(limit)}
+    weight = sum(stats.size for stats in sampled.values()) or 1
+    ratio = sum(stats.ratio * stats.size for stats in sampled.values()) / weight
+    throughput = sum(stats.throughput * stats.size for stats in sampled.values()) / weight
+    return [
+        sampled.get(index) or SampleStats(os.path.getsize(path), ratio, throughput, sampled=False)
+        for index, path in enumerate(paths)
+    ]
+
+
+def historical_throughput(results, extension, size):
+    """
+    Median input bytes per second of past LZMA results for files with this
+    extension ('' for any) within HISTORY_SIZE_FACTOR of size, with how many
+    there were. results is a CompressionResult queryset; this is the only
+    ORM access.
+    """
+    queryset = results.filter(
+        codec=f'lzma-{engine.LZMA_PRESET}', compression_time__gt=0,
+        file__original_file_size__gte=size // HISTORY_SIZE_FACTOR,
+        file__original_file_size__lte=size * HISTORY_SIZE_FACTOR,
+    )
+    if extension:
+        queryset = queryset.filter(file__original_filename__iendswith=extension)
+    rows = queryset.order_by('-timestamp').values_list(
+        'file__original_file_size', 'compression_time'
+    )[:HISTORY_LIMIT]
+    throughputs = [original_size / seconds for original_size, seconds in rows]
+    return (statistics.median(throughputs) if throughputs else 0.0), len(throughputs)
+
+
+def combine(stats, history=(0.0, 0)):
+    """Estimate one file from its SampleStats and (historical throughput, count)"""
+    historical, count = history
+    if historical and not stats.sampled:
+        # An average of other files' samples says little about this file's speed
+        throughput = historical
+    elif historical and stats.throughput:
+        # The more comparable results, the more they outweigh the single sample
+        weight = count / (count + HISTORY_WEIGHT)
+        throughput = weight * historical + (1 - weight) * stats.throughput
+    else:
+        throughput = historical or stats.throughput
+    seconds = stats.size / throughput if throughput else 0.0
+    return Estimate(round(stats.size * stats.ratio), seconds)
+
+
+def combine_job(estimates, archive_mode=engine.ARCHIVE_SOLID, workers=1):
+    """Estimate a job from the estimates of its files"""
+    compressed_size = sum(estimate.compressed_size for estimate in estimates)
+    seconds = sum(estimate.seconds for estimate in estimates)
+    if len(estimates) > 1 and archive_mode == engine.ARCHIVE_PARALLEL:
+        # Members are spread over the workers, the largest bounds the wall time
+        seconds = max(seconds / workers, max(estimate.seconds for estimate in estimates))
+    return Estimate(compressed_size, seconds)
@@ -0,0 +1,221 @@
+"""
+Idle-time recompression of cold artifacts.
+
+Jobs compress at engine.LZMA_PRESET so uploads finish quickly. Many
+artifacts then sit undownloaded for days. Once one has been waiting for
+COMPRESSION_RECOMPRESS_AFTER seconds it counts as cold, and it is re-encoded
+at LZMA preset 9 extreme. The filter chain is whichever of
+engine.RECOMPRESS_CODECS does best on a sample: plain, tuned for text, or
+after a delta filter for numeric arrays. The new artifact is written beside
+the old one. It replaces the old one with os.replace(), in the same
+transaction that records its size, digest and codec, and only if it is
+smaller and the result still hasn't been claimed for download.
+
+With COMPRESSION_RECOMPRESS set, every completed job schedules a sweep on a
+single low-priority thread, and so does a check every IDLE_CHECK_SECONDS
+that finds compression idle (start_idle_checks(), called when the app is
+ready), so artifacts that turn cold while no job completes are still found.
+The sweep waits until no compression job is queued or running in this
+process. It then works through the cold artifacts, oldest first. When a job
+arrives it abandons the current artifact within one RECOMPRESS_BLOCK_SIZE
+block and waits for idle again. Single-file LZMA results and solid archives
+are recompressed. Parallel archives, other codecs and corrupt results are
+left alone. The recompress_cold command runs a sweep from cron.
+"""
+import logging
+import lzma
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import engine, jobs, verifier
+from .database import worker_connections
+from .executors import get_executor
+from .models import CompressionResult
+
+logger = logging.getLogger(__name__)
+
+IDLE_POLL_SECONDS = 1.0  # How often a waiting sweep checks whether compression is idle
+RECOMPRESSIBLE_CODECS = tuple(f'lzma-{preset}' for preset in range(10))
+LOW_PRIORITY = 19  # Nice value of the recompression thread (Linux)
+IDLE_CHECK_SECONDS = 10 * 60  # How often an idle process looks for artifacts that have turned cold
+
+_scheduled = False  # A sweep is queued and hasn't started yet
+_scheduled_lock = threading.Lock()
+_checking = False  # The idle check thread was started
+
+
+def cold_results(now=None):
+    """Results whose artifacts may be recompressed, oldest first"""
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.COMPRESSION_RECOMPRESS_AFTER)
+    return (
+        CompressionResult.objects
+        .filter(
+            downloaded=False, recompressed_at__isnull=True, timestamp__lte=cutoff,
+            codec__in=RECOMPRESSIBLE_CODECS
+        )
+        .exclude(archive_mode=engine.ARCHIVE_PARALLEL)
+        .exclude(verification=CompressionResult.VERIFICATION_CORRUPT)
+        .select_related('file')
+        .order_by('timestamp', 'id')
+    )
+
+
+def recompress_result(result, should_stop=None):
+    """
+    Re-encode a result's artifact with the best of RECOMPRESS_CODECS and
+    swap it in if it is smaller. Return the bytes saved (0 if it wasn't
+    smaller). Return None if should_stop() interrupted it, the artifact is
+    gone or the result was downloaded meanwhile.
+    """
+    path = result.artifact_path
+    if not os.path.exists(path):
+        return None
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.part')
+    os.close(fd)
+    try:
+        compressed_digest = engine.new_digest()
+        try:
+            recompressed = engine.recompress_file(path, temp_path, should_stop=should_stop,
+                                                  compressed_digest=compressed_digest)
+        except (lzma.LZMAError, EOFError):
+            # Damaged: leave it to verification, and don't try again
+            logger.exception("Artifact of compression result %s could not be recompressed", result.id)
+            CompressionResult.objects.filter(pk=result.pk).update(recompressed_at=timezone.now())
+            return None
+        if recompressed is None:
+            return None
+        codec, size = recompressed
+
+        saved = result.compressed_file_size - size
+        updates = {'recompressed_at': timezone.now()}
+        if saved > 0:
+            updates.update(
+                codec=codec,
+                compressed_file_size=size,
+                compression_ratio=(1 - (size / result.file.original_file_size)) * 100,
+                compressed_sha256=compressed_digest.hexdigest(),
+                verification=CompressionResult.VERIFICATION_PENDING,
+                verified_at=None,
+            )
+        with transaction.atomic():
+            # The row stays locked until the swap commits. A download claims its
+            # result first, so the artifact it streams (and deletes) is never swapped.
+            if not CompressionResult.objects.filter(
+                pk=result.pk, downloaded=False, compressed_sha256=result.compressed_sha256
+            ).update(**updates):
+                return None
+            if saved > 0:
+                os.replace(temp_path, path)
+                if settings.COMPRESSION_VERIFY:
+                    transaction.on_commit(lambda: verifier.schedule(result.id))
+        return max(saved, 0)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+            if not os.path.exists(path):
+                # Downloaded meanwhile: the download couldn't remove the directory while the temporary file was in it
+                try:
+                    os.rmdir(os.path.dirname(path))
+                except OSError:
+                    pass
+
+
+def sweep(should_stop=None, limit=None):
+    """
+    Recompress cold results, oldest first, until none is left, limit have
+    been tried or should_stop() returns True. Return (results tried, results
+    shrunk, bytes saved, whether should_stop() ended the sweep).
+    """
+    tried = shrunk = saved = 0
+    for result in cold_results().iterator():
+        if limit is not None and tried >= limit:
+            break
+        if should_stop and should_stop():
+            return tried, shrunk, saved, True
+        try:
+            result_saved = recompress_result(result, should_stop)
+        except Exception:
+            logger.exception("Compression result %s could not be recompressed", result.id)
+            continue
+        if result_saved is None and should_stop and should_stop():
+            return tried, shrunk, saved, True
+        tried += 1
+        if result_saved:
+            shrunk += 1
+            saved += result_saved
+    return tried, shrunk, saved, False
+
+
+def _lower_priority():
+    # On Linux a thread has its own nice value, elsewhere this would renice the whole process
+    if sys.platform == 'linux':
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), LOW_PRIORITY)
+        except OSError:
+            pass
+
+
+def _busy():
+    return not jobs.is_idle()
+
+
+def _sweep_when_idle():
+    global _scheduled
+    with _scheduled_lock:
+        _scheduled = False  # Jobs completing from now on schedule the next sweep
+    _lower_priority()
+    while True:
+        while _busy():
+            time.sleep(IDLE_POLL_SECONDS)
+        with worker_connections():
+            try:
+                tried, shrunk, saved, interrupted = sweep(should_stop=_busy)
+            except Exception:
+                logger.exception("Recompression sweep failed")
+                return
+        if tried:
+            logger.info("Recompressed %d of %d cold artifacts, %d bytes saved", shrunk, tried, saved)
+        if not interrupted:
+            return
+
+
+def schedule():
+    """Sweep cold artifacts once compression is idle, or now when COMPRESSION_JOBS_EAGER is set"""
+    global _scheduled
+    if settings.COMPRESSION_JOBS_EAGER:
+        sweep()
+        return
+    with _scheduled_lock:
+        if _scheduled:
+            return
+        _scheduled = True
+    get_executor('recompress').submit(_sweep_when_idle)
+
+
+def _check_when_idle():
+    while True:
+        time.sleep(IDLE_CHECK_SECONDS)
+        if jobs.is_idle():
+            try:
+                schedule()
+            except Exception:
+                logger.exception("Recompression sweep could not be scheduled")
+
+
+def start_idle_checks():
+    """Start the daemon thread that schedules a sweep every IDLE_CHECK_SECONDS compression is idle, once"""
+    global _checking
+    with _scheduled_lock:
+        if _checking:
+            return
+        _checking = True
+    threading.Thread(target=_check_when_idle, name='compression-recompress-check', daemon=True).start()
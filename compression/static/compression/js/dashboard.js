@@ -18,6 +18,14 @@
   const progressText = document.getElementById('progressText');
   const errorMessages = document.getElementById('errorMessages');
   const errorText = document.getElementById('errorText');
+  const archiveModeField = document.getElementById('archiveModeField');
+  const archiveMode = document.getElementById('archiveMode');
+  const preconditionerField = document.getElementById('preconditionerField');
+  const preconditioner = document.getElementById('preconditioner');
+  const compareField = document.getElementById('compareField');
+  const previousVersionField = document.getElementById('previousVersionField');
+  const previousVersion = document.getElementById('previousVersion');
+  const compare = document.getElementById('compare');
 
   // Initialize when DOM is loaded
   document.addEventListener('DOMContentLoaded', function() {
@@ -117,6 +125,14 @@
 
     fileList.style.display = 'block';
     fileItems.innerHTML = '';
+    // Solid vs parallel only matters when several files go into one archive
+    archiveModeField.style.display = selectedFiles.length > 1 ? 'block' : 'none';
+    // Preprocessing applies to single-file jobs
+    preconditionerField.style.display = selectedFiles.length === 1 ? 'block' : 'none';
+    compareField.style.display = selectedFiles.length === 1 ? 'block' : 'none';
+    if (previousVersionField) {
+      previousVersionField.style.display = selectedFiles.length === 1 ? 'block' : 'none';
+    }
 
     selectedFiles.forEach((file, index) => {
       const fileItem = document.createElement('div');
@@ -176,6 +192,14 @@
     selectedFiles.forEach(file => {
       formData.append('files', file);
     });
+    formData.append('archive_mode', archiveMode.value);
+    formData.append('preconditioner', preconditioner.value);
+    if (selectedFiles.length === 1) {
+      formData.append('compare', compare.value);
+      if (previousVersion) {
+        formData.append('previous_version', previousVersion.value);
+      }
+    }
 
     // Add CSRF token
     const csrfToken = document.querySelector('[name=csrfmiddlewaretoken]').value;
@@ -196,18 +220,12 @@
     .then(response => response.json())
     .then(data => {
       if (data.success) {
-        progressText.textContent = 'Files uploaded, starting compression...';
-        progressBar.style.width = '60%';
-
-        // Simulate compression progress
-        setTimeout(() => {
-          progressText.textContent = 'Compression complete! Redirecting...';
-          progressBar.style.width = '100%';
-
-          setTimeout(() => {
-            window.location.href = data.redirect_url;
-          }, 1000);
-        }, 2000);
+        if (data.status === 'completed' && data.redirect_url) {
+          finishCompression(data.redirect_url);
+        } else {
+          progressText.textContent = 'Files uploaded, waiting for compression...' + describeEstimate(data.estimate);
+          followJob(data);
+        }
       } else {
         hideProgress();
         showError(data.error || 'Upload failed');
@@ -219,6 +237,86 @@
     });
   }
 
+  function followJob(job) {
+    // Progress is pushed over one Server-Sent Events connection; polling is only a fallback
+    if (!window.EventSource) {
+      pollJob(job.progress_url);
+      return;
+    }
+
+    const source = new EventSource(job.events_url);
+    const handleEvent = (e) => {
+      if (updateJobProgress(JSON.parse(e.data))) {
+        source.close();
+      }
+    };
+    ['queued', 'running', 'completed', 'failed'].forEach(eventName => {
+      source.addEventListener(eventName, handleEvent);
+    });
+    source.onerror = () => {
+      // The stream closes normally once the job finishes; anything else falls back to polling
+      if (source.readyState !== EventSource.CLOSED) {
+        source.close();
+        pollJob(job.progress_url);
+      }
+    };
+  }
+
+  function pollJob(progressUrl) {
+    fetch(progressUrl)
+      .then(response => response.json())
+      .then(data => {
+        if (!updateJobProgress(data)) {
+          setTimeout(() => pollJob(progressUrl), 2000);
+        }
+      })
+      .catch(error => {
+        hideProgress();
+        showError('Network error: ' + error.message);
+      });
+  }
+
+  function describeEstimate(estimate) {
+    if (!estimate) return '';
+    const seconds = estimate.seconds < 1 ? 'under a second'
+      : estimate.seconds < 120 ? `~${Math.round(estimate.seconds)} s`
+      : `~${Math.round(estimate.seconds / 60)} min`;
+    return ` (estimated ${seconds}, about ${formatFileSize(estimate.compressed_size)} compressed)`;
+  }
+
+  // Returns true once the job has finished
+  function updateJobProgress(data) {
+    if (data.status === 'completed') {
+      finishCompression(data.redirect_url);
+      return true;
+    }
+    if (data.status === 'failed' || data.status === 'error') {
+      hideProgress();
+      showError(data.message || 'Compression failed');
+      return true;
+    }
+    if (data.status === 'running') {
+      let remaining = '';
+      if (data.estimate && data.estimate.seconds >= 1) {
+        const left = Math.max(Math.round(data.estimate.seconds * (100 - data.progress) / 100), 1);
+        remaining = ` (about ${left} s left)`;
+      }
+      progressText.textContent = `Compressing... ${data.progress}%${remaining}`;
+    }
+    // Upload took the first 20% of the bar, compression fills the rest
+    progressBar.style.width = `${20 + Math.round(data.progress * 0.8)}%`;
+    return false;
+  }
+
+  function finishCompression(redirectUrl) {
+    progressText.textContent = 'Compression complete! Redirecting...';
+    progressBar.style.width = '100%';
+
+    setTimeout(() => {
+      window.location.href = redirectUrl;
+    }, 1000);
+  }
+
   function showProgress() {
     progressSection.style.display = 'block';
     fileList.style.display = 'none';
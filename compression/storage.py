@@ -0,0 +1,77 @@
+"""
+On-disk layout of uploads and compression artifacts.
+
+Every stored file gets a random ID, so two uploads or artifacts with the
+same name never overwrite each other. Files are sharded on the first two
+byte pairs of that ID, MEDIA_ROOT/<area>/<user>/ab/cd/, which keeps every
+directory small however many files a user stores. An artifact lives in a
+directory of its own named by its ID, so it keeps its human-readable name
+(engine.compressed_filename_for()) for users who unpack it by hand.
+
+Artifacts are written to a temporary file and moved into place with
+os.replace() (engine.atomic_output()), so a reader never sees a partial one.
+"""
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+
+UPLOADS = 'uploads'
+ARTIFACTS = 'compressed'
+SHARD_LEVELS = 2  # 256 ** 2 leaf directories per user and area
+
+
+def new_id():
+    return uuid.uuid4().hex
+
+
+def shard_dir(area, user_id, file_id):
+    """Directory of file_id under area for a user"""
+    shards = [file_id[2 * level:2 * level + 2] for level in range(SHARD_LEVELS)]
+    return os.path.join(settings.MEDIA_ROOT, area, str(user_id), *shards)
+
+
+def upload_path(user_id, filename):
+    """A new, unique path for an upload named filename"""
+    file_id = new_id()
+    return os.path.join(shard_dir(UPLOADS, user_id, file_id), f"{file_id}_{os.path.basename(filename)}")
+
+
+def link_file(source_path, path):
+    """Hard link a server-side file to path in the upload area (copy across filesystems)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.link(source_path, path)
+    except OSError:
+        shutil.copyfile(source_path, path)
+
+
+def upload_temp_dir():
+    """Where large uploads are spooled while they arrive, beside the upload area so they can be renamed into it"""
+    return os.path.join(settings.MEDIA_ROOT, UPLOADS, '.incoming')
+
+
+def rebuild_temp_dir():
+    """Where the files a download is rebuilt from are decompressed while it is sent (compression.versions)"""
+    return os.path.join(settings.MEDIA_ROOT, ARTIFACTS, '.rebuild')
+
+
+def artifact_dir(user_id):
+    """A new, unique directory for one artifact (created when the artifact is written)"""
+    artifact_id = new_id()
+    return os.path.join(shard_dir(ARTIFACTS, user_id, artifact_id), artifact_id)
+
+
+def legacy_artifact_path(user_id, compressed_filename):
+    """Where artifacts were written before the sharded layout"""
+    return os.path.join(settings.MEDIA_ROOT, ARTIFACTS, str(user_id), compressed_filename)
+
+
+def remove_artifact(path):
+    """Delete an artifact and its directory, if that is now empty"""
+    os.remove(path)
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass  # Not empty, e.g. a legacy per-user directory
@@ -1,15 +1,43 @@
+import csv
+import gzip
+import hashlib
+import io
+import json
 import lzma
 import os
+import random
 import shutil
+import tarfile
 import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock, skipUnless
 
+import numpy as np
+
+from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, Client
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, Client, AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from .models import File, CompressionResult
+from users.models import APIToken
+
+from . import (
+    accounting, analytics, chunking, database, dedup, delta, engine, events, export, jobs, manifest, preconditioners,
+    predictor, recompress, storage, verifier, versions, views
+)
+from .models import Chunk, CompressionJob, File, CompressionResult
+from .uploads import SpooledUpload
 
 
 class CompressionModelsTestCase(TestCase):
@@ -80,6 +108,7 @@ class CompressionModelsTestCase(TestCase):
         self.assertEqual(compression_result.formatted_compression_time, '1 minute 5 seconds')
 
 
+@override_settings(COMPRESSION_JOBS_EAGER=True)
 class CompressionViewsTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -149,7 +178,9 @@ class CompressionViewsTestCase(TestCase):
             content_type="text/plain"
         )
 
-        response = self.client.post(reverse('dashboard'), {'files': test_file})
+        # Uploads are deleted once the result's transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('dashboard'), {'files': test_file})
         self.assertEqual(response.status_code, 200)
 
         data = response.json()
@@ -196,6 +227,12 @@ class CompressionViewsTestCase(TestCase):
         # Should have created one master File object and one CompressionResult
         self.assertEqual(CompressionResult.objects.count(), 1)
 
+        # The three uploads belong to one finished job
+        job = CompressionJob.objects.get()
+        self.assertEqual(job.status, CompressionJob.STATUS_COMPLETED)
+        self.assertEqual(job.files.count(), 3)
+        self.assertEqual(data['events_url'], reverse('compression_events', kwargs={'job_id': job.id}))
+
     def test_compression_results_view(self):
         """Test compression results view"""
         self.client.login(username='testuser@example.com', password='testpass123')
@@ -321,6 +358,750 @@ class CompressionFunctionalityTestCase(TestCase):
         self.assertEqual(compression_result.formatted_compression_time, '1.50 seconds')
 
 
+class CompressionEngineTestCase(TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_compressed_filename_keeps_extension(self):
+        """Test that the .xz name preserves the original extension"""
+        self.assertEqual(engine.compressed_filename_for('data.csv'), 'data.csv.xz')
+        self.assertEqual(engine.compressed_filename_for('README'), 'README.xz')
+
+    def test_archive_filename(self):
+        """Test archive naming for few and many files"""
+        self.assertEqual(engine.archive_filename_for(['a.txt', 'b.csv']), 'a_b.xz')
+        self.assertEqual(engine.archive_filename_for(['f.txt'] * 5), '5_files_archive.xz')
+
+    def test_compress_single_round_trip(self):
+        """Test that the engine writes a valid .xz without touching the database"""
+        source_path = os.path.join(self.test_dir, 'source.txt')
+        test_data = b'Engine round trip data. ' * 500
+        with open(source_path, 'wb') as f:
+            f.write(test_data)
+
+        outcome = engine.compress_single(source_path, 'source.txt', os.path.join(self.test_dir, 'out'))
+
+        self.assertEqual(outcome.compressed_filename, 'source.txt.xz')
+        with open(outcome.compressed_path, 'rb') as f:
+            compressed_data = f.read()
+        self.assertEqual(len(compressed_data), outcome.compressed_file_size)
+        self.assertEqual(lzma.decompress(compressed_data), test_data)
+
+    def _members(self, contents):
+        members = []
+        for index, data in enumerate(contents):
+            path = os.path.join(self.test_dir, f'member{index}.bin')
+            with open(path, 'wb') as f:
+                f.write(data)
+            members.append((path, f'member{index}.bin'))
+        return members
+
+    def test_compress_many_parallel_round_trip(self):
+        """Test that parallel mode writes a tar of independently decompressible members"""
+        contents = [f'row {i}\n'.encode() * (2000 + i) for i in range(5)]
+        ticks = []
+        outcome = engine.compress_many(
+            self._members(contents), os.path.join(self.test_dir, 'out'),
+            progress=lambda done, total: ticks.append((done, total)), mode=engine.ARCHIVE_PARALLEL, workers=3
+        )
+
+        self.assertEqual(outcome.archive_mode, engine.ARCHIVE_PARALLEL)
+        self.assertEqual(outcome.compressed_filename, '5_files_archive.tar')
+        self.assertEqual(ticks[-1][0], sum(len(data) for data in contents))
+        with tarfile.open(outcome.compressed_path) as tar:
+            self.assertEqual(tar.getnames(), [f'member{i}.bin.xz' for i in range(5)])
+            self.assertEqual(lzma.decompress(tar.extractfile('member3.bin.xz').read()), contents[3])
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, 'out')), ['5_files_archive.tar'])
+
+    def test_compress_many_solid_round_trip(self):
+        """Test that solid mode stores the members in a zip inside one LZMA stream"""
+        contents = [b'alpha ' * 300, b'beta ' * 300]
+        outcome = engine.compress_many(
+            self._members(contents), os.path.join(self.test_dir, 'out'), mode=engine.ARCHIVE_SOLID
+        )
+
+        self.assertEqual(outcome.archive_mode, engine.ARCHIVE_SOLID)
+        with open(outcome.compressed_path, 'rb') as f:
+            archive = zipfile.ZipFile(io.BytesIO(lzma.decompress(f.read())))
+        self.assertEqual(archive.read('member1.bin'), contents[1])
+
+    def test_order_members_groups_similar_content(self):
+        """Test that solid archives place related members next to each other"""
+        rng = random.Random(1)
+        datasets = [rng.randbytes(50000) for _ in range(3)]
+        reruns = [data[:-100] + rng.randbytes(100) for data in datasets]
+        members = self._members(datasets + reruns + [b'notes\n' * 1000])
+        members[-1] = (members[-1][0], 'notes.txt')
+
+        ordered = [name for _, name in engine.order_members(members)]
+        self.assertEqual(sorted(ordered), sorted(name for _, name in members))
+        for index in range(3):
+            position = ordered.index(f'member{index}.bin')
+            self.assertEqual(ordered[position + 1], f'member{index + 3}.bin')
+
+        _, sketch = engine.fingerprint(members[0][0])
+        self.assertEqual(engine.resemblance(sketch, sketch), 1.0)
+
+    def test_compare_codecs(self):
+        """Test that every codec runs, and only the kept artifact remains"""
+        data = b'sample,reading\n' + b'12,0.5\n' * 5000
+        source_path = self._members([data])[0][0]
+        out_dir = os.path.join(self.test_dir, 'out')
+
+        outcome, trials = engine.compare_codecs(source_path, 'data.csv', out_dir)
+        self.assertEqual([trial.codec for trial in trials], list(engine.COMPARE_CODECS))
+        best = min(trials, key=lambda trial: trial.compressed_file_size)
+        self.assertEqual(outcome.codec, best.codec)
+        self.assertEqual(os.listdir(out_dir), [outcome.compressed_filename])
+
+        # One codec at a time, the job holds a single compression worker
+        running, overlap, real_compress_file = [], [], engine.compress_file
+
+        def compress_file(*args, **kwargs):
+            running.append(True)
+            overlap.append(len(running))
+            try:
+                return real_compress_file(*args, **kwargs)
+            finally:
+                running.pop()
+
+        with mock.patch.object(engine, 'compress_file', side_effect=compress_file):
+            outcome, _ = engine.compare_codecs(source_path, 'data.csv', out_dir, keep='zlib-9')
+        self.assertEqual(max(overlap), 1)
+        self.assertEqual(outcome.compressed_filename, 'data.csv.gz')
+        with open(outcome.compressed_path, 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), data)
+
+    def test_atomic_output(self):
+        """Test that an artifact only appears once fully written, and a failed write leaves nothing"""
+        path = os.path.join(self.test_dir, 'out', 'artifact.xz')
+        with self.assertRaises(RuntimeError):
+            with engine.atomic_output(path) as temp_path:
+                with open(temp_path, 'wb') as f:
+                    f.write(b'partial')
+                self.assertFalse(os.path.exists(path))
+                raise RuntimeError
+        self.assertEqual(os.listdir(os.path.dirname(path)), [])
+
+        with engine.atomic_output(path) as temp_path:
+            with open(temp_path, 'wb') as f:
+                f.write(b'complete')
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['artifact.xz'])
+
+    def test_digests_single_pass(self):
+        """Test that every mode reports the digests of its inputs and of the artifact it wrote"""
+        contents = [b'alpha ' * 3000, b'id,value\n' + b'1,2\n' * 3000]
+        members = self._members(contents)
+        expected = sorted(hashlib.sha256(data).hexdigest() for data in contents)
+
+        def artifact_digest(outcome):
+            with open(outcome.compressed_path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+
+        outcome = engine.compress_single(members[1][0], 'data.csv', self.test_dir, preconditioner='columnar')
+        self.assertEqual(outcome.preconditioner, 'columnar')
+        self.assertEqual(outcome.digest, hashlib.sha256(contents[1]).hexdigest())
+        self.assertEqual(outcome.compressed_digest, artifact_digest(outcome))
+
+        outcome, _ = engine.compare_codecs(members[0][0], 'alpha.txt', self.test_dir, keep='bz2-9')
+        self.assertEqual(outcome.digest, hashlib.sha256(contents[0]).hexdigest())
+        self.assertEqual(outcome.compressed_digest, artifact_digest(outcome))
+
+        for mode in (engine.ARCHIVE_SOLID, engine.ARCHIVE_PARALLEL):
+            outcome = engine.compress_many(members, os.path.join(self.test_dir, mode), mode=mode, workers=2)
+            self.assertEqual(sorted(outcome.member_digests), expected)
+            self.assertEqual(outcome.compressed_digest, artifact_digest(outcome))
+            self.assertEqual(verifier.decompressed_digests(outcome.compressed_path, archive_mode=mode), expected)
+
+    def test_resource_accounting(self):
+        """Test that measure() counts CPU, memory and I/O, including helper threads started through bind()"""
+        contents = [random.Random(index).randbytes(200_000) for index in range(3)]
+        members = self._members(contents)
+        total = sum(len(data) for data in contents)
+
+        with accounting.measure() as meter:
+            outcome = engine.compress_many(members, self.test_dir, mode=engine.ARCHIVE_PARALLEL, workers=2)
+        usage = meter.usage
+        self.assertGreater(usage.cpu_user_time + usage.cpu_system_time, 0)
+        self.assertGreater(usage.peak_memory, 0)
+        self.assertGreaterEqual(usage.bytes_read, total)  # Member reads happen on the helper threads
+        self.assertGreaterEqual(usage.bytes_written, os.path.getsize(outcome.compressed_path))
+
+        with accounting.measure() as idle:
+            self.assertFalse(tracemalloc.is_tracing())  # Jobs don't pay for tracing every allocation
+        self.assertLess(idle.usage.bytes_read, total)
+
+    def test_choose_archive_mode(self):
+        """Test that only many unrelated, evenly sized members go parallel"""
+        rng = random.Random(0)
+        size = engine.PARALLEL_MIN_AVERAGE_SIZE
+        unrelated = [rng.randbytes(size) for _ in range(4)]
+        self.assertEqual(engine.choose_archive_mode(self._members(unrelated)), engine.ARCHIVE_PARALLEL)
+
+        # Too few members
+        self.assertEqual(engine.choose_archive_mode(self._members(unrelated[:2])), engine.ARCHIVE_SOLID)
+        # Copies of one file compress far better together
+        self.assertEqual(engine.choose_archive_mode(self._members(unrelated[:1] * 4)), engine.ARCHIVE_SOLID)
+        # One member holds most of the bytes
+        lopsided = unrelated[:3] + [rng.randbytes(size * 4)]
+        self.assertEqual(engine.choose_archive_mode(self._members(lopsided)), engine.ARCHIVE_SOLID)
+
+    def test_delta_round_trip(self):
+        """Test that a delta rebuilds the new version and holds little more than what changed"""
+        rng = random.Random(4)
+        rows = [f'{i},{rng.randint(1, 20)},{rng.gauss(20, 3):.3f}\n'.encode() for i in range(20000)]
+        base = b''.join(rows)
+        for i in rng.sample(range(len(rows)), 200):
+            rows[i] = f'{i},0,edited\n'.encode()
+        target = b''.join(rows[:500] + rows[600:] + [b'appended,1,2\n'] * 50)
+
+        patch = delta.encode(base, target)
+        self.assertEqual(delta.apply(base, patch), target)
+        self.assertLess(len(patch), len(target) // 10)
+        self.assertEqual(delta.apply(target, delta.encode(target, b'')), b'')
+        with self.assertRaises(ValueError):
+            delta.apply(base[1:], patch)
+
+        # Streamed from a file and a stream, in bounded pieces
+        pieces = list(delta.iter_apply(io.BytesIO(base), io.BytesIO(patch), block_size=4096))
+        self.assertEqual(b''.join(pieces), target)
+        self.assertLessEqual(max(len(piece) for piece in pieces), 4096)
+        for broken_base, broken_patch in ((base[1:], patch), (base, patch[:-5])):
+            with self.assertRaises(ValueError):
+                b''.join(delta.iter_apply(io.BytesIO(broken_base), io.BytesIO(broken_patch)))
+
+        # Chunk boundaries move only around an insertion
+        ends = set(chunking.chunk_ends(base, 256))
+        shifted = {end - 7 for end in chunking.chunk_ends(b'INSERTS' + base, 256)}
+        self.assertGreater(len(ends & shifted), len(ends) * 0.95)
+
+    def test_chunk_manifest_round_trip(self):
+        """Test that a manifest references stored and repeated chunks and decodes back to the file"""
+        rng = random.Random(7)
+        table, repeated = rng.randbytes(100000), rng.randbytes(30000)
+        content = b'header\n' + table + repeated + rng.randbytes(50000) + repeated
+        path = os.path.join(self.test_dir, 'upload.bin')
+        with open(path, 'wb') as f:
+            f.write(content)
+
+        # Files are chunked a block at a time exactly as whole
+        chunks = manifest.chunk_file(path)
+        ends = list(np.cumsum([chunk.size for chunk in chunks]))
+        self.assertEqual(ends, chunking.chunk_ends(content, manifest.CHUNK_SIZE))
+        with open(path, 'rb') as f:
+            self.assertEqual(b''.join(chunking.iter_chunks(f, manifest.CHUNK_SIZE, block_size=5000)), content)
+
+        # Result 3 stored the table, in a file with three more bytes before it
+        stored, position = {}, 0
+        for chunk in chunks:
+            if 7 <= position and position + chunk.size <= 7 + len(table):
+                stored[chunk.digest] = (3, position + 3)
+            position += chunk.size
+        records = manifest.layout(chunks, stored)
+        self.assertTrue(any(record.source == manifest.SELF for record in records))
+        with open(path, 'rb') as f:
+            encoded = b''.join(manifest.encode(f, records))
+        self.assertLess(len(encoded), len(content) - len(table) // 2 - len(repeated) // 2)
+
+        source = b'abc' + content[:7 + len(table)]
+
+        def read_reference(result_id, offset, size):
+            self.assertIn(result_id, (3, manifest.SELF))
+            return (source if result_id == 3 else encoded)[offset:offset + size]
+        self.assertEqual(b''.join(manifest.decode(io.BytesIO(encoded), read_reference)), content)
+        with self.assertRaises(ValueError):
+            list(manifest.decode(io.BytesIO(encoded[:-10]), read_reference))
+
+    def test_recompress_file(self):
+        """Test that an artifact is re-encoded losslessly and that recompression stops when asked"""
+        source_path = os.path.join(self.test_dir, 'source.txt.xz')
+        test_data = b'Recompressed later at a higher preset. ' * 10000
+        engine.compress_bytes(test_data, source_path, preset=0)
+
+        output_path = os.path.join(self.test_dir, 'recompressed.xz')
+        compressed_digest = engine.new_digest()
+        codec, size = engine.recompress_file(source_path, output_path, compressed_digest=compressed_digest)
+        self.assertEqual(codec, 'lzma-9e-text')
+        self.assertEqual(size, os.path.getsize(output_path))
+        self.assertEqual(verifier.file_digest(output_path), compressed_digest.hexdigest())
+        with open(output_path, 'rb') as f:
+            self.assertEqual(lzma.decompress(f.read()), test_data)
+
+        checks = []
+        self.assertIsNone(
+            engine.recompress_file(source_path, output_path, should_stop=lambda: checks.append(1) or len(checks) > 1)
+        )
+        self.assertEqual(len(checks), 2)
+
+    def test_recompress_codec_probes_match_full_encoders(self):
+        """Test that codecs are picked with encoders sized to the sample, which compress it like the full ones"""
+        samples = (
+            b'Recompressed later at a higher preset. ' * 2000,
+            np.arange(20000, dtype='<u4').tobytes(),
+            random.Random(0).randbytes(50_000),
+        )
+        for sample in samples:
+            for codec in engine.RECOMPRESS_CODECS:
+                full, probe = engine.CODECS[codec].compressor(), engine.CODECS[codec].probe(len(sample))
+                self.assertEqual(
+                    len(probe.compress(sample) + probe.flush()), len(full.compress(sample) + full.flush())
+                )
+        self.assertEqual(engine.choose_recompress_codec(samples[1]), 'lzma-9e-delta4')
+
+
+class PreconditionerTestCase(TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def _write(self, name, data):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_columnar_round_trip(self):
+        """Test that delimited files of every shape come back byte for byte"""
+        columnar = preconditioners.PRECONDITIONERS['columnar']
+        rng = random.Random(2)
+        rows = [
+            f'{1700000000 + i * 3},{rng.randint(-50, 50)},{rng.gauss(0, 3):.3f},{rng.choice(["ok", "bad"])},{i}-x'
+            for i in range(500)
+        ]
+        samples = [
+            ('t,a,b,flag,id\n' + '\n'.join(rows) + '\n').encode(),
+            ('t,a,b,flag,id\r\n' + '\r\n'.join(rows)).encode(),
+            b'a\tb\n-0.00\t0\n1.50\t-0\n,\t\n',
+            b'x,y\n007,1.5\n8,10\n',
+        ]
+        for data in samples:
+            payload = columnar.encode(data)
+            self.assertIsNotNone(payload)
+            self.assertEqual(columnar.decode(payload), data)
+            with mock.patch.object(preconditioners.Columnar, 'DECODE_BLOCK_ROWS', 7):
+                self.assertEqual(columnar.decode(payload), data)
+
+    def test_columnar_skips_unsupported_layouts(self):
+        """Test that quoted, ragged or mixed-newline files are not transformed"""
+        columnar = preconditioners.PRECONDITIONERS['columnar']
+        self.assertIsNone(columnar.encode(b'a,b\n"1,2",3\n'))
+        self.assertIsNone(columnar.encode(b'a,b\n1,2,3\n'))
+        self.assertIsNone(columnar.encode(b'a,b\r\n1,2\n3,4\r\n'))
+
+        path = self._write('notes.txt', b'plain text, nothing tabular\n')
+        self.assertEqual(preconditioners.encode_file(path, 'notes.txt'), (None, None))
+
+    def test_encode_file_limits_and_verifies(self):
+        """Test that files over a transform's max_size, or that don't decode back, are compressed as-is"""
+        data = b'a,b,c\n' + b''.join(b'%d,%d,x\n' % (i, i * 2) for i in range(5000))
+        path = self._write('table.csv', data)
+        self.assertEqual(preconditioners.encode_file(path, 'table.csv')[0], 'columnar')
+        with mock.patch.object(preconditioners.Columnar, 'max_size', len(data) - 1):
+            self.assertEqual(preconditioners.encode_file(path, 'table.csv'), (None, None))
+
+        real_iter_decode = preconditioners.Columnar.iter_decode
+
+        def iter_decode(self, payload):
+            *blocks, last = real_iter_decode(self, payload)
+            yield from blocks
+            yield last[:-1] + b'?'
+
+        with mock.patch.object(preconditioners.Columnar, 'iter_decode', iter_decode):
+            self.assertEqual(preconditioners.encode_file(path, 'table.csv'), (None, None))
+
+    def _npy(self, array):
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        return buffer.getvalue()
+
+    def test_shuffle_round_trip(self):
+        """Test that numeric arrays come back byte for byte and compress better"""
+        shuffle = preconditioners.PRECONDITIONERS['shuffle']
+        rng = np.random.default_rng(4)
+        signal = self._npy(np.cumsum(rng.normal(0, 0.01, 50000)).astype(np.float32))
+        samples = [
+            signal,
+            self._npy(np.arange(20000, dtype='>i8').reshape(100, 200)),
+            self._npy(np.full(3000, 1 + 2j, dtype=np.complex128)),
+            np.linspace(0, 1, 30000).astype('<f8').tobytes() + b'odd',
+        ]
+        for data in samples:
+            payload = shuffle.encode(data)
+            self.assertIsNotNone(payload)
+            self.assertEqual(shuffle.decode(payload), data)
+            # Decoded in blocks, each continuing the XOR or delta coding of the one before
+            with mock.patch.object(preconditioners.ByteShuffle, 'DECODE_BLOCK_SIZE', 1000):
+                self.assertEqual(shuffle.decode(payload), data)
+
+        self.assertLess(len(lzma.compress(shuffle.encode(signal))), len(lzma.compress(signal)))
+        self.assertIsNone(shuffle.encode(self._npy(np.zeros(10))))
+        self.assertIsNone(shuffle.encode(self._npy(np.array(['a', 'b'] * 1000))))
+
+        # Extended precision has no integer view to shuffle as, it is compressed as-is
+        for dtype in (np.longdouble, np.clongdouble):
+            if np.dtype(np.longdouble).itemsize == 8:
+                break  # long double is plain float64 on this platform
+            data = self._npy(np.linspace(0, 1, 5000).astype(dtype))
+            self.assertIsNone(shuffle.encode(data))
+            self.assertEqual(preconditioners.encode_file(self._write('wide.npy', data), 'wide.npy'), (None, None))
+
+    def test_auto_detects_arrays(self):
+        """Test that 'auto' picks the byte shuffle for .npy files"""
+        data = self._npy(np.sin(np.linspace(0, 100, 40000)))
+        path = self._write('wave.dat', data)
+        name, container = preconditioners.encode_file(path, 'wave.dat')
+        self.assertEqual(name, 'shuffle')
+        self.assertEqual(preconditioners.unpack(container), data)
+
+    def test_compress_single_with_preconditioner(self):
+        """Test that a preconditioned .xz decodes to the original and beats plain LZMA"""
+        rng = random.Random(3)
+        data = b'time,station,value\n' + b''.join(
+            f'{1700000000 + i},{rng.randint(1, 9)},{rng.gauss(20, 2):.2f}\n'.encode() for i in range(20000)
+        )
+        source_path = self._write('readings.csv', data)
+        out_dir = os.path.join(self.test_dir, 'out')
+
+        plain = engine.compress_single(source_path, 'readings.csv', out_dir)
+        outcome = engine.compress_single(source_path, 'readings.csv', out_dir, preconditioner='auto')
+
+        self.assertEqual(outcome.preconditioner, 'columnar')
+        self.assertEqual(outcome.compressed_filename, 'readings.csv.lzpc.xz')
+        self.assertLess(outcome.compressed_file_size, plain.compressed_file_size)
+        with open(outcome.compressed_path, 'rb') as f:
+            container = lzma.decompress(f.read())
+        self.assertEqual(preconditioners.unpack(container), data)
+
+        # The command-line decoder restores the original next to the container
+        container_path = self._write('readings.csv.lzpc', container)
+        preconditioners.main(['decode', container_path])
+        with open(os.path.join(self.test_dir, 'readings.csv'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+
+class PredictorTestCase(TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.user = User.objects.create_user(username='p@example.com', email='p@example.com', password='x')
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        jobs._waiting.clear()
+
+    def test_sample_estimates_compressed_size(self):
+        """Test that a stratified sample predicts the real size within a factor of two"""
+        rng = random.Random(5)
+        data = b''.join(f'{i},{rng.randint(0, 999)},{rng.choice(["a", "b", "c"])}\n'.encode() for i in range(200000))
+        path = os.path.join(self.test_dir, 'big.csv')
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        estimate = predictor.combine(predictor.sample(path))
+        actual = len(lzma.compress(data))
+        self.assertLess(estimate.compressed_size, actual * 2)
+        self.assertGreater(estimate.compressed_size, actual / 2)
+        self.assertGreater(estimate.seconds, 0)
+
+    def test_history_outweighs_sample_as_it_grows(self):
+        """Test that comparable past results pull the throughput towards them"""
+        for index in range(20):
+            file_record = File.objects.create(
+                user=self.user, original_filename=f'old{index}.csv', original_file_size=1000000, file_path='/x'
+            )
+            CompressionResult.objects.create(
+                file=file_record, compressed_filename='old.csv.xz', compressed_file_size=100000,
+                compression_ratio=90.0, compression_time=1.0, download_link='/x'
+            )
+        history = predictor.historical_throughput(CompressionResult.objects.all(), '.csv', 2000000)
+        self.assertEqual(history, (1000000.0, 20))
+        self.assertEqual(predictor.historical_throughput(CompressionResult.objects.all(), '.npy', 2000000)[1], 0)
+
+        stats = predictor.SampleStats(size=2000000, ratio=0.1, throughput=4000000.0)
+        self.assertAlmostEqual(predictor.combine(stats).seconds, 0.5)
+        self.assertAlmostEqual(predictor.combine(stats, history).seconds, 2000000 / 1600000.0)
+        unsampled = stats._replace(sampled=False)
+        self.assertAlmostEqual(predictor.combine(unsampled).seconds, 0.5)
+        self.assertAlmostEqual(predictor.combine(unsampled, history).seconds, 2.0)
+
+    def test_shortest_job_runs_first(self):
+        """Test that waiting jobs are taken shortest first, with ageing"""
+        now = time.monotonic()
+        jobs._waiting.update({1: (30.0, now), 2: (2.0, now), 3: (10.0, now), 4: (40.0, now - 39)})
+        self.assertEqual([jobs._take_shortest() for _ in range(4)], [4, 2, 3, 1])
+
+
+@override_settings(COMPRESSION_JOBS_EAGER=True)
+class CompressionAsyncViewsTestCase(TestCase):
+    def setUp(self):
+        self.async_client = AsyncClient()
+        self.user = User.objects.create_user(
+            username='testuser@example.com',
+            email='testuser@example.com',
+            password='testpass123'
+        )
+
+        self.test_media_dir = tempfile.mkdtemp()
+        settings.MEDIA_ROOT = self.test_media_dir
+
+    def tearDown(self):
+        if os.path.exists(self.test_media_dir):
+            shutil.rmtree(self.test_media_dir)
+
+    async def test_async_upload_progress_and_streamed_download(self):
+        """Test the async views end to end through the ASGI request path"""
+        await self.async_client.aforce_login(self.user)
+
+        test_content = b'This is test content for the async path. ' * 200
+        test_file = SimpleUploadedFile("async_test.txt", test_content, content_type="text/plain")
+        upload_response = await self.async_client.post(reverse('dashboard'), {'files': test_file})
+        self.assertEqual(upload_response.status_code, 200)
+        self.assertTrue(upload_response.json()['success'])
+
+        compression_result = await CompressionResult.objects.select_related('file').aget()
+        progress_response = await self.async_client.get(upload_response.json()['progress_url'])
+        self.assertEqual(progress_response.json()['status'], 'completed')
+        self.assertEqual(progress_response.json()['progress'], 100)
+
+        download_response = await self.async_client.get(
+            reverse('download_compressed_file', kwargs={'file_id': compression_result.file.id})
+        )
+        self.assertEqual(download_response.status_code, 200)
+        self.assertTrue(download_response.is_async)
+        downloaded_content = b''.join([chunk async for chunk in download_response.streaming_content])
+        self.assertEqual(lzma.decompress(downloaded_content), test_content)
+
+        self.assertFalse(os.path.exists(compression_result.compressed_path))
+
+    async def test_async_progress_unknown_file(self):
+        """Test that the async progress view returns 404 for another user's file"""
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('compression_progress', kwargs={'job_id': 999}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_export_streams_without_buffering(self):
+        """Test that the ASGI export reads rows with an async iterator instead of listing them first"""
+        await self.async_client.aforce_login(self.user)
+        for index in range(3):
+            file = await File.objects.acreate(
+                user=self.user, original_filename=f'data{index}.csv', original_file_size=100, file_path=''
+            )
+            await CompressionResult.objects.acreate(
+                file=file, compressed_filename=f'data{index}.csv.xz', compressed_file_size=10,
+                compression_ratio=90, compression_time=0.1, download_link=''
+            )
+
+        response = await self.async_client.get(reverse('export_results'), {'format': 'json'})
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([row['original_filename'] for row in json.loads(body)], ['data0.csv', 'data1.csv', 'data2.csv'])
+
+    async def test_async_event_stream_for_finished_job(self):
+        """Test that the ASGI event stream sends the final state and closes"""
+        await self.async_client.aforce_login(self.user)
+        job = await CompressionJob.objects.acreate(
+            user=self.user, status=CompressionJob.STATUS_FAILED, error='Disk full'
+        )
+
+        response = await self.async_client.get(reverse('compression_events', kwargs={'job_id': job.id}))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertTrue(body.startswith('event: failed\n'))
+        self.assertIn('"message": "Disk full"', body)
+
+
+class DatabaseConnectionTestCase(TransactionTestCase):
+    """Tests for connection settings and reconnection on worker threads"""
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite settings')
+    def test_sqlite_connections_use_wal_and_busy_timeout(self):
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 20000)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+        self.assertGreater(connection.settings_dict['CONN_MAX_AGE'], 0)
+
+    def test_worker_reconnects_after_broken_or_expired_connection(self):
+        """Test that refresh_connections() replaces dead and expired connections but not one in a transaction"""
+        def worker():
+            User.objects.exists()
+            # Dropped by the server while the job compressed: the last query failed and a ping would too
+            connection.errors_occurred = True
+            with mock.patch.object(connection, 'is_usable', return_value=False):
+                database.refresh_connections()
+            self.assertIsNone(connection.connection)
+            self.assertFalse(User.objects.exists())  # Reconnects
+
+            connection.close_at = time.monotonic() - 1  # Past CONN_MAX_AGE
+            with transaction.atomic():
+                database.refresh_connections()
+                self.assertIsNotNone(connection.connection)
+            database.refresh_connections()
+            self.assertIsNone(connection.connection)
+            connection.close()
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pool.submit(worker).result()
+
+
+@override_settings(COMPRESSION_JOBS_EAGER=True)
+class DownloadClaimTestCase(TransactionTestCase):
+    """One-time downloads, hit from several threads at once, each on its own database connection"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser@example.com',
+            email='testuser@example.com',
+            password='testpass123'
+        )
+        self.test_media_dir = tempfile.mkdtemp()
+        settings.MEDIA_ROOT = self.test_media_dir
+
+    def tearDown(self):
+        if os.path.exists(self.test_media_dir):
+            shutil.rmtree(self.test_media_dir)
+
+    def test_concurrent_downloads_are_claimed_once(self):
+        """Test that of many simultaneous download requests exactly one streams the artifact"""
+        test_content = b'Downloaded exactly once. ' * 2000
+        client = Client()
+        client.force_login(self.user)
+        client.post(reverse('dashboard'), {'files': SimpleUploadedFile("once.txt", test_content)})
+        compression_result = CompressionResult.objects.get()
+        url = reverse('download_compressed_file', kwargs={'file_id': compression_result.file.id})
+
+        requests = 12
+        barrier = threading.Barrier(requests)
+
+        def download(_):
+            request_client = Client()
+            request_client.cookies = client.cookies
+            try:
+                barrier.wait()
+                response = request_client.get(url)
+                content = b''.join(response.streaming_content) if response.status_code == 200 else None
+                return response.status_code, content
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=requests) as pool:
+            outcomes = list(pool.map(download, range(requests)))
+
+        self.assertEqual(sorted(status for status, _ in outcomes), [200] + [302] * (requests - 1))
+        content = next(content for status, content in outcomes if status == 200)
+        self.assertEqual(lzma.decompress(content), test_content)
+        self.assertFalse(os.path.exists(compression_result.compressed_path))
+        self.assertTrue(CompressionResult.objects.get(id=compression_result.id).downloaded)
+
+    def test_interrupted_download_can_be_retried(self):
+        """Test that a transfer that breaks off releases the claim and keeps the artifact"""
+        client = Client()
+        client.force_login(self.user)
+        test_content = random.Random(2).randbytes(engine.CHUNK_SIZE * 3)
+        client.post(reverse('dashboard'), {'files': SimpleUploadedFile("noise.bin", test_content)})
+        compression_result = CompressionResult.objects.get()
+
+        self.assertTrue(views._claim_download(compression_result.id))
+        content = views._iter_download(compression_result.compressed_path, compression_result.id)
+        next(content)
+        content.close()  # The client went away after the first chunk
+        self.assertFalse(CompressionResult.objects.get(id=compression_result.id).downloaded)
+        self.assertTrue(os.path.exists(compression_result.compressed_path))
+
+        response = client.get(reverse('download_compressed_file', kwargs={'file_id': compression_result.file.id}))
+        self.assertEqual(lzma.decompress(b''.join(response.streaming_content)), test_content)
+        self.assertTrue(CompressionResult.objects.get(id=compression_result.id).downloaded)
+        self.assertFalse(os.path.exists(compression_result.compressed_path))
+
+
+class CompressionEventsTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser@example.com',
+            email='testuser@example.com',
+            password='testpass123'
+        )
+
+    def test_publish_reaches_subscribers_of_that_job_only(self):
+        """Test the in-process event broker"""
+        with events.subscribe(1) as first, events.subscribe(2) as second:
+            events.publish(1, {'status': 'running', 'progress': 40})
+            self.assertEqual(first.get(timeout=1), {'status': 'running', 'progress': 40})
+            self.assertIsNone(second.get(timeout=0.01))
+
+    def test_running_job_publishes_transitions_and_progress(self):
+        """Test that a job run publishes running, progress ticks and completed"""
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir)
+        settings.MEDIA_ROOT = test_dir
+        file_path = os.path.join(test_dir, 'big.bin')
+        with open(file_path, 'wb') as f:
+            f.write(b'progress ticks ' * (3 * engine.COMPRESS_BLOCK_SIZE // 15))
+
+        job = CompressionJob.objects.create(user=self.user)
+        File.objects.create(
+            user=self.user, original_filename='big.bin', original_file_size=os.path.getsize(file_path),
+            file_path=file_path, job=job
+        )
+
+        with events.subscribe(job.id) as subscription:
+            jobs.run_job(job.id)
+            received = []
+            while (event := subscription.get(timeout=0.01)) is not None:
+                received.append(event)
+
+        statuses = [event['status'] for event in received]
+        self.assertEqual(statuses[0], 'running')
+        self.assertEqual(statuses[-1], 'completed')
+        progress = [event['progress'] for event in received if event['status'] == 'running']
+        self.assertEqual(progress, sorted(progress))
+        self.assertGreater(len(set(progress)), 2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, CompressionJob.STATUS_COMPLETED)
+        self.assertIsNotNone(job.result)
+
+    def test_event_stream_sends_state_then_closes_when_finished(self):
+        """Test the SSE view for a job that has already completed"""
+        file_obj = File.objects.create(
+            user=self.user, original_filename='test.txt', original_file_size=1024, file_path='/path/to/test.txt'
+        )
+        compression_result = CompressionResult.objects.create(
+            file=file_obj, compressed_filename='test.xz', compressed_file_size=512,
+            compression_ratio=50.0, compression_time=2.5, download_link='/download/1/'
+        )
+        job = CompressionJob.objects.create(
+            user=self.user, status=CompressionJob.STATUS_COMPLETED, result=compression_result
+        )
+
+        self.client.login(username='testuser@example.com', password='testpass123')
+        response = self.client.get(reverse('compression_events', kwargs={'job_id': job.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('event: completed\n'))
+        self.assertIn(reverse('compression_results', kwargs={'result_id': compression_result.id}), body)
+
+    def test_event_stream_requires_job_owner(self):
+        """Test that users cannot follow other users' jobs"""
+        other_user = User.objects.create_user(
+            username='otheruser@example.com', email='otheruser@example.com', password='otherpass123'
+        )
+        job = CompressionJob.objects.create(user=other_user)
+
+        self.client.login(username='testuser@example.com', password='testpass123')
+        response = self.client.get(reverse('compression_events', kwargs={'job_id': job.id}))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(COMPRESSION_JOBS_EAGER=True)
 class CompressionIntegrationTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -367,12 +1148,7 @@ class CompressionIntegrationTestCase(TestCase):
         file_obj = compression_result.file
 
         # Get the compressed file path before download
-        compressed_path = os.path.join(
-            settings.MEDIA_ROOT,
-            'compressed',
-            str(self.user.id),
-            compression_result.compressed_filename
-        )
+        compressed_path = compression_result.compressed_path
 
         # Verify compressed file exists before download
         self.assertTrue(os.path.exists(compressed_path))
@@ -384,7 +1160,7 @@ class CompressionIntegrationTestCase(TestCase):
         self.assertEqual(download_response['Content-Type'], 'application/octet-stream')
 
         # Verify the downloaded content can be decompressed
-        downloaded_content = download_response.content
+        downloaded_content = b''.join(download_response.streaming_content)
         decompressed_content = lzma.decompress(downloaded_content)
         self.assertEqual(decompressed_content, test_content)
 
@@ -395,3 +1171,773 @@ class CompressionIntegrationTestCase(TestCase):
         compression_result.refresh_from_db()
         self.assertTrue(compression_result.downloaded)
         self.assertIsNotNone(compression_result.downloaded_at)
+
+
+@override_settings(COMPRESSION_JOBS_EAGER=True)
+class CompressionAPITestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='pipeline@example.com',
+            email='pipeline@example.com',
+            password='testpass123'
+        )
+        self.token, key = APIToken.create_token(self.user, name='ingest')
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {key}'}
+
+        self.test_media_dir = tempfile.mkdtemp()
+        settings.MEDIA_ROOT = self.test_media_dir
+
+    def tearDown(self):
+        if os.path.exists(self.test_media_dir):
+            shutil.rmtree(self.test_media_dir)
+
+    def _upload(self, count, **extra):
+        files = [
+            SimpleUploadedFile(f'dataset{i}.csv', f'id,value\n{i},{i * 2}\n'.encode() * 200)
+            for i in range(count)
+        ]
+        return self.client.post(reverse('api_create_jobs'), {'files': files, **extra}, **self.auth)
+
+    def test_requires_token(self):
+        """Test that API calls without a valid token are rejected"""
+        response = self.client.get(reverse('api_job_status'), {'ids': '1'})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(
+            reverse('api_job_status'), {'ids': '1'}, HTTP_AUTHORIZATION='Token not-a-real-key'
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_batch_upload_creates_one_job_per_file(self):
+        """Test that a batch upload without CSRF returns a job per file at once"""
+        csrf_client = Client(enforce_csrf_checks=True)
+        files = [SimpleUploadedFile(f'd{i}.txt', b'data ' * 100) for i in range(3)]
+        response = csrf_client.post(reverse('api_create_jobs'), {'files': files}, **self.auth)
+        self.assertEqual(response.status_code, 202)
+
+        created = response.json()['jobs']
+        self.assertEqual([job['files'] for job in created], [['d0.txt'], ['d1.txt'], ['d2.txt']])
+        self.assertEqual(CompressionJob.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(CompressionResult.objects.count(), 3)
+
+    def test_archive_batch_creates_single_job(self):
+        """Test that archive=1 compresses the batch as one job"""
+        response = self._upload(3, archive='1')
+        self.assertEqual(response.status_code, 202)
+        created = response.json()['jobs']
+        self.assertEqual(len(created), 1)
+        self.assertEqual(len(created[0]['files']), 3)
+
+    def test_upload_returns_estimate(self):
+        """Test that every queued job comes back with a size and time estimate"""
+        created = self._upload(2).json()['jobs']
+        for job in created:
+            self.assertGreater(job['estimate']['compressed_size'], 0)
+            self.assertGreaterEqual(job['estimate']['seconds'], 0)
+        self.assertIsNotNone(CompressionJob.objects.get(id=created[0]['job_id']).estimated_seconds)
+
+    def test_archive_mode(self):
+        """Test that archive_mode is passed to the job and recorded on the result"""
+        response = self._upload(3, archive='1', archive_mode='parallel')
+        self.assertEqual(response.status_code, 202)
+        job = CompressionJob.objects.get(id=response.json()['jobs'][0]['job_id'])
+        self.assertEqual(job.archive_mode, 'parallel')
+        self.assertEqual(job.result.archive_mode, 'parallel')
+        self.assertTrue(job.result.compressed_filename.endswith('.tar'))
+
+        response = self._upload(2, archive='1', archive_mode='fastest')
+        self.assertEqual(response.status_code, 400)
+
+    def test_preconditioner(self):
+        """Test that a requested preconditioner is applied and recorded per file"""
+        response = self._upload(1, preconditioner='columnar')
+        self.assertEqual(response.status_code, 202)
+        job = CompressionJob.objects.get(id=response.json()['jobs'][0]['job_id'])
+        self.assertEqual(job.result.preconditioner, 'columnar')
+        self.assertEqual(job.result.compressed_filename, 'dataset0.csv.lzpc.xz')
+
+        # Downloaded as a plain .xz of the original, decoded on the way
+        payload = self.client.get(reverse('api_job_results'), {'job_ids': job.id}, **self.auth).json()
+        self.assertEqual(payload['results'][0]['compressed_filename'], 'dataset0.csv.xz')
+        response = self.client.get(payload['results'][0]['download_url'], **self.auth)
+        self.assertIn('filename="dataset0.csv.xz"', response['Content-Disposition'])
+        self.assertEqual(lzma.decompress(b''.join(response.streaming_content)), b'id,value\n0,0\n' * 200)
+
+        response = self._upload(1, preconditioner='magic')
+        self.assertEqual(response.status_code, 400)
+
+    def test_compare_mode(self):
+        """Test that compare mode records every codec and shows them on the results page"""
+        response = self._upload(1, compare='lzma-9')
+        self.assertEqual(response.status_code, 202)
+        result = CompressionJob.objects.get(id=response.json()['jobs'][0]['job_id']).result
+        self.assertEqual(result.codec, 'lzma-9')
+        self.assertEqual(result.codec_trials.count(), len(engine.COMPARE_CODECS))
+        self.assertEqual(list(result.codec_trials.filter(kept=True).values_list('codec', flat=True)), ['lzma-9'])
+
+        self.client.force_login(self.user)
+        page = self.client.get(reverse('compression_results', kwargs={'result_id': result.id}))
+        self.assertContains(page, 'Codec Comparison')
+        self.assertContains(page, 'bzip2 level 9')
+
+    def test_bulk_status_and_results(self):
+        """Test that status and results of many jobs come back in one request"""
+        job_ids = [job['job_id'] for job in self._upload(2).json()['jobs']]
+        other_job = CompressionJob.objects.create(
+            user=User.objects.create_user(username='o@example.com', email='o@example.com', password='x')
+        )
+        ids = ','.join(str(job_id) for job_id in job_ids + [other_job.id])
+
+        status_response = self.client.get(reverse('api_job_status'), {'ids': ids}, **self.auth)
+        self.assertEqual(status_response.status_code, 200)
+        data = status_response.json()
+        self.assertEqual([job['status'] for job in data['jobs']], ['completed', 'completed'])
+        self.assertEqual(data['missing'], [other_job.id])
+
+        with self.assertNumQueries(2):  # Token lookup, then one query for every result
+            results_response = self.client.get(reverse('api_job_results'), {'job_ids': ids}, **self.auth)
+        results = results_response.json()['results']
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(result['compressed_filename'].endswith('.csv.xz') for result in results))
+
+        download_response = self.client.get(results[0]['download_url'], **self.auth)
+        self.assertEqual(download_response.status_code, 200)
+        self.assertIn(b'id,value', lzma.decompress(b''.join(download_response.streaming_content)))
+        self.assertEqual(self.client.get(results[0]['download_url'], **self.auth).status_code, 410)
+
+        response = self.client.get(reverse('api_job_status'), {'ids': '1,two'}, **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], "'ids' must be comma-separated integer ids")
+
+    def test_missing_artifact_is_not_claimed(self):
+        """Test that a download answered 404 for a missing artifact can be retried once it is back"""
+        result = CompressionJob.objects.get(id=self._upload(1).json()['jobs'][0]['job_id']).result
+        moved_path = result.compressed_path + '.moved'
+        os.rename(result.compressed_path, moved_path)
+        download_url = reverse('api_download_result', kwargs={'result_id': result.id})
+        self.assertEqual(self.client.get(download_url, **self.auth).status_code, 404)
+        self.assertFalse(CompressionResult.objects.get(id=result.id).downloaded)
+
+        os.rename(moved_path, result.compressed_path)
+        response = self.client.get(download_url, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'id,value', lzma.decompress(b''.join(response.streaming_content)))
+
+    def test_server_side_paths_inside_allowed_root(self):
+        """Test that server-side files are compressed in place and never deleted"""
+        allowed_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, allowed_root)
+        os.makedirs(os.path.join(allowed_root, 'run1'))
+        source_path = os.path.join(allowed_root, 'run1', 'readings.txt')
+        with open(source_path, 'wb') as f:
+            f.write(b'sensor reading 42\n' * 500)
+
+        with self.settings(COMPRESSION_API_ALLOWED_ROOT=allowed_root):
+            response = self.client.post(
+                reverse('api_create_jobs'), {'paths': ['run1/readings.txt']},
+                content_type='application/json', **self.auth
+            )
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json()['jobs'][0]['status'], 'completed')
+            self.assertTrue(os.path.exists(source_path))
+
+            response = self.client.post(
+                reverse('api_create_jobs'), {'paths': ['../etc/passwd']},
+                content_type='application/json', **self.auth
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('outside the allowed directory', response.json()['error'])
+
+            for body in ([], 'run1/readings.txt'):
+                response = self.client.post(
+                    reverse('api_create_jobs'), json.dumps(body), content_type='application/json', **self.auth
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error'], 'The request body must be a JSON object')
+
+    def test_same_name_uploads_do_not_collide(self):
+        """Test that uploads and artifacts with the same name get their own sharded paths"""
+        files = [SimpleUploadedFile('data.csv', f'run,{i}\n'.encode() * 100) for i in range(2)]
+        response = self.client.post(reverse('api_create_jobs'), {'files': files}, **self.auth)
+        self.assertEqual(response.status_code, 202)
+
+        results = [
+            CompressionJob.objects.get(id=job['job_id']).result for job in response.json()['jobs']
+        ]
+        self.assertNotEqual(results[0].file.file_path, results[1].file.file_path)
+        self.assertNotEqual(results[0].compressed_path, results[1].compressed_path)
+        for index, result in enumerate(results):
+            self.assertEqual(result.compressed_filename, 'data.csv.xz')
+            relative = os.path.relpath(result.compressed_path, settings.MEDIA_ROOT).split(os.sep)
+            self.assertEqual(relative[:2], ['compressed', str(self.user.id)])
+            self.assertEqual(relative[2] + relative[3], relative[4][:4])  # Sharded on the artifact id
+            with open(result.compressed_path, 'rb') as f:
+                self.assertEqual(lzma.decompress(f.read()), f'run,{index}\n'.encode() * 100)
+
+        download_url = reverse('api_download_result', kwargs={'result_id': results[0].id})
+        response = self.client.get(download_url, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        b''.join(response.streaming_content)
+        self.assertFalse(os.path.exists(os.path.dirname(results[0].compressed_path)))
+
+    def test_large_uploads_are_spooled_and_renamed(self):
+        """Test that uploads over the memory limit go to disk once and are renamed, not copied, into place"""
+        data = b'reading,value\n' + b'7,0.25\n' * 1000
+        spooled = SpooledUpload('big.csv', 'text/csv', 0, None)
+        spooled.write(data)
+        spooled.seek(0)
+        temp_path = spooled.temporary_file_path()
+        inode = os.stat(temp_path).st_ino
+        self.assertEqual(os.path.dirname(temp_path), storage.upload_temp_dir())
+
+        file_path = views._store_upload(spooled, self.user.id)
+        spooled.close()
+        self.assertFalse(os.path.exists(temp_path))
+        self.assertEqual(os.stat(file_path).st_ino, inode)
+        with open(file_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        with self.settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024):
+            response = self.client.post(
+                reverse('api_create_jobs'), {'files': [SimpleUploadedFile('big.csv', data)]}, **self.auth
+            )
+        self.assertEqual(response.status_code, 202)
+        result = CompressionJob.objects.get(id=response.json()['jobs'][0]['job_id']).result
+        with open(result.compressed_path, 'rb') as f:
+            self.assertEqual(lzma.decompress(f.read()), data)
+        self.assertEqual(os.listdir(storage.upload_temp_dir()), [])
+
+    def test_job_metadata_written_in_one_transaction(self):
+        """Test that a batch's jobs share one File insert, and a failure leaves no rows or uploads behind"""
+        batches = []
+        for index in range(3):
+            file_path = os.path.join(self.test_media_dir, f'upload{index}.csv')
+            with open(file_path, 'wb') as f:
+                f.write(b'id\n1\n')
+            batches.append([(f'upload{index}.csv', 5, file_path)])
+        estimates = [predictor.Estimate(10, 0.1)] * len(batches)
+        options = {'archive_mode': engine.ARCHIVE_AUTO}
+
+        with CaptureQueriesContext(connection) as queries:
+            created = views._create_jobs(self.user, batches, estimates, options)
+        file_inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "compression_file"')]
+        job_inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "compression_compressionjob"')]
+        self.assertEqual((len(file_inserts), len(job_inserts)), (1, 1))
+        self.assertEqual([job.files.count() for job in created], [1, 1, 1])
+
+        broken = batches + [[('unsized.csv', None, batches[0][0][2])]]  # original_file_size is NOT NULL
+        jobs_before = CompressionJob.objects.count()
+        with self.assertRaises(IntegrityError):
+            views._create_jobs(self.user, broken, estimates + estimates[:1], options)
+        self.assertEqual(CompressionJob.objects.count(), jobs_before)
+        self.assertFalse(any(os.path.exists(path) for batch in batches for _, _, path in batch))
+
+    def test_estimates_look_up_history_once_per_file_type(self):
+        """Test that estimating several jobs queries past throughput once per extension, not per job"""
+        batches = []
+        for index, name in enumerate(('a.csv', 'b.csv', 'c.txt', 'd.csv')):
+            file_path = os.path.join(self.test_media_dir, name)
+            with open(file_path, 'wb') as f:
+                f.write(b'id,value\n' + b'1,2\n' * 100 * (index + 1))
+            batches.append([(name, os.path.getsize(file_path), file_path)])
+
+        with mock.patch.object(
+            predictor, 'historical_throughput', wraps=predictor.historical_throughput
+        ) as lookup:
+            estimates = async_to_sync(views._estimate_jobs)(batches)
+        self.assertEqual(sorted(call.args[1] for call in lookup.call_args_list), ['.csv', '.txt'])
+        self.assertEqual(len(estimates), 4)
+        self.assertTrue(all(estimate.compressed_size > 0 for estimate in estimates))
+
+    def test_estimates_sample_a_bounded_number_of_files_per_request(self):
+        """Test that a large request samples at most MAX_SAMPLED_FILES files, on the compression pool"""
+        batches = []
+        for index in range(predictor.MAX_SAMPLED_FILES * 3):
+            file_path = os.path.join(self.test_media_dir, f'{index}.csv')
+            with open(file_path, 'wb') as f:
+                f.write(b'id,value\n' + b'1,2\n' * 50)
+            batches.append([(f'{index}.csv', os.path.getsize(file_path), file_path)])
+
+        threads = []
+        real_sample = predictor.sample
+
+        def sample(*args):
+            threads.append(threading.current_thread().name)
+            return real_sample(*args)
+
+        with mock.patch.object(predictor, 'sample', side_effect=sample):
+            estimates = async_to_sync(views._estimate_jobs)(batches)
+        self.assertEqual(len(threads), predictor.MAX_SAMPLED_FILES)
+        self.assertTrue(all(name.startswith('compression-compression') for name in threads))
+        self.assertEqual(len(estimates), len(batches))
+        self.assertTrue(all(estimate.compressed_size > 0 for estimate in estimates))
+
+    def test_failed_recording_removes_artifact(self):
+        """Test that a rolled back result deletes its artifact and keeps the uploads"""
+        upload_path = os.path.join(self.test_media_dir, 'upload.txt')
+        with open(upload_path, 'wb') as f:
+            f.write(b'data ' * 100)
+        outcome = engine.compress_single(upload_path, 'upload.txt', storage.artifact_dir(self.user.id))
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+            with views._recording(outcome, [File(file_path=upload_path)]):
+                raise RuntimeError
+        self.assertFalse(os.path.exists(outcome.compressed_path))
+        self.assertTrue(os.path.exists(upload_path))
+
+    def test_legacy_artifact_path(self):
+        """Test that results stored before the sharded layout can still be downloaded"""
+        job = CompressionJob.objects.get(id=self._upload(1).json()['jobs'][0]['job_id'])
+        result = job.result
+        legacy_path = os.path.join(settings.MEDIA_ROOT, 'compressed', str(self.user.id), result.compressed_filename)
+        os.replace(result.compressed_path, legacy_path)
+        CompressionResult.objects.filter(id=result.id).update(compressed_path='')
+
+        download_url = reverse('api_download_result', kwargs={'result_id': result.id})
+        response = self.client.get(download_url, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'id,value', lzma.decompress(b''.join(response.streaming_content)))
+        self.assertFalse(os.path.exists(legacy_path))
+
+    def test_verification_flags_corrupt_results(self):
+        """Test that results are verified in the background and corrupt ones cannot be downloaded"""
+        with self.settings(COMPRESSION_VERIFY=True):
+            single = self._upload(1, preconditioner='columnar').json()['jobs'][0]
+            solid = self._upload(3, archive='1', archive_mode='solid').json()['jobs'][0]
+            parallel = self._upload(3, archive='1', archive_mode='parallel').json()['jobs'][0]
+
+        for created in (single, solid, parallel):
+            result = CompressionJob.objects.get(id=created['job_id']).result
+            self.assertEqual(result.verification, CompressionResult.VERIFICATION_OK)
+        single_result = CompressionJob.objects.get(id=single['job_id']).result
+        self.assertEqual(
+            single_result.file.sha256, hashlib.sha256(b'id,value\n0,0\n' * 200).hexdigest()
+        )
+
+        # Flip one byte of an artifact
+        result = CompressionJob.objects.get(id=solid['job_id']).result
+        compressed_path = result.compressed_path
+        with open(compressed_path, 'r+b') as f:
+            f.seek(40)
+            byte = f.read(1)
+            f.seek(40)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        self.assertIs(verifier.verify_result(result), False)
+        self.assertTrue(CompressionResult.objects.get(id=result.id).is_corrupt)
+
+        download_url = reverse('api_download_result', kwargs={'result_id': result.id})
+        self.assertEqual(self.client.get(download_url, **self.auth).status_code, 409)
+        self.assertTrue(os.path.exists(compressed_path))
+
+    def test_new_versions_stored_as_deltas(self):
+        """Test that versions of a dataset are stored as deltas, rebuilt on download and kept while needed"""
+        rng = random.Random(6)
+        rows = [f'{i},{rng.randint(1, 20)},{rng.gauss(20, 3):.3f}\n'.encode() for i in range(10000)]
+        contents = []
+        for version in range(3):
+            for i in rng.sample(range(len(rows)), 50):
+                rows[i] = f'{i},{version},edited\n'.encode()
+            contents.append(b''.join(rows))
+
+        results = []
+        for version, content in enumerate(contents):
+            data = {'files': [SimpleUploadedFile('readings.csv', content)]}
+            if results:
+                data['previous_version'] = results[-1].file_id
+            response = self.client.post(reverse('api_create_jobs'), data, **self.auth)
+            self.assertEqual(response.status_code, 202)
+            job_id = response.json()['jobs'][0]['job_id']
+            payload = self.client.get(reverse('api_job_results'), {'job_ids': job_id}, **self.auth).json()
+            self.assertEqual(payload['results'][0]['stored_as_delta'], bool(results))
+            results.append(CompressionJob.objects.get(id=job_id).result)
+        full, second, third = results
+        self.assertEqual(third.delta_base, second)
+        self.assertLess(second.compressed_file_size, full.compressed_file_size / 5)
+        self.assertIs(verifier.verify_result(third), True)
+        self.client.force_login(self.user)
+        results_page = self.client.get(reverse('compression_results', kwargs={'result_id': third.id}))
+        self.assertContains(results_page, 'stored as the changes since readings.csv')
+        self.assertContains(self.client.get(reverse('dashboard')), f'<option value="{third.file_id}">')
+
+        def download(result):
+            response = self.client.get(reverse('api_download_result', kwargs={'result_id': result.id}), **self.auth)
+            self.assertEqual(response.status_code, 200)
+            return b''.join(response.streaming_content)
+
+        # The complete artifact stays while later versions are rebuilt from it
+        self.assertEqual(lzma.decompress(download(full)), contents[0])
+        self.assertTrue(os.path.exists(full.compressed_path))
+        results_page = self.client.get(reverse('compression_results', kwargs={'result_id': full.id}))
+        self.assertContains(results_page, 'Its stored data is kept only while a later upload')
+        full = CompressionResult.objects.select_related('file').get(id=full.id)
+        with self.assertNumQueries(1):  # The links between the user's results, walked in memory
+            self.assertTrue(versions._needed(full))
+        # Rebuilt through temporary files, compressed at the preset it was stored with
+        rebuilt = download(third)
+        self.assertEqual(lzma.decompress(rebuilt), contents[2])
+        self.assertLess(len(rebuilt), len(lzma.compress(contents[2], preset=1)))
+        self.assertEqual(os.listdir(storage.rebuild_temp_dir()), [])
+        self.assertFalse(os.path.exists(third.compressed_path))
+        self.assertTrue(os.path.exists(second.compressed_path))
+        self.assertEqual(lzma.decompress(download(second)), contents[1])
+        self.assertFalse(os.path.exists(second.compressed_path))
+        self.assertFalse(os.path.exists(full.compressed_path))
+        results_page = self.client.get(reverse('compression_results', kwargs={'result_id': full.id}))
+        self.assertContains(results_page, 'automatically deleted from our servers')
+
+        # Versions of one file only, of the user's own files
+        other = User.objects.create_user(username='other@example.com', email='other@example.com', password='x')
+        theirs = File.objects.create(user=other, original_filename='theirs.csv', original_file_size=1, file_path='')
+        for data in (
+            {'files': [SimpleUploadedFile('readings.csv', contents[0])], 'previous_version': theirs.id},
+            {'files': [SimpleUploadedFile(name, contents[0]) for name in ('a.csv', 'b.csv')],
+             'previous_version': full.file_id},
+        ):
+            self.assertEqual(self.client.post(reverse('api_create_jobs'), data, **self.auth).status_code, 400)
+        self.assertEqual(CompressionJob.objects.count(), 3)
+
+    def test_deduplication_is_opt_in(self):
+        """Test that uploads are neither chunked nor recorded in the chunk store unless COMPRESSION_DEDUP is set"""
+        self.assertFalse(settings.COMPRESSION_DEDUP)
+        table = random.Random(8).randbytes(100000)
+        for name in ('a.bin', 'b.bin'):
+            self.client.post(reverse('api_create_jobs'), {'files': [SimpleUploadedFile(name, table)]}, **self.auth)
+        self.assertEqual(CompressionResult.objects.filter(deduplicated_size=0).count(), 2)
+        self.assertFalse(Chunk.objects.exists())
+
+    @override_settings(COMPRESSION_DEDUP=True)
+    def test_uploads_deduplicated_against_chunk_store(self):
+        """Test that chunks already stored are referenced, rebuilt on download and kept while referenced"""
+        rng = random.Random(8)
+        table = rng.randbytes(300000)  # Incompressible, LZMA alone can't shrink it
+        contents = [table + b'run 1\n' * 2000, b'run 2 header\n' + table + rng.randbytes(20000)]
+
+        results = []
+        for i, content in enumerate(contents):
+            data = {'files': [SimpleUploadedFile(f'run{i}.bin', content)]}
+            response = self.client.post(reverse('api_create_jobs'), data, **self.auth)
+            job_id = response.json()['jobs'][0]['job_id']
+            payload = self.client.get(reverse('api_job_results'), {'job_ids': job_id}, **self.auth).json()
+            self.assertEqual(payload['results'][0]['deduplicated_size'] > 0, bool(results))
+            results.append(CompressionJob.objects.get(id=job_id).result)
+        first, second = results
+        self.assertFalse(first.is_deduplicated)
+        self.assertEqual(list(second.chunk_sources.all()), [first])
+        self.assertGreater(second.deduplicated_size, len(table) * 0.9)
+        self.assertLess(second.compressed_file_size, len(contents[1]) - second.deduplicated_size + 1000)
+        self.assertGreater(second.dedup_ratio, 5)
+        self.assertIs(verifier.verify_result(second), True)
+        self.client.force_login(self.user)
+        results_page = self.client.get(reverse('compression_results', kwargs={'result_id': second.id}))
+        self.assertContains(results_page, 'Deduplication')
+        self.assertContains(results_page, 'found in your earlier uploads')
+
+        def download(result):
+            response = self.client.get(reverse('api_download_result', kwargs={'result_id': result.id}), **self.auth)
+            self.assertEqual(response.status_code, 200)
+            return lzma.decompress(b''.join(response.streaming_content))
+
+        # The referenced artifact stays until the upload referencing it is downloaded, its chunks leave the store
+        self.assertEqual(download(first), contents[0])
+        self.assertTrue(os.path.exists(first.compressed_path))
+        self.assertFalse(Chunk.objects.filter(result=first).exists())
+        results_page = self.client.get(reverse('compression_results', kwargs={'result_id': first.id}))
+        self.assertContains(results_page, 'Its stored data is kept only while a later upload')
+        self.assertEqual(download(second), contents[1])
+        self.assertEqual(os.listdir(storage.rebuild_temp_dir()), [])
+        self.assertFalse(os.path.exists(second.compressed_path))
+        self.assertFalse(os.path.exists(first.compressed_path))
+        self.assertFalse(Chunk.objects.filter(user=self.user).exists())
+
+        # Released chunks are not referenced again, nor are those of an artifact deleted meanwhile
+        self.client.post(reverse('api_create_jobs'), {'files': [SimpleUploadedFile('a.bin', table)]}, **self.auth)
+        with mock.patch.object(dedup, 'lock_sources', side_effect=dedup.SourceGone) as lock_sources:
+            self.client.post(reverse('api_create_jobs'), {'files': [SimpleUploadedFile('b.bin', table)]}, **self.auth)
+        self.assertEqual(lock_sources.call_count, 1)  # Then stored complete, not tried again
+        third, fourth = CompressionResult.objects.order_by('-id')[:2][::-1]
+        self.assertFalse(third.is_deduplicated)
+        self.assertFalse(fourth.is_deduplicated)
+        self.assertEqual(download(fourth), table)
+
+    def test_cold_artifacts_recompressed_when_idle(self):
+        """Test that cold artifacts are swapped for smaller ones, kept if not smaller, and left alone once claimed"""
+        rng = random.Random(3)
+        words = [''.join(rng.choice('abcdefghij') for _ in range(rng.randint(2, 8))) for _ in range(500)]
+        test_content = ' '.join(rng.choice(words) for _ in range(10000)).encode()
+        self.client.post(
+            reverse('api_create_jobs'), {'files': [SimpleUploadedFile('words.txt', test_content)]}, **self.auth
+        )
+        self._upload(1)
+        fast, default = CompressionResult.objects.order_by('id')
+        # As if compressed at the fastest preset
+        compressed_digest = engine.new_digest()
+        size = engine.compress_bytes(test_content, fast.compressed_path, preset=0, compressed_digest=compressed_digest)
+        CompressionResult.objects.filter(id=fast.id).update(
+            codec='lzma-0', compressed_file_size=size, compressed_sha256=compressed_digest.hexdigest()
+        )
+        default_artifact = open(default.compressed_path, 'rb').read()
+
+        self.assertEqual(recompress.sweep()[0], 0)  # Not cold yet
+        with self.settings(COMPRESSION_RECOMPRESS_AFTER=0, COMPRESSION_VERIFY=True):
+            # A compression job arrived: nothing is swapped
+            self.assertEqual(recompress.sweep(should_stop=lambda: True), (0, 0, 0, True))
+            self.assertIsNone(CompressionResult.objects.get(id=fast.id).recompressed_at)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                tried, shrunk, saved, interrupted = recompress.sweep()
+            self.assertEqual((tried, shrunk, interrupted), (2, 1, False))
+            self.assertEqual(recompress.sweep()[0], 0)  # Each artifact is tried once
+
+        fast = CompressionResult.objects.get(id=fast.id)
+        self.assertIn(fast.codec, engine.RECOMPRESS_CODECS)
+        self.assertEqual(saved, size - fast.compressed_file_size)
+        self.assertEqual(fast.compressed_file_size, os.path.getsize(fast.compressed_path))
+        self.assertEqual(fast.verification, CompressionResult.VERIFICATION_OK)
+        with open(fast.compressed_path, 'rb') as f:
+            self.assertEqual(lzma.decompress(f.read()), test_content)
+        # Preset 9 extreme did no better than preset 6 on this one
+        default = CompressionResult.objects.get(id=default.id)
+        self.assertEqual(default.codec, f'lzma-{engine.LZMA_PRESET}')
+        self.assertIsNotNone(default.recompressed_at)
+        self.assertEqual(open(default.compressed_path, 'rb').read(), default_artifact)
+
+        # Claimed for download while it was being recompressed
+        CompressionResult.objects.filter(id=default.id).update(codec='lzma-0', recompressed_at=None)
+        claimed = []
+        with self.settings(COMPRESSION_RECOMPRESS_AFTER=0):
+            self.assertIsNone(recompress.recompress_result(
+                CompressionResult.objects.get(id=default.id),
+                should_stop=lambda: claimed.append(views._claim_download(default.id)) and False
+            ))
+        self.assertEqual(claimed[0], True)
+        self.assertEqual(open(default.compressed_path, 'rb').read(), default_artifact)
+        self.assertEqual(os.listdir(os.path.dirname(default.compressed_path)), [default.compressed_filename])
+
+    def test_verification_ignores_artifact_recompressed_meanwhile(self):
+        """Test that a check racing a recompression swap doesn't mark the new artifact corrupt"""
+        rng = random.Random(3)
+        words = [''.join(rng.choice('abcdefghij') for _ in range(rng.randint(2, 8))) for _ in range(500)]
+        test_content = ' '.join(rng.choice(words) for _ in range(10000)).encode()
+        self.client.post(
+            reverse('api_create_jobs'), {'files': [SimpleUploadedFile('words.txt', test_content)]}, **self.auth
+        )
+        result = CompressionResult.objects.get()
+        compressed_digest = engine.new_digest()
+        size = engine.compress_bytes(test_content, result.compressed_path, preset=0, compressed_digest=compressed_digest)
+        CompressionResult.objects.filter(id=result.id).update(
+            codec='lzma-0', compressed_file_size=size, compressed_sha256=compressed_digest.hexdigest(),
+            verification=CompressionResult.VERIFICATION_PENDING
+        )
+        result = CompressionResult.objects.get(id=result.id)
+        real_file_digest = verifier.file_digest
+
+        def file_digest(path):
+            # Recompression swaps the artifact after the verifier read the row
+            self.assertGreater(recompress.recompress_result(CompressionResult.objects.get(id=result.id)), 0)
+            return real_file_digest(path)
+
+        with mock.patch.object(verifier, 'file_digest', side_effect=file_digest):
+            self.assertIsNone(verifier.verify_result(result))
+        swapped = CompressionResult.objects.get(id=result.id)
+        self.assertNotEqual(swapped.compressed_sha256, result.compressed_sha256)
+        self.assertEqual(swapped.verification, CompressionResult.VERIFICATION_PENDING)
+
+        self.assertIs(verifier.verify_result(swapped), True)
+        self.assertEqual(CompressionResult.objects.get(id=result.id).verification, CompressionResult.VERIFICATION_OK)
+
+    def test_idle_checks_schedule_sweeps(self):
+        """Test that the periodic check schedules a sweep only while compression is idle"""
+        with mock.patch.object(recompress.time, 'sleep', side_effect=[None, None, RuntimeError]), \
+                mock.patch.object(jobs, 'is_idle', side_effect=[True, False]), \
+                mock.patch.object(recompress, 'schedule') as schedule:
+            with self.assertRaises(RuntimeError):
+                recompress._check_when_idle()
+        self.assertEqual(schedule.call_count, 1)
+
+    def test_resource_usage_recorded_and_summarised(self):
+        """Test that results store their resource usage and the admin totals it per user and codec"""
+        job = CompressionJob.objects.get(id=self._upload(1).json()['jobs'][0]['job_id'])
+        result = job.result
+        self.assertGreater(result.cpu_time, 0)
+        self.assertGreater(result.peak_memory, 0)
+        self.assertGreaterEqual(result.bytes_read, result.file.original_file_size)
+        self.assertGreaterEqual(result.bytes_written, result.compressed_file_size)
+
+        admin_user = User.objects.create_superuser('admin@example.com', 'admin@example.com', 'adminpass123')
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:compression_compressionresult_changelist'))
+        self.assertEqual(response.status_code, 200)
+        by_user, = response.context['usage_by_user']
+        self.assertEqual(by_user['group'], self.user.username)
+        self.assertEqual(by_user['results'], 1)
+        self.assertAlmostEqual(by_user['cpu_time'], result.cpu_time)
+        self.assertEqual(by_user['bytes_read'], result.bytes_read)
+        self.assertEqual(response.context['usage_by_codec'][0]['group'], result.codec)
+        self.assertContains(response, 'Resource usage by codec and preset')
+
+    def test_export_streams_history(self):
+        """Test that the CSV and JSON exports stream only the owner's results, in every deployment mode"""
+        self._upload(3)
+        other = User.objects.create_user(username='other@example.com', email='other@example.com', password='x')
+        other_file = File.objects.create(user=other, original_filename='theirs.csv', original_file_size=1, file_path='')
+        CompressionResult.objects.create(
+            file=other_file, compressed_filename='theirs.csv.xz', compressed_file_size=1, compression_ratio=0,
+            compression_time=0, download_link=''
+        )
+        expected = list(CompressionResult.objects.filter(file__user=self.user).order_by('pk').values_list('id', flat=True))
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('export_results'), {'format': 'csv'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([int(row['result_id']) for row in rows], expected)
+        self.assertEqual(rows[0]['user'], self.user.username)
+        self.assertEqual(self.client.get(reverse('export_results'), {'format': 'xml'}).status_code, 400)
+
+        response = self.client.get(reverse('api_export_results'), **self.auth)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([row['result_id'] for row in rows], expected)
+        self.assertEqual(rows[0]['original_file_size'], CompressionResult.objects.get(id=expected[0]).file.original_file_size)
+
+        empty = export.iter_json(CompressionResult.objects.none())
+        self.assertEqual(json.loads(''.join(empty)), [])
+
+    def test_admin_export_action(self):
+        """Test that the admin exports the selected results"""
+        self._upload(2)
+        selected = CompressionResult.objects.order_by('pk').first()
+        admin_user = User.objects.create_superuser('admin@example.com', 'admin@example.com', 'adminpass123')
+        self.client.force_login(admin_user)
+        response = self.client.post(
+            reverse('admin:compression_compressionresult_changelist'),
+            {'action': 'export_csv', '_selected_action': [selected.id]},
+        )
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], export.HEADER)
+        self.assertEqual([int(row[0]) for row in rows[1:]], [selected.id])
+
+    def test_analytics_summary(self):
+        """Test that staff get vectorized statistics over every user's results, cached until refreshed"""
+        cache.delete(analytics.CACHE_KEY)
+        self._upload(3)
+        url = reverse('api_analytics')
+        self.assertEqual(self.client.get(url, **self.auth).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        summary = self.client.get(url, **self.auth).json()
+        self.assertEqual(summary['results'], 3)
+        self.assertEqual(sum(row['results'] for row in summary['by_size']), 3)
+        self.assertEqual(sum(summary['by_size'][0]['saved_histogram']), 3)  # All under 64 KiB
+        self.assertEqual(summary['by_codec'][0]['key'], f'lzma-{engine.LZMA_PRESET}')
+        self.assertEqual(summary['by_file_type'][0]['key'], 'csv')
+        self.assertEqual(summary['trend'][0]['results'], 3)
+
+        self._upload(1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(analytics.summary()['results'], 3)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(self.client.get(url, {'refresh': '1'}, **self.auth).json()['results'], 4)
+
+        self.client.force_login(User.objects.create_superuser('admin@example.com', 'admin@example.com', 'x'))
+        response = self.client.get(reverse('admin:compression_analytics'))
+        self.assertContains(response, 'Throughput by codec and preset')
+
+        values = np.random.default_rng(0).random(200)
+        groups = np.arange(200) % 3
+        expected = [np.percentile(values[groups == group], analytics.PERCENTILES) for group in range(3)]
+        percentiles = analytics.group_percentiles(values, groups, 4)
+        np.testing.assert_allclose(percentiles[:3], expected)
+        self.assertTrue(np.isnan(percentiles[3]).all())
+
+    def test_server_side_paths_disabled_by_default(self):
+        """Test that path batches are refused when no allowed root is configured"""
+        response = self.client.post(
+            reverse('api_create_jobs'), {'paths': ['a.txt']}, content_type='application/json', **self.auth
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class CompressTreeCommandTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser@example.com',
+            email='testuser@example.com',
+            password='testpass123'
+        )
+        self.test_media_dir = tempfile.mkdtemp()
+        settings.MEDIA_ROOT = self.test_media_dir
+
+        self.tree = tempfile.mkdtemp()
+        for relative_path in ('a.csv', 'run1/b.csv', 'run2/b.csv', 'run2/notes.txt'):
+            path = os.path.join(self.tree, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(f'{relative_path},1,2,3\n'.encode() * 300)
+
+    def tearDown(self):
+        for path in (self.test_media_dir, self.tree):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def _run(self, *args):
+        out = StringIO()
+        call_command('compress_tree', self.tree, '--user', 'testuser@example.com', *args, stdout=out)
+        return out.getvalue()
+
+    def test_compresses_tree_and_registers_results(self):
+        """Test that every file is compressed, registered and left in place"""
+        output = self._run('--workers', '2')
+
+        self.assertEqual(CompressionResult.objects.filter(file__user=self.user).count(), 4)
+        self.assertIn('Compressed 4 files (0 failed)', output)
+        self.assertIn('% reduction', output)
+
+        result = CompressionResult.objects.get(file__original_filename=os.path.join('run2', 'b.csv'))
+        self.assertEqual(result.compressed_filename, 'run2__b.csv.xz')
+        with open(result.compressed_path, 'rb') as f:
+            self.assertTrue(lzma.decompress(f.read()).startswith(b'run2/b.csv,1,2,3'))
+        self.assertEqual(result.file.source_path, os.path.join(os.path.realpath(self.tree), 'run2', 'b.csv'))
+        self.assertTrue(result.file.file_path.startswith(os.path.join(self.test_media_dir, 'uploads')))
+        # The source is left in place, only its link in the upload area is removed
+        self.assertTrue(os.path.exists(result.file.source_path))
+        self.assertFalse(os.path.exists(result.file.file_path))
+
+    def test_rerun_skips_registered_files(self):
+        """Test that a second run resumes instead of compressing everything again"""
+        self._run('--workers', '1', '--pattern', '*.csv')
+        self.assertEqual(CompressionResult.objects.count(), 3)
+
+        output = self._run('--workers', '1')
+        self.assertIn('4 files found, 3 already compressed, 1 to go', output)
+        self.assertEqual(CompressionResult.objects.count(), 4)
+
+    def test_interrupted_run_leaves_no_orphans(self):
+        """Test that files compressed but not registered when a run stops leave no artifacts or links behind"""
+        from compression.management.commands.compress_tree import Command
+
+        with mock.patch.object(Command, '_register', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self._run('--workers', '2', '--batch-size', '1')
+
+        self.assertFalse(CompressionResult.objects.exists())
+        left = [os.path.join(root, name) for root, _, names in os.walk(self.test_media_dir) for name in names]
+        self.assertEqual(left, [])
+
+    def test_unknown_user(self):
+        """Test that the command refuses an unknown owner"""
+        with self.assertRaises(CommandError):
+            call_command('compress_tree', self.tree, '--user', 'nobody@example.com', stdout=StringIO())
+
+    def test_user_matched_on_normalized_email(self):
+        """Test that the owner's email is matched normalized, and an address shared by several users is refused"""
+        call_command('compress_tree', self.tree, '--user', ' TestUser@Example.com ', '--workers', '1', stdout=StringIO())
+        self.assertEqual(CompressionResult.objects.filter(file__user=self.user).count(), 4)
+
+        User.objects.create_user(username='second', email='testuser@example.com', password='x')
+        with self.assertRaisesMessage(CommandError, 'Several users'):
+            call_command('compress_tree', self.tree, '--user', 'testuser@example.com', stdout=StringIO())
@@ -0,0 +1,34 @@
+"""
+Upload handling that keeps large uploads out of memory.
+
+Uploads up to FILE_UPLOAD_MAX_MEMORY_SIZE stay in memory. Larger ones are
+spooled as they arrive to a temporary file inside the upload area
+(storage.upload_temp_dir()), on the same filesystem as their final path,
+so views can rename them into place (_store_upload) instead of copying
+them a second time.
+"""
+import os
+import tempfile
+
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+from . import storage
+
+
+class SpooledUpload(TemporaryUploadedFile):
+    """A TemporaryUploadedFile in the upload area instead of FILE_UPLOAD_TEMP_DIR"""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        directory = storage.upload_temp_dir()
+        os.makedirs(directory, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(suffix='.upload', dir=directory)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+
+class SpoolingUploadHandler(TemporaryFileUploadHandler):
+    """Streams uploads over the in-memory limit into a SpooledUpload"""
+
+    def new_file(self, *args, **kwargs):
+        super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        self.file = SpooledUpload(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
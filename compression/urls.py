@@ -1,11 +1,21 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('results/', views.all_results, name='all_results'),
+    path('results/export/', views.export_results, name='export_results'),
     path('results/<int:result_id>/', views.compression_results, name='compression_results'),
     path('download/<int:file_id>/', views.download_compressed_file, name='download_compressed_file'),
-    path('progress/<int:file_id>/', views.compression_progress, name='compression_progress'),
+    path('progress/<int:job_id>/', views.compression_progress, name='compression_progress'),
+    path('events/<int:job_id>/', views.compression_events, name='compression_events'),
+
+    # Token-authenticated JSON API for pipelines
+    path('api/v1/jobs/', api.create_jobs, name='api_create_jobs'),
+    path('api/v1/jobs/status/', api.job_status, name='api_job_status'),
+    path('api/v1/jobs/results/', api.job_results, name='api_job_results'),
+    path('api/v1/analytics/', api.analytics_summary, name='api_analytics'),
+    path('api/v1/results/export/', api.export_results, name='api_export_results'),
+    path('api/v1/results/<int:result_id>/download/', api.download_result, name='api_download_result'),
 ]
@@ -0,0 +1,183 @@
+"""
+Round-trip verification of compression artifacts.
+
+The digests are computed while a job runs: each original's SHA-256 as it is
+read for compression and the artifact's as it is written. Verifying a result
+re-reads only the artifact: its digest must still match, and decompressing
+it must give back the digests of the originals (for a delta or a chunk
+manifest, rebuilding the file it stands for must). Results that fail are
+flagged corrupt and can no longer be downloaded.
+
+With COMPRESSION_VERIFY set, completed jobs are verified in the background
+on a single thread that waits until no compression job is queued or
+running, so verification only uses otherwise idle cores.
+"""
+import bz2
+import gzip
+import logging
+import lzma
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import dedup, engine, jobs, preconditioners, versions
+from .database import worker_connections
+from .executors import get_executor
+from .models import CompressionResult
+
+logger = logging.getLogger(__name__)
+
+IDLE_POLL_SECONDS = 1.0  # How often a waiting verification checks whether compression is idle
+_OPENERS = {'.xz': lzma.open, '.bz2': bz2.open, '.gz': gzip.open}
+
+
+def _stream_digest(stream):
+    digest = engine.new_digest()
+    while True:
+        block = stream.read(engine.COMPRESS_BLOCK_SIZE)
+        if not block:
+            return digest.hexdigest()
+        digest.update(block)
+
+
+def file_digest(path):
+    """SHA-256 of the file at path"""
+    with open(path, 'rb') as f:
+        return _stream_digest(f)
+
+
+def decompressed_digests(path, codec=f'lzma-{engine.LZMA_PRESET}', archive_mode='', preconditioned=False):
+    """
+    Decompress the artifact at path and return the sorted SHA-256 digests of
+    the originals in it: one for a single file, one per archive member.
+    """
+    if archive_mode == engine.ARCHIVE_PARALLEL:
+        with tarfile.open(path) as tar:
+            digests = []
+            for member in tar:
+                with lzma.open(tar.extractfile(member)) as stream:
+                    digests.append(_stream_digest(stream))
+            return sorted(digests)
+
+    if archive_mode:
+        # Zip readers seek, so the solid stream is decompressed to a scratch file first
+        with lzma.open(path) as stream, tempfile.TemporaryFile() as scratch:
+            shutil.copyfileobj(stream, scratch, engine.COMPRESS_BLOCK_SIZE)
+            with zipfile.ZipFile(scratch) as zipf:
+                digests = []
+                for info in zipf.infolist():
+                    with zipf.open(info) as member:
+                        digests.append(_stream_digest(member))
+                return sorted(digests)
+
+    with _OPENERS[engine.CODECS[codec].extension](path, 'rb') as stream:
+        if not preconditioned:
+            return [_stream_digest(stream)]
+        container = stream.read()
+    digest = engine.new_digest()
+    for block in preconditioners.iter_unpack(container):
+        digest.update(block)
+    return [digest.hexdigest()]
+
+
+def check_artifact(path, compressed_sha256, original_sha256s, codec=f'lzma-{engine.LZMA_PRESET}',
+                   archive_mode='', preconditioned=False):
+    """Whether the artifact at path is intact and decompresses to originals with these digests"""
+    if file_digest(path) != compressed_sha256:
+        return False
+    try:
+        return decompressed_digests(path, codec, archive_mode, preconditioned) == sorted(original_sha256s)
+    except (lzma.LZMAError, OSError, EOFError, ValueError, tarfile.TarError, zipfile.BadZipFile):
+        return False
+
+
+def check_version(result):
+    """Whether a delta result's artifact is intact and its version rebuilds to the original"""
+    if file_digest(result.artifact_path) != result.compressed_sha256:
+        return False
+    digest = engine.new_digest()
+    try:
+        for chunk in versions.iter_content(result):
+            digest.update(chunk)
+    except (lzma.LZMAError, OSError, EOFError, ValueError):
+        return False
+    return digest.hexdigest() == result.file.sha256
+
+
+def check_deduplicated(result):
+    """Whether a deduplicated result's artifact is intact and its manifest rebuilds to the original"""
+    if file_digest(result.artifact_path) != result.compressed_sha256:
+        return False
+    digest = engine.new_digest()
+    try:
+        for chunk in dedup.iter_content(result):
+            digest.update(chunk)
+    except (lzma.LZMAError, OSError, EOFError, ValueError):
+        return False
+    return digest.hexdigest() == result.file.sha256
+
+
+def verify_result(result):
+    """
+    Check a CompressionResult's artifact and record the outcome on it.
+    Return True or False, or None when there is nothing to check (the
+    artifact is gone or the result predates digests) or recompression
+    replaced the artifact during the check.
+    """
+    path = result.artifact_path
+    if result.downloaded or not result.compressed_sha256 or not os.path.exists(path):
+        return None
+
+    if result.archive_mode:
+        members = list(result.job.files.all())
+    else:
+        members = [result.file]
+    if not all(member.sha256 for member in members):
+        return None
+
+    if result.is_delta:
+        intact = check_version(result)
+    elif result.is_deduplicated:
+        intact = check_deduplicated(result)
+    else:
+        intact = check_artifact(
+            path, result.compressed_sha256, [member.sha256 for member in members], result.codec,
+            result.archive_mode, bool(result.preconditioner)
+        )
+    verification = CompressionResult.VERIFICATION_OK if intact else CompressionResult.VERIFICATION_CORRUPT
+    verified_at = timezone.now()
+    # Recorded only against the artifact that was read: if recompression swapped it meanwhile,
+    # the check may have seen the new file against the old digest, and the swap schedules its own
+    if not CompressionResult.objects.filter(pk=result.pk, compressed_sha256=result.compressed_sha256).update(
+        verification=verification, verified_at=verified_at
+    ):
+        return None
+    if not intact:
+        logger.error("Compression result %s failed verification", result.id)
+    result.verification = verification
+    result.verified_at = verified_at
+    return intact
+
+
+def _verify_when_idle(result_id):
+    while not jobs.is_idle():
+        time.sleep(IDLE_POLL_SECONDS)
+    with worker_connections():
+        try:
+            verify_result(CompressionResult.objects.select_related('file').get(pk=result_id))
+        except Exception:
+            logger.exception("Compression result %s could not be verified", result_id)
+
+
+def schedule(result_id):
+    """Verify a result once compression is idle, or now when COMPRESSION_JOBS_EAGER is set"""
+    if settings.COMPRESSION_JOBS_EAGER:
+        verify_result(CompressionResult.objects.select_related('file').get(pk=result_id))
+    else:
+        get_executor('verify').submit(_verify_when_idle, result_id)
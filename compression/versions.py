@@ -0,0 +1,218 @@
+"""
+Successive versions of a dataset, stored as deltas.
+
+An upload can be marked as a new version of one of the user's earlier files
+(File.previous_version). If that version's artifact is still on the server,
+the new one is stored as a delta against its content (compression.delta).
+Only the changed bytes are compressed, so a version that differs by a few
+percent takes a fraction of the time and space of a full compression.
+
+Each delta result points at the result it was made against (delta_base),
+and a chain of them ends at a complete artifact. Downloading a version
+rebuilds it along the chain and streams it as .xz, compressed on the fly at
+the preset it was stored with. The versions before it are decompressed and
+rebuilt into temporary files, so memory use doesn't grow with the file.
+A downloaded version's artifact is kept for as long as a later version
+still needs it to be rebuilt, and so is one holding chunks that a later
+upload references (compression.dedup).
+"""
+import lzma
+import os
+import shutil
+import tempfile
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import delta, engine, storage
+from .models import Chunk, CompressionResult
+
+MAX_CHAIN = 8  # Deltas applied to rebuild a version, the next one is stored complete
+# Diffing holds both versions in memory, with NumPy hash arrays over each: about 12x a version's size at
+# peak (a 32 MiB pair peaked at about 410 MiB), in the web process. Larger versions are stored complete.
+MAX_SIZE = 32 * engine.MIB
+
+
+class BaseGone(Exception):
+    """The version a delta was made against was deleted before the delta was recorded"""
+
+
+def delta_chain(result):
+    """The results from the complete artifact up to result, each a delta against the one before"""
+    chain = [result]
+    while chain[0].delta_base_id:
+        chain.insert(0, CompressionResult.objects.select_related('file').get(pk=chain[0].delta_base_id))
+    return chain
+
+
+def _is_plain_lzma(result):
+    """Whether a result's artifact is one file's content as .xz"""
+    codec = engine.CODECS.get(result.codec)
+    return (
+        not result.archive_mode and not result.preconditioner and not result.is_deduplicated
+        and codec is not None and codec.extension == '.xz'
+    )
+
+
+def delta_base_for(file_record):
+    """
+    The result a new version of file_record.previous_version can be stored as
+    a delta against, or None to store it complete.
+    """
+    previous = file_record.previous_version
+    if previous is None or previous.original_file_size > MAX_SIZE or file_record.original_file_size > MAX_SIZE:
+        return None
+    try:
+        base = CompressionResult.objects.select_related('file').get(file=previous)
+    except CompressionResult.DoesNotExist:
+        return None
+    if base.is_corrupt:
+        return None
+
+    chain = delta_chain(base)
+    if len(chain) > MAX_CHAIN or not _is_plain_lzma(chain[0]):
+        return None
+    if not all(os.path.exists(result.artifact_path) for result in chain):
+        return None
+    return base
+
+
+def artifacts_exist(result):
+    """
+    Whether the artifacts needed to download result are on the server: its
+    own, those of its delta chain and those holding the chunks it references.
+    """
+    needed = delta_chain(result) + list(result.chunk_sources.select_related('file'))
+    return all(os.path.exists(version.artifact_path) for version in needed)
+
+
+def spool(artifact_path, directory):
+    """Decompress the .xz artifact at artifact_path into a new file in directory, return its path"""
+    fd, path = tempfile.mkstemp(dir=directory)
+    with lzma.open(artifact_path) as source, open(fd, 'wb') as output:
+        shutil.copyfileobj(source, output, engine.COMPRESS_BLOCK_SIZE)
+    return path
+
+
+def rebuild_directory():
+    """A temporary directory to rebuild a download in, removed when the context exits"""
+    os.makedirs(storage.rebuild_temp_dir(), exist_ok=True)
+    return tempfile.TemporaryDirectory(dir=storage.rebuild_temp_dir())
+
+
+def iter_content(result):
+    """Yield the original content of a result, following its delta chain, in pieces"""
+    chain = delta_chain(result)
+    if len(chain) == 1:
+        with lzma.open(result.artifact_path) as stream:
+            while True:
+                piece = stream.read(engine.COMPRESS_BLOCK_SIZE)
+                if not piece:
+                    return
+                yield piece
+    with rebuild_directory() as directory:
+        base_path = spool(chain[0].artifact_path, directory)
+        for version in chain[1:-1]:
+            fd, path = tempfile.mkstemp(dir=directory)
+            with open(base_path, 'rb') as base, lzma.open(version.artifact_path) as stream, open(fd, 'wb') as output:
+                for piece in delta.iter_apply(base, stream):
+                    output.write(piece)
+            os.remove(base_path)
+            base_path = path
+        with open(base_path, 'rb') as base, lzma.open(chain[-1].artifact_path) as stream:
+            yield from delta.iter_apply(base, stream)
+
+
+def rebuild(result):
+    """The original content of a result, following its delta chain"""
+    return b''.join(iter_content(result))
+
+
+def download_compressor(result):
+    """
+    An encoder for a rebuilt result's download: LZMA at the preset its
+    artifact was compressed with (engine.LZMA_PRESET after recompression)
+    """
+    if result.codec in (f'lzma-{preset}' for preset in range(10)):
+        return engine.CODECS[result.codec].compressor()
+    return engine.CODECS[f'lzma-{engine.LZMA_PRESET}'].compressor()
+
+
+def iter_compressed(result, content):
+    """Yield content, the pieces result was rebuilt in, compressed as .xz for download"""
+    compressor = download_compressor(result)
+    for piece in content:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_rebuilt(result):
+    """Yield a version rebuilt and compressed as .xz, in pieces, for download"""
+    return iter_compressed(result, iter_content(result))
+
+
+def lock_base(base):
+    """
+    In a transaction recording a delta against base: lock base's row so its
+    artifact can't be released meanwhile, and raise BaseGone if it already was.
+    """
+    CompressionResult.objects.select_for_update().only('pk').get(pk=base.pk)
+    if not os.path.exists(base.artifact_path):
+        raise BaseGone("The previous version was deleted while this one was compressed, upload it again")
+
+
+def _needed(result):
+    """
+    Whether a later result, not downloaded itself or needed in turn, is
+    stored as a delta against result or references chunks it holds. The
+    links between the user's results are read in one query and walked here.
+    """
+    dependents, downloaded = {}, {}
+    rows = CompressionResult.objects.filter(
+        Q(delta_base__isnull=False) | Q(chunk_sources__isnull=False), file__user_id=result.file.user_id
+    ).values_list('pk', 'downloaded', 'delta_base_id', 'chunk_sources')
+    for pk, is_downloaded, base_id, source_id in rows:
+        downloaded[pk] = is_downloaded
+        for needed_id in (base_id, source_id):
+            if needed_id is not None:
+                dependents.setdefault(needed_id, set()).add(pk)
+
+    pending, seen = [result.pk], {result.pk}
+    while pending:
+        for pk in dependents.get(pending.pop(), ()):
+            if not downloaded[pk]:
+                return True
+            if pk not in seen:
+                seen.add(pk)
+                pending.append(pk)
+    return False
+
+
+def release_artifact(result_id):
+    """
+    Delete the artifact of a downloaded result unless a later one still
+    needs it (_needed()), then do the same for the results it needed, whose
+    last dependent it may have been. Its chunks leave the chunk store either
+    way, so no new upload references them.
+    """
+    pending = [result_id]
+    while pending:
+        with transaction.atomic():
+            try:
+                result = CompressionResult.objects.select_for_update().select_related('file').get(pk=pending.pop())
+            except CompressionResult.DoesNotExist:
+                continue
+            if not result.downloaded:
+                continue
+            # Even if its artifact is kept, no new upload may reference it and prolong that
+            Chunk.objects.filter(result=result).delete()
+            if _needed(result):
+                continue
+            path = result.artifact_path
+            if os.path.exists(path):
+                storage.remove_artifact(path)
+        if result.delta_base_id:
+            pending.append(result.delta_base_id)
+        pending.extend(result.chunk_sources.values_list('pk', flat=True))
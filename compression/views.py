@@ -1,210 +1,425 @@
+import asyncio
+import json
 import lzma
 import os
-import tempfile
-import time
-import zipfile
+from contextlib import contextmanager
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.http import JsonResponse, HttpResponse, Http404
+from django.db import transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, Http404, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.utils import timezone
 
-from .models import File, CompressionResult
+from . import accounting, dedup, engine, events, export, jobs, preconditioners, predictor, storage, versions
+from .database import refresh_connections
+from .executors import aiter_in_executor, run_compression, run_io
+from .models import CodecTrial, CompressionJob, File, CompressionResult
+
+# How long an event stream waits for an in-process event before re-reading the job row
+SSE_REFRESH_SECONDS = 15
+# Total size limit for the files of one upload request
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # 50MB in bytes
+
+# Told to a user downloading a file again, depending on whether its artifact was deleted or is still needed
+DELETED_MESSAGE = 'The files have been deleted from our servers for your security and privacy.'
+KEPT_MESSAGE = (
+    'Its stored data is kept only while a later upload of yours, stored against it, still needs it, '
+    'and is deleted once that has been downloaded too.'
+)
 
 
 @login_required
-def dashboard(request):
+async def dashboard(request):
     if request.method == 'POST':
-        return handle_file_upload(request)
-    return render(request, "compression/dashboard.html")
+        return await handle_file_upload(request)
+    return await sync_to_async(_render_dashboard)(request)
+
+
+def _render_dashboard(request):
+    return render(request, "compression/dashboard.html", {'versionable_files': _versionable_files(request.user)})
+
+
+def _versionable_files(user, limit=50):
+    """The user's latest single-file uploads, which a new upload may be marked as a version of"""
+    return File.objects.filter(
+        user=user, compressionresult__isnull=False, compressionresult__archive_mode=''
+    ).order_by('-upload_timestamp')[:limit]
+
+
+def _store_upload(uploaded_file, user_id):
+    """
+    Move an uploaded file to a new, unique upload path and return it. Spooled
+    uploads are renamed into place, small in-memory ones written out.
+    """
+    file_path = storage.upload_path(user_id, uploaded_file.name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        try:
+            os.rename(uploaded_file.temporary_file_path(), file_path)
+            return file_path
+        except OSError:
+            pass  # Spooled on another filesystem, e.g. by the stock handler, so copy it
+    with open(file_path, 'wb') as destination:
+        for chunk in uploaded_file.chunks():
+            destination.write(chunk)
+    return file_path
+
+
+def _link_source(source_path, user_id):
+    """Hard link a server-side file to a new upload path (copy across filesystems), return the new path"""
+    file_path = storage.upload_path(user_id, source_path)
+    storage.link_file(source_path, file_path)
+    return file_path
+
+
+def _upload_size_error(total_size):
+    """Return the error message if total_size is over the upload limit"""
+    if total_size > MAX_UPLOAD_SIZE:
+        return f'Total file size ({total_size / (1024*1024):.2f} MB) exceeds maximum limit of 50MB'
+    return None
+
+
+# Job options a client may set: field -> (default, accepted values)
+JOB_OPTIONS = {
+    'archive_mode': (
+        engine.ARCHIVE_AUTO, (engine.ARCHIVE_AUTO, engine.ARCHIVE_SOLID, engine.ARCHIVE_PARALLEL)
+    ),
+    'preconditioner': (preconditioners.NONE, preconditioners.CHOICES),
+    'compare': ('', ('', engine.KEEP_BEST, *engine.COMPARE_CODECS)),
+}
+
+
+def _job_options(params):
+    """Return the CompressionJob options requested in params (POST data or a JSON body), or raise ValueError"""
+    options = {}
+    for name, (default, accepted) in JOB_OPTIONS.items():
+        value = params.get(name) or default
+        if value not in accepted:
+            raise ValueError(f"Unknown {name.replace('_', ' ')} '{value}'")
+        options[name] = value
+    return options
+
+
+def _previous_version(params, user, single_file):
+    """
+    Return the user's File that the upload in params (POST data or a JSON body)
+    is marked as a new version of, or None; raise ValueError.
+    """
+    file_id = params.get('previous_version')
+    if not file_id:
+        return None
+    if not single_file:
+        raise ValueError("Only a single file can be uploaded as a new version")
+    try:
+        return File.objects.get(id=int(file_id), user=user)
+    except (ValueError, File.DoesNotExist):
+        raise ValueError(f"Unknown previous version '{file_id}'")
+
+
+async def _estimate_jobs(batches, archive_mode=engine.ARCHIVE_AUTO):
+    """
+    Predict the compressed size and duration of each job in batches before they are queued.
+    At most predictor.MAX_SAMPLED_FILES files of the whole request are sampled, on the
+    compression pool; the others are estimated from past throughput.
+    """
+    flat = await run_compression(predictor.sample_files, [file_path for batch in batches for _, _, file_path in batch])
+    samples, start = [], 0
+    for batch in batches:
+        samples.append(flat[start:start + len(batch)])
+        start += len(batch)
+
+    # Past throughput is looked up once per file type across all the jobs, at the type's average size
+    sizes_by_type = {}
+    for batch in batches:
+        for original_filename, size, _ in batch:
+            sizes_by_type.setdefault(os.path.splitext(original_filename)[1].lower(), []).append(size)
+    history = {
+        extension: await sync_to_async(predictor.historical_throughput)(
+            CompressionResult.objects.all(), extension, sum(sizes) // len(sizes)
+        )
+        for extension, sizes in sizes_by_type.items()
+    }
+
+    return [
+        predictor.combine_job([
+            predictor.combine(stats, history[os.path.splitext(original_filename)[1].lower()])
+            for (original_filename, _, _), stats in zip(batch, batch_samples)
+        ], archive_mode, settings.COMPRESSION_WORKERS)
+        for batch, batch_samples in zip(batches, samples)
+    ]
+
+
+def _create_jobs(user, batches, estimates, options, previous_version=None):
+    """
+    Create a job per batch and the File rows of every batch in one transaction.
+    If it fails, the stored uploads are deleted as well, so nothing is left behind.
+    """
+    try:
+        with transaction.atomic():
+            created = CompressionJob.objects.bulk_create_with_ids([
+                CompressionJob(
+                    user=user, estimated_size=estimate.compressed_size, estimated_seconds=estimate.seconds,
+                    **options
+                )
+                for estimate in estimates
+            ])
+            File.objects.bulk_create([
+                File(
+                    user=user,
+                    original_filename=original_filename,
+                    original_file_size=size,
+                    file_path=file_path,
+                    job=job,
+                    previous_version=previous_version
+                )
+                for job, batch in zip(created, batches)
+                for original_filename, size, file_path in batch
+            ])
+    except Exception:
+        _remove_uploads([File(file_path=file_path) for batch in batches for _, _, file_path in batch])
+        raise
+    return created
+
+
+async def _start_jobs(user, batches, previous_version=None, **options):
+    """
+    Create a job for each of batches, lists of (original_filename, size, file_path),
+    with options from _job_options(), estimate them and queue them. Return the jobs.
+    A single file may be marked as a new version of an earlier one (_previous_version()).
+    """
+    archive_mode = options.get('archive_mode', engine.ARCHIVE_AUTO)
+    estimates = await _estimate_jobs(batches, archive_mode)
+    created = await sync_to_async(_create_jobs)(user, batches, estimates, options, previous_version)
+
+    # Queued only once their rows are committed, a worker may pick them up straight away
+    for job, estimate in zip(created, estimates):
+        await jobs.asubmit(job.id, estimate.seconds)
+    # Re-read for the state the workers (or eager runs) have left them in
+    current = {job.id: job async for job in CompressionJob.objects.filter(id__in=[job.id for job in created])}
+    return [current[job.id] for job in created]
+
+
+def _remove_uploads(file_records):
+    """Delete the original uploaded files to save space"""
+    for file_record in file_records:
+        if os.path.exists(file_record.file_path):
+            os.remove(file_record.file_path)
 
 
 @login_required
-def handle_file_upload(request):
+async def handle_file_upload(request):
     """Handle file upload and initiate compression"""
-    if 'files' not in request.FILES:
+    user = await request.auser()
+    # Parsing the multipart body reads (and may spool) the upload, keep it off the loop
+    files = await run_io(lambda: request.FILES.getlist('files'))
+    if not files:
         return JsonResponse({'error': 'No files uploaded'}, status=400)
 
-    files = request.FILES.getlist('files')
     total_size = sum(file.size for file in files)
 
     # Check total file size limit (50MB)
-    max_size = 50 * 1024 * 1024  # 50MB in bytes
-    if total_size > max_size:
-        return JsonResponse({
-            'error': f'Total file size ({total_size / (1024*1024):.2f} MB) exceeds maximum limit of 50MB'
-        }, status=400)
+    size_error = _upload_size_error(total_size)
+    if size_error:
+        return JsonResponse({'error': size_error}, status=400)
 
     try:
-        # Create uploads directory if it doesn't exist
-        upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads', str(request.user.id))
-        os.makedirs(upload_dir, exist_ok=True)
+        options = _job_options(request.POST)
+        previous_version = await sync_to_async(_previous_version)(request.POST, user, len(files) == 1)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
-        # Save uploaded files and create File records
-        uploaded_files = []
+    try:
+        # Save uploaded files and create File records for a new job
+        stored_files = []
         for uploaded_file in files:
-            # Create unique filename to avoid conflicts
-            timestamp = str(int(time.time()))
-            filename = f"{timestamp}_{uploaded_file.name}"
-            file_path = os.path.join(upload_dir, filename)
-
-            # Save file to disk
-            with open(file_path, 'wb+') as destination:
-                for chunk in uploaded_file.chunks():
-                    destination.write(chunk)
-
-            # Create File record
-            file_record = File.objects.create(
-                user=request.user,
-                original_filename=uploaded_file.name,
-                original_file_size=uploaded_file.size,
-                file_path=file_path
-            )
-            uploaded_files.append(file_record)
+            file_path = await run_io(_store_upload, uploaded_file, user.id)
+            stored_files.append((uploaded_file.name, uploaded_file.size, file_path))
 
-        # Start compression process
-        if len(uploaded_files) == 1:
-            # Single file compression
-            file_record = uploaded_files[0]
-            compression_result = compress_single_file(file_record)
-        else:
-            # Multiple files - create zip first, then compress
-            compression_result = compress_multiple_files(uploaded_files)
+        # Start compression process in the background, the browser follows it via events_url
+        job, = await _start_jobs(user, [stored_files], previous_version=previous_version, **options)
 
         return JsonResponse({
             'success': True,
-            'redirect_url': reverse('compression_results', kwargs={'result_id': compression_result.id})
+            'progress_url': reverse('compression_progress', kwargs={'job_id': job.id}),
+            'events_url': reverse('compression_events', kwargs={'job_id': job.id}),
+            **job.to_event(),
         })
 
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 
-def compress_single_file(file_record):
-    """Compress a single file using LZMA"""
-    start_time = time.time()
-
-    # Read the original file
-    with open(file_record.file_path, 'rb') as input_file:
-        data = input_file.read()
-
-    # Compress using LZMA
-    compressed_data = lzma.compress(data, preset=6)  # Preset 6 is default for good compression
-
-    # Create compressed filename that preserves original extension information
-    # Format: originalname.original_ext.xz (so when decompressed, it becomes originalname.original_ext)
-    original_name, original_ext = os.path.splitext(file_record.original_filename)
-    if original_ext:
-        # If there's an extension, include it in the compressed filename
-        compressed_filename = f"{original_name}{original_ext}.xz"
-    else:
-        # If no extension, just add .xz
-        compressed_filename = f"{file_record.original_filename}.xz"
-
-    # Save compressed file
-    compressed_dir = os.path.join(settings.MEDIA_ROOT, 'compressed', str(file_record.user.id))
-    os.makedirs(compressed_dir, exist_ok=True)
-
-    compressed_path = os.path.join(compressed_dir, compressed_filename)
-    with open(compressed_path, 'wb') as output_file:
-        output_file.write(compressed_data)
-
-    end_time = time.time()
-    compression_time = end_time - start_time
-
-    # Create CompressionResult record
+def _record_single_result(file_record, outcome, usage=accounting.Usage(), delta_base=None, plan=None):
+    """Create the CompressionResult for a compressed single file, chunked as planned if it was (dedup.plan_for())"""
     download_url = f"/compression/download/{file_record.id}/"
+    file_record.sha256 = outcome.digest
+    file_record.save(update_fields=['sha256'])
 
-    compression_result = CompressionResult.objects.create(
+    return CompressionResult.objects.create(
         file=file_record,
-        compressed_filename=compressed_filename,
-        compressed_file_size=len(compressed_data),
-        compression_ratio=(1 - (len(compressed_data) / file_record.original_file_size)) * 100,
-        compression_time=compression_time,
-        download_link=download_url
+        compressed_filename=outcome.compressed_filename,
+        compressed_path=outcome.compressed_path,
+        compressed_file_size=outcome.compressed_file_size,
+        compression_ratio=(1 - (outcome.compressed_file_size / file_record.original_file_size)) * 100,
+        compression_time=outcome.compression_time + (plan.seconds if plan else 0.0),
+        download_link=download_url,
+        preconditioner=outcome.preconditioner,
+        codec=outcome.codec,
+        compressed_sha256=outcome.compressed_digest,
+        delta_base=delta_base,
+        deduplicated_size=plan.deduplicated_size if plan else 0,
+        dedup_time_saved=dedup.time_saved(plan, outcome) if plan else 0.0,
+        **usage._asdict()
     )
 
-    # Delete the original uploaded file to save space
-    if os.path.exists(file_record.file_path):
-        os.remove(file_record.file_path)
-
-    return compression_result
-
-
-def compress_multiple_files(file_records):
-    """Compress multiple files by creating a zip first, then compressing with LZMA"""
-    start_time = time.time()
 
-    # Create a temporary zip file
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_zip:
-        with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            total_size = 0
-            for file_record in file_records:
-                zipf.write(file_record.file_path, file_record.original_filename)
-                total_size += file_record.original_file_size
-
-        # Read the zip file and compress with LZMA
-        with open(temp_zip.name, 'rb') as zip_file:
-            zip_data = zip_file.read()
-
-        compressed_data = lzma.compress(zip_data, preset=6)
-
-        # Clean up temp zip file
-        os.unlink(temp_zip.name)
-
-    # Create a combined filename
-    if len(file_records) <= 3:
-        filenames = [os.path.splitext(f.original_filename)[0] for f in file_records]
-        base_name = '_'.join(filenames)
-        compressed_filename = f"{base_name}.xz"
-    else:
-        compressed_filename = f"{len(file_records)}_files_archive.xz"
-
-    # Ensure filename isn't too long
-    if len(compressed_filename) > 200:
-        compressed_filename = f"{len(file_records)}_files_archive.xz"
-
-    # Save compressed file
-    user_id = file_records[0].user.id
-    compressed_dir = os.path.join(settings.MEDIA_ROOT, 'compressed', str(user_id))
-    os.makedirs(compressed_dir, exist_ok=True)
-
-    compressed_path = os.path.join(compressed_dir, compressed_filename)
-    with open(compressed_path, 'wb') as output_file:
-        output_file.write(compressed_data)
-
-    end_time = time.time()
-    compression_time = end_time - start_time
+def _record_multiple_result(file_records, outcome, usage=accounting.Usage()):
+    """Create the master File and CompressionResult for a compressed archive"""
+    total_size = sum(file_record.original_file_size for file_record in file_records)
+    for file_record, digest in zip(file_records, outcome.member_digests):
+        file_record.sha256 = digest
+    File.objects.bulk_update(file_records, ['sha256'])
 
     # Create a master File record for the combined files
     master_file = File.objects.create(
-        user=file_records[0].user,
+        user_id=file_records[0].user_id,
         original_filename=f"{len(file_records)} files combined",
         original_file_size=total_size,
-        file_path=compressed_path  # Store the compressed path as this is our main file
+        file_path=outcome.compressed_path  # Store the compressed path as this is our main file
     )
 
     # Create CompressionResult record
     download_url = f"/compression/download/{master_file.id}/"
 
-    compression_result = CompressionResult.objects.create(
+    return CompressionResult.objects.create(
         file=master_file,
-        compressed_filename=compressed_filename,
-        compressed_file_size=len(compressed_data),
-        compression_ratio=(1 - (len(compressed_data) / total_size)) * 100,
-        compression_time=compression_time,
-        download_link=download_url
+        compressed_filename=outcome.compressed_filename,
+        compressed_path=outcome.compressed_path,
+        compressed_file_size=outcome.compressed_file_size,
+        compression_ratio=(1 - (outcome.compressed_file_size / total_size)) * 100,
+        compression_time=outcome.compression_time,
+        download_link=download_url,
+        archive_mode=outcome.archive_mode,
+        compressed_sha256=outcome.compressed_digest,
+        **usage._asdict()
     )
 
-    # Delete all original uploaded files to save space
-    for file_record in file_records:
-        if os.path.exists(file_record.file_path):
-            os.remove(file_record.file_path)
 
+@contextmanager
+def _recording(outcome, file_records):
+    """
+    Transaction for the rows recording a finished compression. The uploads
+    are deleted once it commits; if it rolls back, the artifact is instead.
+    """
+    refresh_connections()  # The job may have compressed for longer than the connection lives
+    try:
+        with transaction.atomic():
+            yield
+            transaction.on_commit(lambda: _remove_uploads(file_records))
+    except Exception:
+        if os.path.exists(outcome.compressed_path):
+            storage.remove_artifact(outcome.compressed_path)
+        raise
+
+
+def compress_single_file(file_record, progress=None, preconditioner=preconditioners.NONE, compare=''):
+    """
+    Compress a single file using LZMA, optionally preconditioned first. With
+    compare set, run every codec in turn and keep that one's artifact.
+    A new version of an earlier upload is stored as a delta against it when
+    that one is still on the server (compression.versions). Otherwise, with
+    COMPRESSION_DEDUP set and enough of the file in the user's chunk store,
+    only the chunks that are not get compressed (compression.dedup).
+    """
+    compressed_dir = storage.artifact_dir(file_record.user_id)
+    base = None if compare else versions.delta_base_for(file_record)
+    plan = None
+    with accounting.measure() as meter:
+        base_content = None
+        if base is not None:
+            try:
+                base_content = versions.rebuild(base)
+            except (OSError, lzma.LZMAError, ValueError):
+                base = None  # Deleted or damaged since, store this version complete
+        if base is None and not compare and preconditioner == preconditioners.NONE and settings.COMPRESSION_DEDUP:
+            plan = dedup.plan_for(file_record)
+        if base is not None:
+            outcome = engine.compress_delta(
+                base_content, file_record.file_path, file_record.original_filename, compressed_dir, progress=progress
+            )
+            trials = []
+        elif compare:
+            outcome, trials = engine.compare_codecs(
+                file_record.file_path, file_record.original_filename, compressed_dir,
+                keep=compare, progress=progress
+            )
+        elif plan and plan.records:
+            outcome = engine.compress_deduplicated(
+                file_record.file_path, file_record.original_filename, compressed_dir, plan.records, progress=progress
+            )
+            trials = []
+        else:
+            outcome = engine.compress_single(
+                file_record.file_path, file_record.original_filename, compressed_dir,
+                progress=progress, preconditioner=preconditioner
+            )
+            trials = []
+    try:
+        return _record_single_file(file_record, outcome, meter.usage, base, plan, trials)
+    except dedup.SourceGone:
+        # Rare: an upload it referenced was downloaded and released meanwhile. Store it complete
+        # instead, which references nothing, so this can't happen again
+        with accounting.measure() as meter:
+            outcome = engine.compress_single(
+                file_record.file_path, file_record.original_filename, storage.artifact_dir(file_record.user_id),
+                progress=progress
+            )
+        return _record_single_file(file_record, outcome, meter.usage, None, dedup.complete(plan), [])
+
+
+def _record_single_file(file_record, outcome, usage, base, plan, trials):
+    """Record what compress_single_file() made, the artifact is deleted if that fails"""
+    with _recording(outcome, [file_record]):
+        if base is not None:
+            versions.lock_base(base)
+        if plan and plan.records:
+            dedup.lock_sources(plan)
+        compression_result = _record_single_result(file_record, outcome, usage, delta_base=base, plan=plan)
+        if plan:
+            dedup.store(compression_result, plan)
+        CodecTrial.objects.bulk_create([
+            CodecTrial(
+                result=compression_result,
+                codec=trial.codec,
+                compressed_file_size=trial.compressed_file_size,
+                compression_time=trial.compression_time,
+                memory=trial.memory,
+                kept=trial.codec == outcome.codec
+            )
+            for trial in trials
+        ])
+    return compression_result
+
+
+def compress_multiple_files(file_records, progress=None, mode=engine.ARCHIVE_AUTO):
+    """
+    Compress multiple files, either solid (zip first, then one LZMA stream) or
+    in parallel (one LZMA stream per file); mode 'auto' lets the engine choose.
+    """
+    members = [(f.file_path, f.original_filename) for f in file_records]
+    with accounting.measure() as meter:
+        outcome = engine.compress_many(
+            members, storage.artifact_dir(file_records[0].user_id), progress=progress, mode=mode,
+            workers=settings.COMPRESSION_WORKERS
+        )
+    with _recording(outcome, file_records):
+        compression_result = _record_multiple_result(file_records, outcome, meter.usage)
     return compression_result
 
 
@@ -212,8 +427,11 @@ def compress_multiple_files(file_records):
 def compression_results(request, result_id):
     """Display compression results"""
     try:
-        result = CompressionResult.objects.get(id=result_id, file__user=request.user)
-        return render(request, 'compression/results.html', {'result': result})
+        result = CompressionResult.objects.select_related('file').get(id=result_id, file__user=request.user)
+        codec_trials = list(result.codec_trials.all())
+        for trial in codec_trials:
+            trial.result = result  # Their ratios and throughput read the original size
+        return render(request, 'compression/results.html', {'result': result, 'codec_trials': codec_trials})
     except CompressionResult.DoesNotExist:
         raise Http404("Compression result not found")
 
@@ -245,85 +463,203 @@ def all_results(request):
     return render(request, 'compression/all_results.html', context)
 
 @login_required
-def download_compressed_file(request, file_id):
-    """Handle download of compressed files"""
+def export_results(request):
+    """Stream the user's whole compression history as CSV or JSON: ?format=csv|json"""
+    export_format = request.GET.get('format', export.FORMAT_CSV)
+    if export_format not in export.FORMATS:
+        return JsonResponse({'status': 'error', 'message': f"Unknown export format '{export_format}'"}, status=400)
+    return export.export_response(request, CompressionResult.objects.filter(file__user=request.user), export_format)
+
+
+def _claim_download(result_id):
+    """
+    Mark a result as downloaded if nobody has yet, in one conditional UPDATE.
+    Return whether this call claimed it: of concurrent requests only one does.
+    """
+    return CompressionResult.objects.filter(pk=result_id, downloaded=False).update(
+        downloaded=True, downloaded_at=timezone.now()
+    ) == 1
+
+
+def _release_download(result_id):
+    """Give a claimed download back after a transfer that did not complete"""
+    CompressionResult.objects.filter(pk=result_id).update(downloaded=False, downloaded_at=None)
+
+
+def _remove_downloaded(result_id):
+    """Delete a downloaded artifact, unless later versions of the file still need it (versions.release_artifact())"""
     try:
-        file_record = File.objects.get(id=file_id, user=request.user)
-        compression_result = CompressionResult.objects.get(file=file_record)
-
-        # Check if file has already been downloaded
-        if compression_result.downloaded:
-            messages.warning(
-                request,
-                f'This file was already downloaded on {compression_result.downloaded_at.strftime("%B %d, %Y at %I:%M %p")}. '
-                'The files have been deleted from our servers for your security and privacy.'
-            )
-            return redirect('dashboard')
+        versions.release_artifact(result_id)
+    except OSError as e:
+        print(f"Error deleting compressed file: {e}")
 
-        compressed_path = os.path.join(
-            settings.MEDIA_ROOT,
-            'compressed',
-            str(request.user.id),
-            compression_result.compressed_filename
-        )
 
-        if not os.path.exists(compressed_path):
-            # Mark as downloaded to prevent future download attempts
-            compression_result.downloaded = True
-            compression_result.downloaded_at = timezone.now()
-            compression_result.save()
+def _iter_download(path, result_id, chunks=None):
+    """
+    Yield an artifact in chunks, or the given ones; delete it once fully sent,
+    or release the claim if the transfer broke off (WSGI)
+    """
+    completed = False
+    try:
+        yield from engine.iter_file(path) if chunks is None else chunks
+        completed = True
+    finally:
+        if completed:
+            _remove_downloaded(result_id)
+        else:
+            _release_download(result_id)
 
-            messages.error(
-                request,
-                "Compressed file not found on server. The file may have been deleted or moved. "
-            )
-            return redirect('all_results')
 
-        # Read file content before deletion
-        with open(compressed_path, 'rb') as f:
-            file_content = f.read()
+async def _aiter_download(path, result_id, chunks=None):
+    """Async variant of _iter_download(), the chunks are read on the I/O pool (ASGI)"""
+    completed = False
+    try:
+        async for chunk in aiter_in_executor(engine.iter_file(path) if chunks is None else chunks):
+            yield chunk
+        completed = True
+    finally:
+        if completed:
+            await sync_to_async(_remove_downloaded)(result_id)
+        else:
+            await sync_to_async(_release_download)(result_id)
 
-        # Mark as downloaded
-        compression_result.downloaded = True
-        compression_result.downloaded_at = timezone.now()
-        compression_result.save()
 
-        # Delete the compressed file after reading
-        try:
-            os.remove(compressed_path)
-        except OSError as e:
-            print(f"Error deleting compressed file: {e}")
+async def _already_downloaded(request, compression_result):
+    kept = await run_io(lambda: compression_result.is_kept_after_download)
+    messages.warning(
+        request,
+        f'This file was already downloaded on {compression_result.downloaded_at.strftime("%B %d, %Y at %I:%M %p")}. '
+        + (KEPT_MESSAGE if kept else DELETED_MESSAGE)
+    )
+    return redirect('dashboard')
 
-        # Return the file for download
-        response = HttpResponse(file_content, content_type='application/octet-stream')
-        response['Content-Disposition'] = f'attachment; filename="{compression_result.compressed_filename}"'
-        return response
 
+@login_required
+async def download_compressed_file(request, file_id):
+    """Handle download of compressed files"""
+    user = await request.auser()
+    try:
+        file_record = await File.objects.aget(id=file_id, user=user)
+        compression_result = await CompressionResult.objects.select_related('file').aget(file=file_record)
     except (File.DoesNotExist, CompressionResult.DoesNotExist):
         messages.error(request, "File not found.")
         return redirect('dashboard')
 
+    # Check if file has already been downloaded
+    if compression_result.downloaded:
+        return await _already_downloaded(request, compression_result)
+
+    if compression_result.is_corrupt:
+        messages.error(request, "This compressed file failed its integrity check and cannot be downloaded.")
+        return redirect('all_results')
+
+    # Only one of concurrent requests (retries, download managers) gets the file
+    if not await sync_to_async(_claim_download)(compression_result.id):
+        await compression_result.arefresh_from_db(fields=['downloaded', 'downloaded_at'])
+        return await _already_downloaded(request, compression_result)
+
+    compressed_path = compression_result.artifact_path
+
+    if not await sync_to_async(versions.artifacts_exist)(compression_result):
+        # Left marked as downloaded to prevent future download attempts
+        messages.error(
+            request,
+            "Compressed file not found on server. The file may have been deleted or moved. "
+        )
+        return redirect('all_results')
+
+    return await _artifact_response(request, compression_result, compressed_path)
+
+
+async def _artifact_response(request, compression_result, compressed_path):
+    """
+    Stream the artifact of a result claimed with _claim_download(), or the
+    file a delta or chunk manifest stands for, rebuilt, or the original a
+    preconditioned artifact holds, decoded. It is deleted once
+    completely sent; if the transfer breaks off, the claim is released so the
+    download can be retried.
+    """
+    if compression_result.is_delta:
+        chunks = versions.iter_rebuilt(compression_result)
+    elif compression_result.is_deduplicated:
+        chunks = dedup.iter_rebuilt(compression_result)
+    elif compression_result.preconditioner:
+        chunks = versions.iter_compressed(compression_result, preconditioners.iter_decoded_file(compressed_path))
+    else:
+        chunks = None
+    if isinstance(request, ASGIRequest):
+        # A slow client only holds a coroutine, not a thread
+        content = _aiter_download(compressed_path, compression_result.id, chunks)
+    else:
+        content = _iter_download(compressed_path, compression_result.id, chunks)
+    response = StreamingHttpResponse(content, content_type='application/octet-stream')
+    if chunks is None:  # A rebuilt or decoded file's size is only known once it has been compressed
+        response['Content-Length'] = str(await run_io(os.path.getsize, compressed_path))
+    response['Content-Disposition'] = f'attachment; filename="{compression_result.download_filename}"'
+    return response
+
 
 @login_required
-def compression_progress(request, file_id):
-    """API endpoint to check compression progress"""
-    # This is a simple implementation - in production you might want to use Celery
-    # or another task queue for background processing
+async def compression_progress(request, job_id):
+    """API endpoint to check compression progress, the polling fallback for compression_events"""
+    user = await request.auser()
     try:
-        file_record = File.objects.get(id=file_id, user=request.user)
-        compression_result = CompressionResult.objects.filter(file=file_record).first()
-
-        if compression_result:
-            return JsonResponse({
-                'status': 'completed',
-                'progress': 100,
-                'redirect_url': reverse('compression_results', kwargs={'result_id': compression_result.id})
-            })
-        else:
-            return JsonResponse({
-                'status': 'processing',
-                'progress': 50  # Simple progress indication
-            })
+        job = await CompressionJob.objects.aget(id=job_id, user=user)
+    except CompressionJob.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+
+    return JsonResponse(job.to_event())
+
+
+def _job_event(job_id):
+    return CompressionJob.objects.get(id=job_id).to_event()
+
+
+def _sse(event):
+    return f"event: {event['status']}\ndata: {json.dumps(event)}\n\n"
+
+
+def _iter_job_events(job_id):
+    """Yield a job's events as SSE messages until it finishes (WSGI)"""
+    with events.subscribe(job_id) as subscription:
+        # Subscribe before reading the row so no transition falls in between
+        event = _job_event(job_id)
+        while True:
+            yield _sse(event)
+            if event['status'] in CompressionJob.FINISHED_STATUSES:
+                return
+            # Silence means the job may be running in another process, re-read its row.
+            # This doubles as the keep-alive for proxies.
+            event = subscription.get(SSE_REFRESH_SECONDS) or _job_event(job_id)
+
+
+async def _aiter_job_events(job_id):
+    """Yield a job's events as SSE messages until it finishes (ASGI)"""
+    with events.subscribe(job_id, asyncio.get_running_loop()) as subscription:
+        event = await sync_to_async(_job_event)(job_id)
+        while True:
+            yield _sse(event)
+            if event['status'] in CompressionJob.FINISHED_STATUSES:
+                return
+            event = (
+                await subscription.aget(SSE_REFRESH_SECONDS)
+                or await sync_to_async(_job_event)(job_id)
+            )
+
 
-    except File.DoesNotExist:
-        return JsonResponse({'status': 'error', 'message': 'File not found'}, status=404)
+@login_required
+async def compression_events(request, job_id):
+    """Server-Sent Events stream of a job's state transitions and progress ticks"""
+    user = await request.auser()
+    if not await CompressionJob.objects.filter(id=job_id, user=user).aexists():
+        return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+
+    if isinstance(request, ASGIRequest):
+        # One coroutine per open tab, no thread held while waiting for ticks
+        stream = _aiter_job_events(job_id)
+    else:
+        stream = _iter_job_events(job_id)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
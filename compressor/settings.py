@@ -37,6 +37,39 @@ DEBUG = True
 ALLOWED_HOSTS = []
 
 # Authentication settings
+# Email and password sign-in with one indexed lookup; usernames (the admin) go through CachedModelBackend.
+# Both load the user of authenticated requests from the cache. Sessions made with Django's
+# ModelBackend before it was replaced are moved over by users migration 0003.
+AUTHENTICATION_BACKENDS = [
+    'users.auth_backends.EmailBackend',
+    'users.auth_backends.CachedModelBackend',
+]
+# Seconds a user stays cached between requests; saves and deletes invalidate it at once
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+# Web server processes; uvicorn and gunicorn take their worker count from it too. Invalidations
+# only reach the process they happen in, so with more than one, users are not cached at all.
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+
+# Sessions are read from the cache and written through to the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Local memory by default, which is per process. Set DJANGO_CACHE_DIR to share a
+# file-based cache between processes, so invalidations reach every worker. Users
+# are only cached in local memory, as a cached user carries its password hash.
+if os.getenv('DJANGO_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('DJANGO_CACHE_DIR'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 
@@ -49,6 +82,8 @@ EMAIL_BACKEND = 'users.email_backend.InMemoryEmailBackend'  # Custom backend for
 # EMAIL_USE_TLS = True
 # EMAIL_HOST_USER = 'your-email@gmail.com'
 # EMAIL_HOST_PASSWORD = 'your-app-specific-password'
+# Store demo emails inside send_messages() instead of on the background sender (tests)
+EMAIL_QUEUE_EAGER = False
 
 
 # Application definition
@@ -93,6 +128,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'compressor.wsgi.application'
+ASGI_APPLICATION = 'compressor.asgi.application'
 
 
 # Database
@@ -133,6 +169,10 @@ if PYTHONANYWHERE_DOMAIN:
                 # Set session sql_mode to include strict mode — prevents silent truncation
                 'init_command': "SET SESSION sql_mode='STRICT_TRANS_TABLES'",
             },
+            # Keep connections across requests. Stay under the server's wait_timeout
+            # (300 s on PythonAnywhere), the health check catches any it drops anyway.
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 240)),
+            'CONN_HEALTH_CHECKS': True,
         }
     }
 else:
@@ -141,6 +181,19 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # On disk rather than in memory, so tests running requests on several
+            # threads get SQLite's ordinary locking instead of shared-cache errors
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+            'OPTIONS': {
+                # WAL lets requests read while compression jobs write; NORMAL sync is durable enough with WAL
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+                'timeout': 20,  # Seconds a writer waits for the lock instead of failing with "database is locked"
+                # Take the write lock when a transaction starts, so two transactions never
+                # deadlock upgrading from read to write (which no busy timeout can wait out)
+                'transaction_mode': 'IMMEDIATE',
+            },
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
         }
     }
 
@@ -190,9 +243,34 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 # File upload settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
+# Larger files are spooled to disk as they arrive and renamed into the upload area (compression.uploads)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024  # 1MB
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'compression.uploads.SpoolingUploadHandler',
+]
 DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024   # 50MB
 
+# Compression worker pools used by the async views
+# LZMA releases the GIL, so one thread per core keeps every core busy
+COMPRESSION_WORKERS = int(os.getenv('COMPRESSION_WORKERS', os.cpu_count() or 1))
+# Threads for blocking disk reads/writes (uploads, downloads)
+COMPRESSION_IO_WORKERS = int(os.getenv('COMPRESSION_IO_WORKERS', 16))
+# Run compression jobs inside the upload request instead of on the pool (tests, debugging)
+COMPRESSION_JOBS_EAGER = False
+# Directory whose files API clients may compress by path; unset disables server-side paths
+COMPRESSION_API_ALLOWED_ROOT = os.getenv('COMPRESSION_API_ALLOWED_ROOT') or None
+# Round-trip every new result in the background once no compression job is queued or running
+COMPRESSION_VERIFY = os.getenv('COMPRESSION_VERIFY') == '1'
+# Re-encode artifacts left undownloaded this many seconds at preset 9 extreme while compression is idle
+COMPRESSION_RECOMPRESS = os.getenv('COMPRESSION_RECOMPRESS') == '1'
+COMPRESSION_RECOMPRESS_AFTER = int(os.getenv('COMPRESSION_RECOMPRESS_AFTER', 24 * 60 * 60))
+# Store single-file uploads that share enough chunks with earlier ones as references to them (compression.dedup).
+# Off by default: every upload is then chunked and recorded, and deduplicated ones are rebuilt on download
+COMPRESSION_DEDUP = os.getenv('COMPRESSION_DEDUP') == '1'
+# Seconds the analytics summary of all results is cached before it is recomputed
+COMPRESSION_ANALYTICS_TTL = int(os.getenv('COMPRESSION_ANALYTICS_TTL', 300))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,3 +1,19 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import APIToken
+
+
+@admin.register(APIToken)
+class APITokenAdmin(admin.ModelAdmin):
+    list_display = ('key_prefix', 'name', 'user', 'created_at', 'last_used_at')
+    list_filter = ('created_at',)
+    search_fields = ('name', 'key_prefix', 'user__username')
+    readonly_fields = ('user', 'key_prefix', 'key_hash', 'created_at', 'last_used_at')
+
+    def has_add_permission(self, request):
+        # Keys are only shown once, so tokens are issued with `manage.py create_api_token`
+        return False
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        return qs.select_related('user')
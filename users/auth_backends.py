@@ -0,0 +1,107 @@
+"""
+Email sign-in with a single indexed lookup.
+
+Emails are stored trimmed and lowercased (normalize_email(), applied on
+every User save and by migration 0002 to existing rows), and auth_user.email
+carries an index, so login, the signup uniqueness check and password reset
+all find a user with one exact match on that index instead of a scan or a
+case-insensitive comparison.
+
+Both backends also load the user of an authenticated request from the
+cache (for USER_CACHE_TTL seconds) instead of the database. Saving or
+deleting a User drops its cache entry (users.models), so a password or
+is_active change applies to the next request. A cached User carries its
+password hash, so users are only cached when the cache is in process memory,
+never when it is shared through files (DJANGO_CACHE_DIR). That drop only
+reaches the process the change was made in, so users are not cached either
+when WEB_CONCURRENCY says the server runs more than one.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+EMAIL_INDEX = 'users_auth_user_email_idx'  # On auth_user.email, created by migration 0002
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def users_with_email(email):
+    """Queryset of the users with this email, matched exactly on the normalized, indexed column"""
+    return User.objects.filter(email=normalize_email(email))
+
+
+def email_in_use(email):
+    return users_with_email(email).exists()
+
+
+def user_cache_key(user_id):
+    return f'users:user:{user_id}'
+
+
+def caches_users():
+    """
+    Whether users (with their password hash) are cached: only in a
+    process-memory cache, and only when that process is the only server one
+    """
+    return settings.WEB_CONCURRENCY <= 1 and isinstance(caches['default'], LocMemCache)
+
+
+def forget_user(user_id):
+    """Drop a user's cache entry, so the next request reloads it"""
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedUserMixin:
+    """Load the user of each authenticated request from the cache, hitting the database once per USER_CACHE_TTL"""
+
+    def get_user(self, user_id):
+        if not caches_users():
+            return super().get_user(user_id)
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = User._default_manager.get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            cache.set(key, user, settings.USER_CACHE_TTL)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        # ModelBackend.aget_user() queries directly rather than through get_user()
+        if not caches_users():
+            return await super().aget_user(user_id)
+        key = user_cache_key(user_id)
+        user = await cache.aget(key)
+        if user is None:
+            try:
+                user = await User._default_manager.aget(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            await cache.aset(key, user, settings.USER_CACHE_TTL)
+        return user if self.user_can_authenticate(user) else None
+
+
+class CachedModelBackend(CachedUserMixin, ModelBackend):
+    """ModelBackend (username sign-in, the admin) with cached user loading"""
+
+
+class EmailBackend(CachedUserMixin, ModelBackend):
+    """Authenticate with email and password; username sign-in (the admin) is left to CachedModelBackend"""
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if not email or password is None:
+            return None
+        # Oldest account first should legacy rows share an address
+        user = users_with_email(email).order_by('pk').first()
+        if user is None:
+            # Hash anyway, so unknown addresses take as long as wrong passwords
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -1,51 +1,147 @@
 """
 Custom email backend that stores emails in memory for display on a web page.
 This is for development/demo purposes only.
+
+send_messages() only queues the messages, so a burst of password reset
+requests never waits on delivery. A background sender thread takes them off
+the queue in batches, looks up every recipient of a batch in one query and
+keeps the emails of existing users in a bounded store. A batch that fails
+is retried with backoff before it is dropped.
 """
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.mail import EmailMultiAlternatives
 from django.core.mail.backends.base import BaseEmailBackend
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+MAIL_QUEUE_SIZE = 1000  # Messages waiting for the sender, further ones are dropped
+MAIL_BATCH_SIZE = 100  # Most messages delivered (and recipient lookups) per query
+MAIL_BATCH_WAIT = 0.05  # Seconds the sender waits for more messages to fill a batch
+MAIL_STORE_SIZE = 50  # Most recent emails kept for display
+MAIL_RETRIES = 3
+MAIL_RETRY_DELAY = 0.5  # Seconds before the first retry, doubled for each one after
+
+
+def _as_dict(message):
+    return {
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email,
+        'to': message.to,
+        'date': message.extra_headers.get('Date', 'Now'),
+    }
 
 
 class InMemoryEmailBackend(BaseEmailBackend):
     """
-    Email backend that stores emails in a class variable for display.
-    Only keeps the most recent email.
+    Email backend that stores emails in class variables for display.
+    Keeps the latest email and the MAIL_STORE_SIZE most recent ones.
     Only stores emails if the recipient exists in the database.
     """
     latest_email = None
+    emails = deque(maxlen=MAIL_STORE_SIZE)  # Oldest first
+    _queue = queue.Queue(maxsize=MAIL_QUEUE_SIZE)
+    _sender = None
+    _sender_lock = threading.Lock()
+    _store_lock = threading.Lock()
 
     def send_messages(self, email_messages):
         """
-        Store the email messages in memory instead of sending them.
-        Only stores if the recipient email exists in the User database.
+        Queue the email messages for the sender thread, or store them at once
+        with EMAIL_QUEUE_EAGER. Returns how many were accepted.
         """
         if not email_messages:
             return 0
+        if settings.EMAIL_QUEUE_EAGER:
+            self.deliver(email_messages)
+            return len(email_messages)
 
-        # Store only the latest email, and only if the user exists
+        self._start_sender()
+        accepted = 0
         for message in email_messages:
-            # Check if any of the recipients exist in the database
-            user_exists = False
-            for recipient in message.to:
-                if User.objects.filter(email=recipient).exists():
-                    user_exists = True
-                    break
-
-            # Only store the email if the user exists
-            if user_exists:
-                InMemoryEmailBackend.latest_email = {
-                    'subject': message.subject,
-                    'body': message.body,
-                    'from_email': message.from_email,
-                    'to': message.to,
-                    'date': message.extra_headers.get('Date', 'Now'),
-                }
-            else:
-                # Clear any existing email if the user doesn't exist
-                InMemoryEmailBackend.latest_email = None
-
-        return len(email_messages)
+            try:
+                self._queue.put_nowait(message)
+                accepted += 1
+            except queue.Full:
+                logger.warning("Mail queue full, dropped email to %s", ', '.join(message.to))
+        return accepted
+
+    @classmethod
+    def deliver(cls, email_messages):
+        """
+        Store a batch of messages, looking up all their recipients in one query.
+        A message to no existing user clears the latest email instead.
+        """
+        recipients = {recipient for message in email_messages for recipient in message.to}
+        existing = set(User.objects.filter(email__in=recipients).values_list('email', flat=True))
+        with cls._store_lock:
+            for message in email_messages:
+                if existing.intersection(message.to):
+                    email = _as_dict(message)
+                    cls.emails.append(email)
+                    cls.latest_email = email
+                else:
+                    cls.latest_email = None
+
+    @classmethod
+    def _start_sender(cls):
+        with cls._sender_lock:
+            if cls._sender is None or not cls._sender.is_alive():
+                cls._sender = threading.Thread(target=cls._run_sender, name='mail-sender', daemon=True)
+                cls._sender.start()
+
+    @classmethod
+    def _next_batch(cls):
+        """Block for a message, then take whatever else arrives within MAIL_BATCH_WAIT"""
+        batch = [cls._queue.get()]
+        deadline = time.monotonic() + MAIL_BATCH_WAIT
+        while len(batch) < MAIL_BATCH_SIZE:
+            try:
+                batch.append(cls._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    @classmethod
+    def _run_sender(cls):
+        while True:
+            batch = cls._next_batch()
+            try:
+                cls._deliver_with_retry(batch)
+            finally:
+                for _ in batch:
+                    cls._queue.task_done()
+
+    @classmethod
+    def _deliver_with_retry(cls, batch):
+        for attempt in range(MAIL_RETRIES + 1):
+            close_old_connections()
+            try:
+                cls.deliver(batch)
+                return True
+            except Exception:
+                if attempt == MAIL_RETRIES:
+                    logger.exception("Dropped %d emails after %d attempts", len(batch), attempt + 1)
+                    return False
+                time.sleep(MAIL_RETRY_DELAY * 2 ** attempt)
+            finally:
+                close_old_connections()
+
+    @classmethod
+    def flush(cls, timeout=None):
+        """
+        Wait until every queued message has been delivered or dropped.
+        Returns False if some were still queued after timeout seconds.
+        """
+        with cls._queue.all_tasks_done:
+            return cls._queue.all_tasks_done.wait_for(lambda: not cls._queue.unfinished_tasks, timeout)
 
     @classmethod
     def get_latest_email(cls):
@@ -57,6 +153,8 @@ class InMemoryEmailBackend(BaseEmailBackend):
     @classmethod
     def clear_email(cls):
         """
-        Clear the stored email.
+        Clear the stored emails.
         """
-        cls.latest_email = None
+        with cls._store_lock:
+            cls.latest_email = None
+            cls.emails.clear()
@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import APIToken
+
+
+class Command(BaseCommand):
+    help = "Issue an API token for the compression REST API"
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help="Email of the user the token acts as")
+        parser.add_argument('--name', default='', help="What the token is for, e.g. the pipeline name")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user with email {options['email']}")
+
+        token, key = APIToken.create_token(user, name=options['name'])
+        self.stdout.write(self.style.SUCCESS(f"Created token {token.key_prefix}... for {user.email}"))
+        self.stdout.write("Store this key now, it cannot be shown again:")
+        self.stdout.write(key)
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models.functions import Lower, Trim
+
+EMAIL_INDEX = 'users_auth_user_email_idx'  # users.auth_backends.EMAIL_INDEX at the time of writing
+
+
+def normalize_emails(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    User.objects.exclude(email='').update(email=Lower(Trim('email')))
+
+
+def add_email_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model('auth', 'User'), models.Index(fields=['email'], name=EMAIL_INDEX))
+
+
+def remove_email_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model('auth', 'User'), models.Index(fields=['email'], name=EMAIL_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_emails, migrations.RunPython.noop),
+        # auth_user belongs to django.contrib.auth, so the index is added through the schema editor
+        migrations.RunPython(add_email_index, remove_email_index),
+    ]
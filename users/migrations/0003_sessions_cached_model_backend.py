@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.sessions.backends.cached_db import KEY_PREFIX
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import caches
+from django.db import migrations
+from django.utils import timezone
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+CACHED_MODEL_BACKEND = 'users.auth_backends.CachedModelBackend'
+
+
+def _move_sessions(apps, old_backend, new_backend):
+    # A session is only valid while the backend it names is in AUTHENTICATION_BACKENDS
+    Session = apps.get_model('sessions', 'Session')
+    store = SessionStore()
+    for session in Session.objects.filter(expire_date__gt=timezone.now()).iterator():
+        data = store.decode(session.session_data)
+        if data.get(BACKEND_SESSION_KEY) != old_backend:
+            continue
+        data[BACKEND_SESSION_KEY] = new_backend
+        session.session_data = store.encode(data)
+        session.save(update_fields=['session_data'])
+        # The file-based cache outlives the deploy, drop its copy so the next read takes this one
+        caches[settings.SESSION_CACHE_ALIAS].delete(KEY_PREFIX + session.session_key)
+
+
+def to_cached_model_backend(apps, schema_editor):
+    _move_sessions(apps, MODEL_BACKEND, CACHED_MODEL_BACKEND)
+
+
+def to_model_backend(apps, schema_editor):
+    _move_sessions(apps, CACHED_MODEL_BACKEND, MODEL_BACKEND)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sessions', '0001_initial'),
+        ('users', '0002_normalized_email_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_cached_model_backend, to_model_backend),
+    ]
@@ -1,3 +1,74 @@
+import hashlib
+import secrets
+from datetime import timedelta
+
+from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .auth_backends import forget_user, normalize_email
+
+
+class APIToken(models.Model):
+    """
+    Credential for the compression REST API.
+    Only a SHA-256 digest of the key is stored; the key itself is shown once.
+    """
+    # Don't write last_used_at more than once a minute per token
+    LAST_USED_RESOLUTION = timedelta(minutes=1)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100, blank=True)  # What the token is for, e.g. the pipeline name
+    key_prefix = models.CharField(max_length=8)  # First characters of the key, to tell tokens apart
+    key_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.key_prefix}... ({self.name or 'unnamed'}) - {self.user.username}"
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def create_token(cls, user, name=''):
+        """Create a token for user, return (token, key)"""
+        key = secrets.token_urlsafe(32)
+        token = cls.objects.create(user=user, name=name, key_prefix=key[:8], key_hash=cls.hash_key(key))
+        return token, key
+
+    @classmethod
+    def authenticate(cls, authorization):
+        """Return the token for an 'Authorization: Token <key>' header value, or None"""
+        keyword, _, key = (authorization or '').partition(' ')
+        if keyword.lower() not in ('token', 'bearer') or not key.strip():
+            return None
+
+        try:
+            token = cls.objects.select_related('user').get(key_hash=cls.hash_key(key.strip()))
+        except cls.DoesNotExist:
+            return None
+        if not token.user.is_active:
+            return None
+
+        now = timezone.now()
+        if token.last_used_at is None or now - token.last_used_at > cls.LAST_USED_RESOLUTION:
+            cls.objects.filter(pk=token.pk).update(last_used_at=now)
+            token.last_used_at = now
+        return token
+
+
+@receiver(pre_save, sender=User)
+def normalize_user_email(sender, instance, **kwargs):
+    """Store every email normalized, so email lookups are exact matches on the indexed column"""
+    instance.email = normalize_email(instance.email)
+
 
-# Create your models here.
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    """Drop the cached copy of a changed user, see users.auth_backends.CachedUserMixin"""
+    forget_user(instance.pk)
@@ -1,8 +1,29 @@
+import os
+import shutil
+import tempfile
+import time
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.auth import BACKEND_SESSION_KEY
 from django.contrib.auth.models import User
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from .views import CustomUserCreationForm, EmailAuthenticationForm
+from compression.models import CompressionJob
+
+from . import email_backend
+from .auth_backends import EMAIL_INDEX, user_cache_key
+from .email_backend import InMemoryEmailBackend
+from .models import APIToken
+from .views import CustomUserCreationForm, EmailAuthenticationForm, EmailPasswordResetForm
 
 
 class CustomUserCreationFormTests(TestCase):
@@ -143,6 +164,143 @@ class EmailAuthenticationFormTests(TestCase):
         self.assertIn('password', form.errors)
 
 
+class EmailBackendTests(TestCase):
+    """Tests for the single-query email authentication backend"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='Student@Example.com',
+            email='  Student@Example.COM ',
+            password='testpass123'
+        )
+
+    def test_email_stored_normalized(self):
+        """Test that emails are saved trimmed and lowercased"""
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'student@example.com')
+
+    def test_login_is_one_indexed_query(self):
+        """Test that a login attempt looks the user up once, whatever the case of the address"""
+        for email, password, valid in [
+            ('STUDENT@example.com', 'testpass123', True),
+            ('student@example.com', 'wrong', False),
+            ('unknown@example.com', 'testpass123', False),
+        ]:
+            with self.assertNumQueries(1):
+                form = EmailAuthenticationForm(data={'email': email, 'password': password})
+                self.assertEqual(form.is_valid(), valid)
+        self.assertEqual(form.get_user(), None)
+        self.assertEqual(EmailAuthenticationForm(data={
+            'email': 'Student@Example.com', 'password': 'testpass123'
+        }).get_user(), None)  # Not validated yet
+
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, User._meta.db_table)
+        self.assertEqual(indexes[EMAIL_INDEX]['columns'], ['email'])
+
+    def test_signup_and_reset_use_normalized_email(self):
+        """Test that signup rejects a differently-cased duplicate and reset finds the user"""
+        form = CustomUserCreationForm(data={
+            'email': 'STUDENT@EXAMPLE.COM', 'password1': 'complexpass123', 'password2': 'complexpass123'
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('already exists', str(form.errors['email']))
+
+        with self.assertNumQueries(1):
+            users = list(EmailPasswordResetForm().get_users('Student@EXAMPLE.com'))
+        self.assertEqual(users, [self.user])
+
+    def test_admin_username_login_still_works(self):
+        """Test that username sign-in falls through to CachedModelBackend, hashing a failed one once"""
+        self.assertTrue(self.client.login(username='Student@Example.com', password='testpass123'))
+        with mock.patch.object(User, 'set_password', autospec=True) as set_password:
+            self.assertFalse(self.client.login(username='nobody', password='testpass123'))
+        self.assertEqual(set_password.call_count, 1)
+
+
+class CachedSessionTests(TestCase):
+    """Tests for cached sessions and users on authenticated requests"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='poller@example.com', email='poller@example.com', password='testpass123'
+        )
+        self.job = CompressionJob.objects.create(user=self.user)
+        self.progress_url = reverse('compression_progress', kwargs={'job_id': self.job.id})
+
+    def _queries_per_poll(self):
+        client = Client()
+        client.login(username='poller@example.com', password='testpass123')
+        client.get(self.progress_url)  # Fills the caches
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.get(self.progress_url).status_code, 200)
+        return len(queries)
+
+    def test_polling_skips_session_and_user_queries(self):
+        """Test that a progress poll only runs the view's own query"""
+        with self.settings(
+            SESSION_ENGINE='django.contrib.sessions.backends.db',
+            AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.ModelBackend'],
+        ):
+            uncached = self._queries_per_poll()
+        cached = self._queries_per_poll()
+        self.assertEqual(uncached, 3)  # Session, user, job
+        self.assertEqual(cached, 1)  # Job
+
+    def test_user_changes_invalidate_cache(self):
+        """Test that deactivating a user or changing their password applies to the next request"""
+        self.client.login(username='poller@example.com', password='testpass123')
+        self.assertEqual(self.client.get(self.progress_url).status_code, 200)
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.id)))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+        self.assertEqual(self.client.get(self.progress_url).status_code, 302)
+
+        self.user.is_active = True
+        self.user.save()
+        self.client.login(username='poller@example.com', password='testpass123')
+        self.assertEqual(self.client.get(self.progress_url).status_code, 200)
+        self.user.set_password('newpass456')
+        self.user.save()
+        self.assertEqual(self.client.get(self.progress_url).status_code, 302)
+
+    def test_several_workers_skip_user_cache(self):
+        """Test that with more than one server process a deactivation applies at once, wherever it was made"""
+        self.client.login(username='poller@example.com', password='testpass123')
+        with self.settings(WEB_CONCURRENCY=2):
+            self.assertEqual(self.client.get(self.progress_url).status_code, 200)
+            self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+            # As if deactivated in another process, whose invalidation doesn't reach this one's cache
+            User.objects.filter(id=self.user.id).update(is_active=False)
+            self.assertEqual(self.client.get(self.progress_url).status_code, 302)
+
+    def test_sessions_made_with_model_backend_stay_valid(self):
+        """Test that sessions made before CachedModelBackend replaced ModelBackend are moved over to it"""
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.get(self.progress_url).status_code, 302)
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+
+        migration = import_module('users.migrations.0003_sessions_cached_model_backend')
+        migration.to_cached_model_backend(apps, None)
+        self.assertEqual(self.client.get(self.progress_url).status_code, 200)
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY], migration.CACHED_MODEL_BACKEND)
+
+    def test_file_cache_never_holds_users(self):
+        """Test that with a file-based cache users are loaded from the database, keeping password hashes off disk"""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        file_cache = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir}}
+        with self.settings(CACHES=file_cache):
+            self.client.login(username='poller@example.com', password='testpass123')
+            self.assertEqual(self.client.get(self.progress_url).status_code, 200)
+            self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+            for name in os.listdir(cache_dir):
+                with open(os.path.join(cache_dir, name), 'rb') as f:
+                    self.assertNotIn(self.user.password.encode(), f.read())
+
+
 class SignupViewTests(TestCase):
     """Tests for the signup view"""
 
@@ -334,3 +492,115 @@ class PasswordResetTests(TestCase):
         # Should redirect to password reset done page
         self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, reverse('password_reset_done'))
+
+    @override_settings(EMAIL_BACKEND='users.email_backend.InMemoryEmailBackend', EMAIL_QUEUE_EAGER=True)
+    def test_reset_email_displayed_for_existing_users_only(self):
+        """Test that the demo page shows the reset email, and nothing for an unknown address"""
+        InMemoryEmailBackend.clear_email()
+        self.client.post(self.password_reset_url, {'email': 'testuser@example.com'})
+        response = self.client.get(reverse('view_reset_email'))
+        self.assertContains(response, 'testuser@example.com')
+        self.assertContains(response, '/reset/')
+
+        InMemoryEmailBackend().send_messages([EmailMessage('Reset', 'body', to=['nobody@example.com'])])
+        response = self.client.get(reverse('view_reset_email'))
+        self.assertContains(response, 'No email found')
+
+
+class MailQueueTests(TransactionTestCase):
+    """Tests for the queued in-memory email backend"""
+
+    def setUp(self):
+        User.objects.create_user(username='known@example.com', email='known@example.com', password='x')
+        InMemoryEmailBackend.clear_email()
+
+    def tearDown(self):
+        InMemoryEmailBackend.flush(timeout=5)
+        InMemoryEmailBackend.clear_email()
+
+    def _messages(self, count):
+        return [
+            EmailMessage(f'Message {index}', 'body', to=['known@example.com' if index % 2 else f'x{index}@example.com'])
+            for index in range(count)
+        ]
+
+    def test_batch_resolves_recipients_in_one_query(self):
+        """Test that a batch is stored with one recipient query and the store stays bounded"""
+        messages = self._messages(2 * email_backend.MAIL_STORE_SIZE + 2)
+        with self.assertNumQueries(1):
+            InMemoryEmailBackend.deliver(messages)
+        self.assertEqual(len(InMemoryEmailBackend.emails), email_backend.MAIL_STORE_SIZE)
+        self.assertTrue(all(email['to'] == ['known@example.com'] for email in InMemoryEmailBackend.emails))
+        self.assertEqual(InMemoryEmailBackend.get_latest_email()['subject'], messages[-1].subject)
+
+    def test_send_returns_before_delivery_and_retries(self):
+        """Test that sending only queues, and a failed delivery is retried by the sender thread"""
+        real_deliver = InMemoryEmailBackend.deliver.__func__
+        attempts = []
+
+        def flaky_deliver(cls, batch):
+            attempts.append(len(batch))
+            time.sleep(0.2)
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+            real_deliver(cls, batch)
+
+        with mock.patch.object(InMemoryEmailBackend, 'deliver', classmethod(flaky_deliver)), \
+                mock.patch.object(email_backend, 'MAIL_RETRY_DELAY', 0.01):
+            started = time.perf_counter()
+            self.assertEqual(InMemoryEmailBackend().send_messages(self._messages(20)), 20)
+            self.assertLess(time.perf_counter() - started, 0.2)
+            self.assertTrue(InMemoryEmailBackend.flush(timeout=10))
+
+        self.assertGreaterEqual(len(attempts), 2)
+        self.assertEqual(sum(attempts[1:]), 20)
+        self.assertEqual(len(InMemoryEmailBackend.emails), 10)
+
+
+class APITokenTests(TestCase):
+    """Tests for API token issuing and authentication"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='pipeline@example.com',
+            email='pipeline@example.com',
+            password='securepass123'
+        )
+
+    def test_key_is_stored_hashed(self):
+        """Test that only a digest of the key is stored"""
+        token, key = APIToken.create_token(self.user, name='ingest')
+        self.assertNotEqual(token.key_hash, key)
+        self.assertEqual(token.key_hash, APIToken.hash_key(key))
+        self.assertEqual(token.key_prefix, key[:8])
+
+    def test_authenticate_header(self):
+        """Test that a Token header resolves to its user and records use"""
+        token, key = APIToken.create_token(self.user)
+        authenticated = APIToken.authenticate(f'Token {key}')
+        self.assertEqual(authenticated, token)
+        self.assertEqual(authenticated.user, self.user)
+        token.refresh_from_db()
+        self.assertIsNotNone(token.last_used_at)
+
+    def test_authenticate_rejects_bad_headers(self):
+        """Test that missing, malformed and unknown keys are rejected"""
+        APIToken.create_token(self.user)
+        self.assertIsNone(APIToken.authenticate(None))
+        self.assertIsNone(APIToken.authenticate('Basic abc'))
+        self.assertIsNone(APIToken.authenticate('Token unknown-key'))
+
+    def test_inactive_user_token_rejected(self):
+        """Test that tokens of deactivated users stop working"""
+        _, key = APIToken.create_token(self.user)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(APIToken.authenticate(f'Token {key}'))
+
+    def test_create_api_token_command(self):
+        """Test that the management command issues a working token"""
+        out = StringIO()
+        call_command('create_api_token', 'pipeline@example.com', '--name', 'nightly', stdout=out)
+        key = out.getvalue().strip().splitlines()[-1]
+        self.assertEqual(APIToken.authenticate(f'Token {key}').name, 'nightly')
+
@@ -10,6 +10,7 @@ urlpatterns = [
     path('logout/', auth_views.LogoutView.as_view(next_page='login'), name='logout'),
     path('password-reset/',
          auth_views.PasswordResetView.as_view(
+             form_class=views.EmailPasswordResetForm,
              template_name='users/password_reset.html',
              email_template_name='users/password_reset_email.html',
              subject_template_name='users/password_reset_subject.txt'
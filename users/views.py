@@ -1,12 +1,16 @@
 from django import forms
 from django.contrib.auth import login, authenticate
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import PasswordResetForm, UserCreationForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.shortcuts import redirect, render
 
+from .auth_backends import email_in_use, normalize_email, users_with_email
 from .email_backend import InMemoryEmailBackend
 
+SIGNUP_AUTH_BACKEND = 'users.auth_backends.EmailBackend'  # Session backend of users logged in on signup
+RESET_EMAIL_WAIT = 2  # Seconds view_reset_email waits for queued emails
+
 
 class EmailAuthenticationForm(forms.Form):
     email = forms.EmailField(
@@ -33,23 +37,9 @@ class EmailAuthenticationForm(forms.Form):
         password = self.cleaned_data.get('password')
 
         if email and password:
-            # Find user by email
-            try:
-                user = User.objects.get(email=email)
-                # Authenticate using username (since Django auth uses username)
-                self.user_cache = authenticate(self.request, username=user.username, password=password)
-                if self.user_cache is None:
-                    raise ValidationError(
-                        self.error_messages['invalid_login'],
-                        code='invalid_login',
-                    )
-                else:
-                    if not self.user_cache.is_active:
-                        raise ValidationError(
-                            self.error_messages['inactive'],
-                            code='inactive',
-                        )
-            except User.DoesNotExist:
+            # One indexed lookup by email (users.auth_backends.EmailBackend), inactive users are refused there
+            self.user_cache = authenticate(self.request, email=email, password=password)
+            if self.user_cache is None:
                 raise ValidationError(
                     self.error_messages['invalid_login'],
                     code='invalid_login',
@@ -78,8 +68,8 @@ class CustomUserCreationForm(UserCreationForm):
         self.error_messages['password_mismatch'] = 'Passwords do not match. Please try again.'
 
     def clean_email(self):
-        email = self.cleaned_data.get('email')
-        if User.objects.filter(email=email).exists():
+        email = normalize_email(self.cleaned_data.get('email'))
+        if email_in_use(email):
             raise ValidationError('A user with this email already exists.')
         return email
 
@@ -93,6 +83,16 @@ class CustomUserCreationForm(UserCreationForm):
             user.save()
         return user
 
+class EmailPasswordResetForm(PasswordResetForm):
+    """Password reset finding users with the indexed email lookup instead of a case-insensitive scan"""
+
+    def get_users(self, email):
+        return (
+            user for user in users_with_email(email).filter(is_active=True)
+            if user.has_usable_password()
+        )
+
+
 def index(request):
     # Redirect authenticated users to dashboard
     if request.user.is_authenticated:
@@ -123,7 +123,7 @@ def signup(request):
         form = CustomUserCreationForm(request.POST)
         if form.is_valid():
             user = form.save()
-            login(request, user)
+            login(request, user, backend=SIGNUP_AUTH_BACKEND)
             return redirect("dashboard")
     else:
         form = CustomUserCreationForm()
@@ -135,6 +135,8 @@ def view_reset_email(request):
     Display the latest password reset email.
     This is for development/demo purposes only.
     """
+    # The reset request only queued the email, give the sender a moment to store it
+    InMemoryEmailBackend.flush(timeout=RESET_EMAIL_WAIT)
     email = InMemoryEmailBackend.get_latest_email()
     return render(request, 'users/view_reset_email.html', {'email': email})
 